@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+
+"""SdvxStatsAppのベンチマーク
+
+代表的なリクエスト (ワークロード) を、プロセス内でapplicationを直接呼び出す方法 (inprocess) と,
+ローカルのソケット越しにPooledWSGIServerへ送る方法 (socket) で繰り返し実行し,
+レイテンシのパーセンタイル (p50, p95, p99), 1秒あたりのリクエスト数, 最大常駐メモリ (RSS) を表示する.
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.bench
+    python -m benchmarks.bench --scale 10 --mode socket --concurrency 4
+"""
+
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from wsgiref.util import setup_testing_defaults
+
+from benchmarks.make_data import make_data
+from modules import SEARCH_BACKENDS
+from modules.server import PooledWSGIServer
+from sdvx_stats_app import SdvxStatsApp
+
+# ワークロード名 -> クエリ文字列 ({music_title}はデータ中の楽曲名に置き換える)
+WORKLOADS = {
+    "home": "",
+    "search_page": "submit=&format=1",
+    "search_all": "submit=&format=1&page_size=0",
+    "search_all_count": "submit=&format=0&page_size=0",
+    "level_difficulty": "submit=&format=1&level_filter=18&level_filter=19&difficulty=3",
+    "title_like_short": "submit=&format=1&music_title_filter=a",
+    "title_like": "submit=&format=1&music_title_filter=ing",
+    "percent": "submit=&format=1&level_filter=17",
+    "count": "submit=&format=0&level_filter=17",
+    "ss_music": "ss_music={music_title}",
+    "ss_score": (
+        "ss_music={music_title}&ss_difficulty=NOVICE%2CADVANCED%2CEXHAUST%2CMAXIMUM"
+        + "&ss_score=9800000&submit="
+    ),
+}
+MODES = ["inprocess", "socket"]
+
+
+def percentile(sorted_values, percent) -> float:
+    """
+    昇順に並べた値のパーセンタイルを求める (最近傍順位法)
+
+    Args:
+        sorted_values (list): 昇順に並べた値
+        percent (float): パーセント (0～100)
+
+    Returns:
+        float: パーセンタイル
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, -(-len(sorted_values) * percent // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def peak_rss_mb() -> float:
+    """
+    プロセスの最大常駐メモリを取得 (Linuxではru_maxrssの単位はKB, macOSではバイト)
+
+    Returns:
+        float: 最大常駐メモリ (MB)
+    """
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def first_music_title(app) -> str:
+    """
+    ss_musicのワークロードで使う楽曲名 (最も譜面の多い楽曲) を取得
+
+    Args:
+        app (SdvxStatsApp): アプリケーション
+
+    Returns:
+        str: 楽曲名
+    """
+    with app.pool.connection() as con:
+        row = con.execute(
+            "SELECT music_title FROM sdvx_stats GROUP BY music_title "
+            + "ORDER BY COUNT(*) DESC, music_title LIMIT 1"
+        ).fetchone()
+    return row[0]
+
+
+def call_inprocess(app, query) -> int:
+    """
+    applicationを直接呼び出し、レスポンスボディを最後まで読み込む
+
+    Args:
+        app (SdvxStatsApp): アプリケーション
+        query (str): クエリ文字列
+
+    Returns:
+        int: レスポンスボディのバイト数
+    """
+    environ = {"QUERY_STRING": query, "PATH_INFO": "/"}
+    setup_testing_defaults(environ)
+    result = app.application(environ, lambda status, headers: None)
+    try:
+        return sum(len(chunk) for chunk in result)
+    finally:
+        if hasattr(result, "close"):
+            result.close()
+
+
+def call_socket(connection, query) -> int:
+    """
+    ソケット越しにリクエストを送信し、レスポンスボディを最後まで読み込む (接続は使い回す)
+
+    Args:
+        connection (http.client.HTTPConnection): 接続
+        query (str): クエリ文字列
+
+    Returns:
+        int: レスポンスボディのバイト数
+    """
+    connection.request("GET", "/?" + query if query else "/")
+    response = connection.getresponse()
+    return len(response.read())
+
+
+def run_workload(app, query, mode, requests, concurrency, address=None) -> dict:
+    """
+    1つのワークロードをrequests回実行して計測する
+
+    Args:
+        app (SdvxStatsApp): アプリケーション
+        query (str): クエリ文字列
+        mode (str): "inprocess"または"socket"
+        requests (int): リクエスト数
+        concurrency (int): 同時に実行するクライアントの数
+        address (tuple, optional): socketの場合のサーバのアドレス
+
+    Returns:
+        dict: 計測結果
+    """
+    latencies = []
+    lock = threading.Lock()
+    sizes = []
+
+    def client(count):
+        connection = None
+        if mode == "socket":
+            connection = http.client.HTTPConnection(*address, timeout=120)
+        local = []
+        try:
+            for _ in range(count):
+                start = time.perf_counter()
+                if connection is None:
+                    size = call_inprocess(app, query)
+                else:
+                    size = call_socket(connection, query)
+                local.append(time.perf_counter() - start)
+        finally:
+            if connection is not None:
+                connection.close()
+        with lock:
+            latencies.extend(local)
+            sizes.append(size)
+
+    counts = [requests // concurrency] * concurrency
+    for index in range(requests % concurrency):
+        counts[index] += 1
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, [count for count in counts if count]))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "bytes": max(sizes) if sizes else 0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "rps": len(latencies) / elapsed if elapsed else 0.0,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+@contextlib.contextmanager
+def local_server(app, threads):
+    """
+    ローカルの空いているポートでPooledWSGIServerを起動する
+
+    Args:
+        app (SdvxStatsApp): アプリケーション
+        threads (int): ワーカースレッドの数
+
+    Yields:
+        tuple: サーバのアドレス (ホスト名, ポート番号)
+    """
+    server = PooledWSGIServer(
+        ("127.0.0.1", 0), app.application, threads=threads, quiet=True
+    )
+    server.start_workers()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server.server_address[:2]
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def run_benchmark(args) -> dict:
+    """
+    データベースを作成し、指定したワークロードをすべて計測する
+
+    Args:
+        args (argparse.Namespace): コマンドライン引数
+
+    Returns:
+        dict: ワークロード名 -> 計測結果
+    """
+    workdir = tempfile.mkdtemp(prefix="sdvx-bench-")
+    try:
+        csv_file = args.csv
+        if args.scale > 1:
+            csv_file = os.path.join(workdir, f"sdvx_stats_x{args.scale}.csv")
+            make_data(args.csv, csv_file, args.scale, args.seed)
+        # データベースを構築したときのメッセージなどの標準出力は計測の邪魔になるため捨てる
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            start = time.perf_counter()
+            app = SdvxStatsApp(
+                dbname=os.path.join(workdir, "sdvx_stats.db"),
+                csv_file=csv_file,
+                sync_interval=None,
+                pool_size=max(args.concurrency, 1),
+                cache_size=128 if args.cache else 0,
+                row_cache_bytes=32 * 1024 * 1024 if args.cache else 0,
+                backend=args.backend,
+                warm_up="sync",
+            )
+            startup = time.perf_counter() - start
+            music_title = quote(first_music_title(app))
+            results = {"startup": {"seconds": startup, "peak_rss_mb": peak_rss_mb()}}
+            server = (
+                local_server(app, args.concurrency)
+                if args.mode == "socket"
+                else contextlib.nullcontext()
+            )
+            with server as address:
+                for name in args.workloads:
+                    query = WORKLOADS[name].format(music_title=music_title)
+                    for _ in range(args.warmup):
+                        if address is None:
+                            call_inprocess(app, query)
+                        else:
+                            connection = http.client.HTTPConnection(*address)
+                            call_socket(connection, query)
+                            connection.close()
+                    results[name] = run_workload(
+                        app, query, args.mode, args.requests, args.concurrency, address
+                    )
+            app.pool.close()
+        return results
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def print_results(results) -> None:
+    """
+    計測結果を表形式で表示
+
+    Args:
+        results (dict): run_benchmarkの結果
+    """
+    startup = results["startup"]
+    print(f"起動時間: {startup['seconds']:.2f}s (RSS {startup['peak_rss_mb']:.1f}MB)")
+    print(
+        f"{'workload':<20}{'reqs':>6}{'bytes':>11}{'p50 ms':>10}{'p95 ms':>10}"
+        + f"{'p99 ms':>10}{'req/s':>10}{'RSS MB':>9}"
+    )
+    for name, result in results.items():
+        if name == "startup":
+            continue
+        print(
+            f"{name:<20}{result['requests']:>6}{result['bytes']:>11}"
+            + f"{result['p50_ms']:>10.2f}{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+            + f"{result['rps']:>10.1f}{result['peak_rss_mb']:>9.1f}"
+        )
+
+
+def parse_args(argv=None):
+    """
+    コマンドライン引数を解析
+
+    Args:
+        argv (list, optional): コマンドライン引数 (省略時はsys.argv)
+
+    Returns:
+        argparse.Namespace: 解析結果
+    """
+    parser = argparse.ArgumentParser(description="SdvxStatsAppのベンチマーク")
+    parser.add_argument(
+        "--mode", choices=MODES, default="inprocess", help="リクエストの送り方"
+    )
+    parser.add_argument(
+        "--workloads",
+        nargs="+",
+        choices=list(WORKLOADS),
+        default=list(WORKLOADS),
+        help="計測するワークロード",
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=50, help="ワークロードごとのリクエスト数"
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        type=int,
+        default=1,
+        help="同時に実行するクライアントの数",
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=2, help="計測前に実行するリクエスト数"
+    )
+    parser.add_argument(
+        "--csv", default="data/sdvx_stats.csv", help="データベースを作成するCSVファイル"
+    )
+    parser.add_argument(
+        "--scale",
+        type=int,
+        default=1,
+        help="CSVを何倍に拡大して計測するか (例: 10, 100)",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="合成データの乱数のシード")
+    parser.add_argument(
+        "--backend",
+        choices=SEARCH_BACKENDS,
+        default="sqlite",
+        help="検索のバックエンド",
+    )
+    parser.add_argument(
+        "--cache",
+        action="store_true",
+        help="検索結果・行のキャッシュを有効にする (デフォルトは無効にして毎回生成する)",
+    )
+    parser.add_argument("--json", help="計測結果をJSONで書き出すファイル名")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_benchmark(args)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, ensure_ascii=False, indent=2)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+
+"""ベンチマーク用の合成データ (sdvx_stats.csvを拡大したCSV) を生成する
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.make_data 10 -o data/sdvx_stats_x10.csv
+"""
+
+import argparse
+import csv
+import random
+
+from data import Column
+
+# 人数を表すカラム (拡大したデータでは譜面ごとに同じ倍率で増減させる)
+COUNT_COLUMNS = ["count"] + Column.clear_mark + Column.score_grade
+# スコアを表すカラム (拡大したデータでは少しずらす)
+SCORE_COLUMNS = ["avg_score"] + Column.skill_level + Column.vf_class
+MAX_SCORE = 10000000
+
+
+def _jitter_row(row, index, rng) -> dict:
+    """
+    譜面の行を元に、楽曲名と数値を変えた合成の行を作成
+
+    人数は譜面ごとに1つの倍率を掛けて切り捨てるため、クリアマーク・スコアグレードの大小関係は保たれる
+
+    Args:
+        row (dict): 元の行
+        index (int): 複製の番号 (楽曲名の末尾に付ける)
+        rng (random.Random): 乱数生成器
+
+    Returns:
+        dict: 合成した行
+    """
+    new_row = dict(row)
+    new_row["music_title"] = f"{row['music_title']} #{index}"
+    ratio = rng.uniform(0.5, 1.5)
+    for key in COUNT_COLUMNS:
+        new_row[key] = str(int(int(row[key]) * ratio))
+    for key in SCORE_COLUMNS:
+        score = int(row[key])
+        if score:
+            new_row[key] = str(
+                min(MAX_SCORE, max(0, score + rng.randint(-20000, 20000)))
+            )
+    new_row["sd_score"] = str(max(0, int(row["sd_score"]) + rng.randint(-5000, 5000)))
+    return new_row
+
+
+def generate_rows(rows, scale, seed=0):
+    """
+    元の行をscale倍に拡大した行を生成するジェネレータ (元の行はそのまま含める)
+
+    Args:
+        rows (list): 元の行 (dict) のリスト
+        scale (int): 倍率
+        seed (int, optional): 乱数のシード (同じシードなら同じデータになる)
+
+    Yields:
+        dict: 行
+    """
+    rng = random.Random(seed)
+    yield from rows
+    for index in range(1, scale):
+        for row in rows:
+            yield _jitter_row(row, index, rng)
+
+
+def make_data(input_file, output_file, scale, seed=0) -> int:
+    """
+    CSVファイルをscale倍に拡大したCSVファイルを作成
+
+    Args:
+        input_file (str): 元のCSVファイル名
+        output_file (str): 作成するCSVファイル名
+        scale (int): 倍率
+        seed (int, optional): 乱数のシード
+
+    Returns:
+        int: 作成したCSVファイルの行数 (ヘッダを除く)
+    """
+    with open(input_file, "r", encoding="utf-8-sig", newline="") as file:
+        reader = csv.DictReader(file)
+        fieldnames = reader.fieldnames
+        rows = list(reader)
+    row_count = 0
+    with open(output_file, "w", encoding="utf-8", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in generate_rows(rows, scale, seed):
+            writer.writerow(row)
+            row_count += 1
+    return row_count
+
+
+def parse_args(argv=None):
+    """
+    コマンドライン引数を解析
+
+    Args:
+        argv (list, optional): コマンドライン引数 (省略時はsys.argv)
+
+    Returns:
+        argparse.Namespace: 解析結果
+    """
+    parser = argparse.ArgumentParser(
+        description="sdvx_stats.csvを拡大したベンチマーク用のCSVを生成する"
+    )
+    parser.add_argument("scale", type=int, help="倍率 (例: 10, 100)")
+    parser.add_argument(
+        "-i", "--input", default="data/sdvx_stats.csv", help="元のCSVファイル名"
+    )
+    parser.add_argument("-o", "--output", help="作成するCSVファイル名")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    return parser.parse_args(argv)
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    output = args.output or f"data/sdvx_stats_x{args.scale}.csv"
+    count = make_data(args.input, output, args.scale, args.seed)
+    print(f"{output}に{count}行を書き込みました")
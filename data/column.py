@@ -134,3 +134,95 @@ class Column:
         "grade_995",
         "grade_998",
     ]
+
+    # スコアグレードの下限のスコア (grade_*の人数はそのスコア以上の人数の累積. perはスコア10,000,000の人数)
+    score_grade_threshold = {
+        "grade_B": 7000000,
+        "grade_A": 8000000,
+        "grade_Ap": 8700000,
+        "grade_AA": 9000000,
+        "grade_AAp": 9300000,
+        "grade_AAA": 9500000,
+        "grade_AAAp": 9700000,
+        "grade_S": 9800000,
+        "grade_995": 9950000,
+        "grade_998": 9980000,
+    }
+    max_score = 10000000
+
+    skill_level = [
+        "avg_skill_u8",
+        "avg_skill_9",
+        "avg_skill_10",
+        "avg_skill_11",
+        "avg_skill_12_n",
+        "avg_skill_12_g",
+        "avg_skill_12_h",
+    ]
+
+    vf_class = [
+        "avg_vf_u7",
+        "avg_vf_8_i_ii",
+        "avg_vf_8_iii_iv",
+        "avg_vf_9_i",
+        "avg_vf_9_ii",
+        "avg_vf_9_iii",
+        "avg_vf_9_iv",
+        "avg_vf_10_i",
+        "avg_vf_10_ii",
+    ]
+
+    # レベル・難易度ごとの集計表 (sdvx_summary) のカラム
+    # 譜面数・プレイ人数の合計・クリアマークとスコアグレードの達成人数の合計・プレイ人数で重み付けした平均スコア・
+    # 譜面の平均スコアのパーセンタイル・スキルレベルとVF帯ごとの平均スコアの平均
+    summary_percentiles = [10, 25, 50, 75, 90]
+    summary_info = {
+        "charts": "譜面数",
+        "avg_score_p10": "平均スコア (10%)",
+        "avg_score_p25": "平均スコア (25%)",
+        "avg_score_p50": "平均スコア (中央値)",
+        "avg_score_p75": "平均スコア (75%)",
+        "avg_score_p90": "平均スコア (90%)",
+    }
+    summary_keys = (
+        ["level", "difficulty_name", "charts", "count"]
+        + clear_mark
+        + score_grade
+        + ["avg_score", "avg_score_p10", "avg_score_p25", "avg_score_p50"]
+        + ["avg_score_p75", "avg_score_p90"]
+        + skill_level
+        + vf_class
+    )
+
+    # 文字列型のカラム (それ以外のカラムはすべて整数型)
+    text_columns = ["music_title", "difficulty_name", "artist"]
+
+    # 主キー (楽曲名と難易度の組で譜面を一意に識別する)
+    primary_key = ["music_title", "difficulty_name"]
+
+    # インデックス名とインデックスを張るカラムの辞書
+    # make_sql_from_formが生成する絞り込み (レベル・難易度) とランキングの並び替え (平均スコア) に対応
+    indexes = {
+        "idx_sdvx_stats_level_difficulty": ["level", "difficulty_name", "avg_score"],
+        "idx_sdvx_stats_difficulty_level": ["difficulty_name", "level"],
+        "idx_sdvx_stats_avg_score": ["avg_score"],
+    }
+
+    # 部分一致検索のフィルタ名と全文検索インデックス (sdvx_search) のカラムの辞書
+    search_filters = {
+        "music_title_filter": "music_title",
+        "artist_filter": "artist",
+    }
+
+    @classmethod
+    def column_type(cls, key) -> str:
+        """
+        カラムのSQLiteでの型名を返す
+
+        Args:
+            key (str): カラム名
+
+        Returns:
+            str: 型名 (TEXTまたはINTEGER)
+        """
+        return "TEXT" if key in cls.text_columns else "INTEGER"
@@ -1,2 +1,15 @@
+# serverはサーバとして起動する場合だけ必要なため、modules.serverから直接読み込む
+from modules.api import *  # NOQA
+from modules.asgi import *  # NOQA
+from modules.compression import *  # NOQA
+from modules.connection_pool import *  # NOQA
+from modules.create_db import *  # NOQA
 from modules.create_results import *  # NOQA
+from modules.form import *  # NOQA
 from modules.make_sql import *  # NOQA
+from modules.metrics import *  # NOQA
+from modules.result_cache import *  # NOQA
+from modules.score_distribution import *  # NOQA
+from modules.snapshot import *  # NOQA
+from modules.static import *  # NOQA
+from modules.title_index import *  # NOQA
@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+
+"""機械可読なAPI (JSON Lines / CSV) のレスポンス生成に関する関数"""
+
+import csv
+import hashlib
+import io
+import json
+
+from utils import calculate_deviation, validate_score, validate_ss_score
+
+from data import Column
+
+# 出力形式とContent-Typeの対応
+API_CONTENT_TYPES = {
+    "jsonl": "application/x-ndjson; charset=utf-8",
+    "csv": "text/csv; charset=utf-8",
+}
+
+
+def get_api_format(form) -> str:
+    """
+    APIの出力形式をフォームから取得
+
+    Args:
+        form (dict): フォームデータ
+
+    Returns:
+        str: 出力形式 ("jsonl"または"csv")
+    """
+    output = form.getvalue("output", "jsonl")
+    return output if output in API_CONTENT_TYPES else "jsonl"
+
+
+def make_etag(db_version, build_version=None) -> str:
+    """
+    データとビルドのバージョンからETagを生成 (どちらも変わらない限り同じURLのレスポンスは変わらない)
+
+    Args:
+        db_version (int): データのバージョン
+        build_version (str, optional): テンプレート・静的ファイル・プログラムの内容から求めたバージョン
+
+    Returns:
+        str: ETagヘッダの値
+    """
+    if build_version is None:
+        return f'"sdvx-{db_version}"'
+    return f'"sdvx-{db_version}-{build_version}"'
+
+
+def make_build_version(digests) -> str:
+    """
+    テンプレート・静的ファイル・プログラムの内容のハッシュをまとめてビルドのバージョンを生成
+
+    Args:
+        digests (Iterable[str]): 内容のハッシュ
+
+    Returns:
+        str: ビルドのバージョン (内容のどれかが変わると変わる)
+    """
+    return hashlib.sha256("\n".join(digests).encode("utf-8")).hexdigest()[:12]
+
+
+def format_http_date(timestamp) -> str:
+    """
+    UNIX時刻をHTTPの日付の形式 (Last-Modifiedヘッダの値) に変換
+
+    Args:
+        timestamp (float): UNIX時刻
+
+    Returns:
+        str: HTTPの日付の文字列
+    """
+    # email.utilsはsocketなどを読み込み起動が遅くなるため、最初に必要になったときに読み込む
+    from email.utils import formatdate
+
+    return formatdate(timestamp, usegmt=True)
+
+
+def is_not_modified(environ, etag, last_modified=None) -> bool:
+    """
+    If-None-MatchヘッダがETagと一致するか、If-Modified-Since以降に更新されていないかを判定
+
+    If-None-Matchがある場合はIf-Modified-Sinceは無視する
+
+    Args:
+        environ (dict): WSGI環境変数の辞書オブジェクト
+        etag (str): 現在のETag
+        last_modified (float, optional): データの最終更新時刻 (UNIX時刻)
+
+    Returns:
+        bool: 一致する (304 Not Modifiedを返せる) 場合はTrue
+    """
+    if_none_match = environ.get("HTTP_IF_NONE_MATCH")
+    if if_none_match:
+        if if_none_match.strip() == "*":
+            return True
+        # 弱いETag (W/) と、圧縮したレスポンスのETag (-gzip) の比較も許可する
+        tags = [
+            tag.strip().removeprefix("W/").replace('-gzip"', '"')
+            for tag in if_none_match.split(",")
+        ]
+        return etag in tags
+    if_modified_since = environ.get("HTTP_IF_MODIFIED_SINCE")
+    if not if_modified_since or last_modified is None:
+        return False
+    from email.utils import parsedate_to_datetime
+
+    try:
+        since = parsedate_to_datetime(if_modified_since).timestamp()
+    except (TypeError, ValueError):
+        return False
+    # HTTPの日付は秒単位なので、最終更新時刻も秒単位で比較する
+    return int(last_modified) <= since
+
+
+def iter_api_rows(search_results, keys, output, batch_size=500):
+    """
+    検索結果の行をJSON LinesまたはCSVに変換するジェネレータ
+
+    Args:
+        search_results (Iterable[tuple]): 検索結果の行 (カーソルなど)
+        keys (list): 各行の列名のリスト (行の末尾の余分な列は出力しない)
+        output (str): 出力形式 ("jsonl"または"csv")
+        batch_size (int, optional): 1度に変換する行数
+
+    Yields:
+        str: batch_size行分のJSON LinesまたはCSV
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    if output == "csv":
+        writer.writerow(keys)
+    rows = 0
+    for search_result in search_results:
+        if output == "csv":
+            writer.writerow(search_result[: len(keys)])
+        else:
+            buffer.write(json.dumps(dict(zip(keys, search_result)), ensure_ascii=False))
+            buffer.write("\n")
+        rows += 1
+        if rows >= batch_size:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            rows = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+# create_deviation_rowsが返す行の列名
+DEVIATION_KEYS = [
+    "music_title",
+    "difficulty_name",
+    "level",
+    "avg_score",
+    "sd_score",
+    "score",
+    "deviation",
+]
+
+
+# /api/completeが返す行の列名 (難易度はカンマ区切り)
+COMPLETE_KEYS = ["music_title", "difficulties"]
+
+
+def parse_limit(limit, default, maximum) -> int:
+    """
+    APIで受け取った件数を整数に変換
+
+    Args:
+        limit (str): 件数
+        default (int): 不正な場合の件数
+        maximum (int): 件数の上限
+
+    Returns:
+        int: 1以上maximum以下の件数
+    """
+    try:
+        limit = int(limit)
+    except (TypeError, ValueError):
+        return default
+    return min(max(limit, 1), maximum)
+
+
+def parse_score(score):
+    """
+    APIで受け取ったスコアを整数に変換
+
+    Args:
+        score (str): スコア
+
+    Returns:
+        tuple (int or None, str): スコア (不正な場合はNone) とエラーメッセージ
+    """
+    is_valid, error_message = validate_ss_score(score)
+    if not is_valid:
+        # HTML用のメッセージからタグを取り除く
+        return None, error_message.replace("<h3>", "").replace("</h3>\n", "")
+    return int(score), ""
+
+
+def parse_difficulty_names(values):
+    """
+    APIで受け取った難易度名 (カンマ区切り, 複数指定可) をColumn.difficultiesの難易度名のリストに変換
+
+    Args:
+        values (list): 難易度名の文字列のリスト (空のリストの場合はすべての難易度)
+
+    Returns:
+        tuple (list or None, str): 難易度名のリスト (不正な場合はNone) とエラーメッセージ
+    """
+    names = [
+        name.strip() for value in values for name in value.split(",") if name.strip()
+    ]
+    if not names:
+        return list(Column.difficulties), ""
+    unknown = [name for name in names if name not in Column.difficulties]
+    if unknown:
+        return None, f"不明な難易度です: {', '.join(unknown)}"
+    return names, ""
+
+
+def create_deviation_rows(search_results, select_keys, score) -> list:
+    """
+    偏差値計算の対象の譜面ごとに偏差値を計算
+
+    Args:
+        search_results (list): 偏差値計算のための統計データの行のリスト
+        select_keys (list): 各行の列名のリスト
+        score (int): プレイヤーのスコア
+
+    Returns:
+        list: 楽曲名, 難易度, レベル, 平均スコア, 標準偏差, スコア, 偏差値 (計算できない場合はNone) の行のリスト
+    """
+    keys = ["music_title", "difficulty_name", "level", "avg_score", "sd_score"]
+    indexes = [select_keys.index(key) for key in keys]
+    rows = []
+    for search_result in search_results:
+        row = [search_result[index] for index in indexes]
+        avg_score, sd_score = row[3], row[4]
+        is_valid, _ = validate_score(score, sd_score)
+        deviation = (
+            calculate_deviation(score, avg_score, sd_score) if is_valid else None
+        )
+        rows.append(tuple(row) + (score, deviation))
+    return rows
+
+
+# 一括偏差値計算で受け付ける譜面の数の上限
+MAX_BATCH_ENTRIES = 10000
+# 一括偏差値計算で返す偏差値が高い (低い) 譜面の数
+DEFAULT_BATCH_TOP = 5
+
+
+def parse_score_entries(text) -> tuple:
+    """
+    アップロードされた (楽曲名, 難易度, スコア) の一覧を解析
+
+    JSON Lines (1行に1つの{"music_title", "difficulty_name", "score"}のオブジェクトまたは配列) と
+    CSV (楽曲名, 難易度, スコアの順. 見出し行は省略可) に対応する
+
+    Args:
+        text (str): アップロードされた一覧
+
+    Returns:
+        tuple (list, list): (楽曲名, 難易度, スコア) のリスト, 不正な行の (行番号, エラーメッセージ) のリスト
+    """
+    lines = text.splitlines()
+    first_line = next((line.strip() for line in lines if line.strip()), "")
+    if first_line.startswith(("{", "[")):
+        rows = []
+        for line in lines:
+            if not line.strip():
+                rows.append(None)
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = []
+            if isinstance(row, dict):
+                row = [
+                    row.get(key) for key in ("music_title", "difficulty_name", "score")
+                ]
+            rows.append(row if isinstance(row, list) else [])
+    else:
+        rows = [row or None for row in csv.reader(lines)]
+        # 見出し行は読み飛ばす
+        if rows and rows[0] and len(rows[0]) >= 3 and rows[0][2].strip() == "score":
+            rows[0] = None
+
+    entries = []
+    invalid = []
+    for line_number, row in enumerate(rows, 1):
+        if row is None:
+            continue
+        if len(row) < 3 or not isinstance(row[0], str) or not isinstance(row[1], str):
+            invalid.append((line_number, "楽曲名, 難易度, スコアを指定してください。"))
+            continue
+        score, error_message = parse_score(str(row[2]).strip())
+        if score is None:
+            invalid.append((line_number, error_message))
+            continue
+        entries.append((row[0], row[1].strip().upper(), score))
+    return entries, invalid
+
+
+def create_batch_deviation(
+    entries, search_results, select_keys, top=DEFAULT_BATCH_TOP
+) -> dict:
+    """
+    一括偏差値計算の結果 (譜面ごとの偏差値と集計) を生成
+
+    Args:
+        entries (list): (楽曲名, 難易度, スコア) のリスト
+        search_results (list): make_batch_deviation_sqlの検索結果の行のリスト
+        select_keys (list): 各行の列名のリスト
+        top (int, optional): 偏差値が高い (低い) 譜面を返す数
+
+    Returns:
+        dict: charts (譜面ごとの結果), levels (レベルごとの平均偏差値), summary (全体の平均偏差値),
+        best・worst (偏差値が高い・低い譜面), not_found (統計データがない譜面) の辞書
+    """
+    indexes = [
+        select_keys.index(key) for key in ("entry_id", "level", "avg_score", "sd_score")
+    ]
+    stats = {}
+    for search_result in search_results:
+        entry_id, level, avg_score, sd_score = [search_result[i] for i in indexes]
+        stats[int(entry_id)] = (level, avg_score, sd_score)
+
+    charts = []
+    not_found = []
+    for entry_id, (music_title, difficulty_name, score) in enumerate(entries):
+        if entry_id not in stats:
+            not_found.append(
+                {"music_title": music_title, "difficulty_name": difficulty_name}
+            )
+            continue
+        level, avg_score, sd_score = stats[entry_id]
+        is_valid, _ = validate_score(score, sd_score)
+        deviation = (
+            calculate_deviation(score, avg_score, sd_score) if is_valid else None
+        )
+        row = (
+            music_title,
+            difficulty_name,
+            level,
+            avg_score,
+            sd_score,
+            score,
+            deviation,
+        )
+        charts.append(dict(zip(DEVIATION_KEYS, row)))
+
+    # 偏差値を計算できた譜面だけを集計する
+    rated = [chart for chart in charts if chart["deviation"] is not None]
+    deviations_by_level = {}
+    for chart in rated:
+        deviations_by_level.setdefault(chart["level"], []).append(chart["deviation"])
+    levels = [
+        {
+            "level": level,
+            "count": len(deviations),
+            "mean_deviation": round(sum(deviations) / len(deviations), 3),
+        }
+        for level, deviations in sorted(deviations_by_level.items())
+    ]
+    ranked = sorted(rated, key=lambda chart: chart["deviation"], reverse=True)
+    return {
+        "charts": charts,
+        "levels": levels,
+        "summary": {
+            "count": len(rated),
+            "mean_deviation": (
+                round(sum(chart["deviation"] for chart in rated) / len(rated), 3)
+                if rated
+                else None
+            ),
+        },
+        "best": ranked[:top],
+        "worst": ranked[::-1][:top],
+        "not_found": not_found,
+    }
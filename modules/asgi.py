@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+
+"""ASGI (asyncio) でアプリケーションを提供するための補助関数
+
+asyncioとconcurrent.futuresは読み込みに時間がかかるため、ASGIで実行する場合だけ使用時に読み込む
+"""
+
+import contextvars
+
+from modules.form import MAX_BODY_SIZE
+
+
+class ExecutorBusy(Exception):
+    """実行待ちの処理が上限に達したことを表す例外"""
+
+
+class BoundedExecutor:
+    """
+    実行待ちの処理の数に上限を設けたスレッドプール
+
+    SQLiteへの問い合わせなどのブロッキングする処理をイベントループの外で実行する.
+    実行中・実行待ちの処理が上限に達している場合は待たずにExecutorBusyを送出する
+    (送信を始めたレスポンスの処理はwait=Trueで実行し、空きができるまで待つ)
+    """
+
+    def __init__(self, max_workers=4, max_pending=64):
+        """
+        Args:
+            max_workers (int, optional): ワーカースレッドの数
+            max_pending (int, optional): 実行中・実行待ちの処理の上限
+        """
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._executor = None  # スレッドプール (最初に実行するときに作成する)
+        # イベントループのスレッドからのみ操作するためロックは不要
+        self._pending = 0
+        self._waiters = []  # 空きを待っている処理のFuture (待ち始めた順)
+
+    async def run(self, func, *args, wait=False):
+        """
+        関数をワーカースレッドで実行し、結果を待つ
+
+        Args:
+            func (callable): 実行する関数
+            *args: 関数の引数
+            wait (bool, optional): 上限に達している場合にExecutorBusyを送出せず、空きができるまで待つかどうか
+
+        Returns:
+            関数の戻り値
+        """
+        import asyncio
+
+        # 空きを待っている処理がある場合は、新しい処理より先に実行させる
+        if self._pending >= self.max_pending or self._waiters:
+            if not wait:
+                raise ExecutorBusy()
+            while True:
+                waiter = asyncio.get_running_loop().create_future()
+                self._waiters.append(waiter)
+                try:
+                    await waiter
+                except BaseException:
+                    self._waiters.remove(waiter)
+                    # 再開させられた後に取り消された場合は、次に待っている処理に空きを譲る
+                    if waiter.done() and not waiter.cancelled():
+                        self._wake_next()
+                    raise
+                self._waiters.remove(waiter)
+                if self._pending < self.max_pending:
+                    break
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers, thread_name_prefix="sdvx-asgi"
+            )
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # 呼び出し元のコンテキスト変数 (リクエストの計測など) を引き継いで実行する
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self._executor, context.run, func, *args)
+        finally:
+            self._pending -= 1
+            self._wake_next()
+
+    def _wake_next(self) -> None:
+        """空きを待っている最初の処理を再開させる"""
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+                break
+
+    def shutdown(self) -> None:
+        """実行中の処理の終了を待ってワーカースレッドを終了する"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+
+def asgi_environ(scope) -> dict:
+    """
+    ASGIのscopeからWSGI形式の環境変数の辞書を生成 (リクエストヘッダはHTTP_*に変換する)
+
+    Args:
+        scope (dict): ASGIのscope
+
+    Returns:
+        dict: WSGI形式の環境変数の辞書
+    """
+    environ = {
+        "REQUEST_METHOD": scope.get("method", "GET"),
+        "PATH_INFO": scope.get("path", "/"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_PROTOCOL": "HTTP/" + scope.get("http_version", "1.1"),
+    }
+    for name, value in scope.get("headers", []):
+        key = name.decode("latin-1").upper().replace("-", "_")
+        value = value.decode("latin-1")
+        if key not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+            key = "HTTP_" + key
+        # 同じ名前のヘッダはカンマで連結する
+        environ[key] = environ[key] + "," + value if key in environ else value
+    return environ
+
+
+async def read_asgi_body(receive, max_size=MAX_BODY_SIZE):
+    """
+    リクエストボディをすべて受信する
+
+    Args:
+        receive (callable): ASGIのreceive
+        max_size (int, optional): 受け付けるリクエストボディの最大サイズ
+
+    Returns:
+        bytes or None: リクエストボディ (最大サイズを超えた場合・切断された場合はNone)
+    """
+    body = bytearray()
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None
+        body += message.get("body", b"")
+        if len(body) > max_size:
+            return None
+        if not message.get("more_body", False):
+            return bytes(body)
+
+
+async def send_response(send, status, headers, body=b"") -> None:
+    """
+    レスポンスを1度に送信する
+
+    Args:
+        send (callable): ASGIのsend
+        status (str): ステータス (例: "200 OK")
+        headers (list): (名前, 値) のレスポンスヘッダのリスト
+        body (bytes, optional): レスポンスボディ
+    """
+    await send(
+        {
+            "type": "http.response.start",
+            "status": int(status.split(" ", 1)[0]),
+            "headers": encode_headers(headers),
+        }
+    )
+    await send({"type": "http.response.body", "body": body})
+
+
+def encode_headers(headers) -> list:
+    """
+    レスポンスヘッダをASGIの形式 (バイト列の組) に変換
+
+    Args:
+        headers (list): (名前, 値) のレスポンスヘッダのリスト
+
+    Returns:
+        list: (名前, 値) のバイト列の組のリスト
+    """
+    return [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in headers
+    ]
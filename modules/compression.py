@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+"""レスポンスの圧縮 (gzip) に関する関数"""
+
+import gzip
+import zlib
+
+# これより小さいレスポンスは圧縮しない (圧縮しても小さくならず、CPU時間だけかかるため)
+COMPRESS_MIN_SIZE = 1024
+# 圧縮レベル (1: 速い～9: 小さい)
+COMPRESS_LEVEL = 6
+# 圧縮するContent-Type
+COMPRESSIBLE_TYPES = [
+    "text/",
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "image/svg+xml",
+]
+
+
+def accepts_gzip(environ) -> bool:
+    """
+    Accept-Encodingヘッダからクライアントがgzipを受け付けるかどうかを判定
+
+    Args:
+        environ (dict): WSGI環境変数の辞書オブジェクト
+
+    Returns:
+        bool: gzipで圧縮したレスポンスを返せる場合はTrue
+    """
+    qualities = {}
+    for item in environ.get("HTTP_ACCEPT_ENCODING", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[coding.strip().lower()] = quality
+    # q=0は明示的な拒否
+    return qualities.get("gzip", qualities.get("*", 0.0)) > 0
+
+
+def is_compressible(headers) -> bool:
+    """
+    レスポンスヘッダから圧縮してよいレスポンスかどうかを判定
+
+    Args:
+        headers (list): (ヘッダ名, 値) のリスト
+
+    Returns:
+        bool: テキスト系のContent-Typeで、まだ圧縮されていない場合はTrue
+    """
+    content_type = ""
+    for name, value in headers:
+        name = name.lower()
+        if name == "content-encoding":
+            return False
+        if name == "content-type":
+            content_type = value.lower()
+    return any(content_type.startswith(prefix) for prefix in COMPRESSIBLE_TYPES)
+
+
+def add_vary(headers) -> list:
+    """
+    Accept-Encodingによってレスポンスが変わることを示すVaryヘッダを追加
+
+    Args:
+        headers (list): (ヘッダ名, 値) のリスト
+
+    Returns:
+        list: Varyヘッダを追加したリスト
+    """
+    return headers + [("Vary", "Accept-Encoding")]
+
+
+def compressed_headers(headers) -> list:
+    """
+    gzipで圧縮したレスポンスのヘッダを作成 (ETagは圧縮前と区別するため-gzipを付ける)
+
+    Args:
+        headers (list): 圧縮前のレスポンスの (ヘッダ名, 値) のリスト
+
+    Returns:
+        list: Content-Encodingを追加したリスト
+    """
+    compressed = []
+    for name, value in headers:
+        if name.lower() == "etag" and value.endswith('"'):
+            value = value[:-1] + '-gzip"'
+        compressed.append((name, value))
+    return compressed + [("Content-Encoding", "gzip")]
+
+
+def gzip_bytes(data, level=COMPRESS_LEVEL) -> bytes:
+    """
+    バイト列をgzipで圧縮 (同じ入力からは同じ出力になるように更新日時は0にする)
+
+    Args:
+        data (bytes): 圧縮するバイト列
+        level (int, optional): 圧縮レベル
+
+    Returns:
+        bytes: 圧縮したバイト列
+    """
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def iter_gzip(chunks, level=COMPRESS_LEVEL):
+    """
+    バイト列の断片を少しずつgzipで圧縮するジェネレータ (ストリーミングのレスポンス用)
+
+    断片ごとにZ_SYNC_FLUSHで出力するため、クライアントは受信した分から展開して表示できる
+
+    Args:
+        chunks (Iterable[bytes]): 圧縮するバイト列の断片
+        level (int, optional): 圧縮レベル
+
+    Yields:
+        bytes: 圧縮したバイト列の断片
+    """
+    # wbits=31でgzip形式 (ヘッダ・フッタ付き) で出力する
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush(zlib.Z_FINISH)
+    finally:
+        # 送信が途中で中断された場合も元のイテレータを閉じる (借りている接続を返すため)
+        if hasattr(chunks, "close"):
+            chunks.close()
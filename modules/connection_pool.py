@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+
+"""読み込み専用のデータベース接続プール"""
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    """
+    読み込み専用のSQLite接続を使い回すための接続プール
+
+    接続ごとにsqlite3のステートメントキャッシュを持つため、同じSQL文 (ホームのランキング,
+    偏差値計算など) は再利用された接続上で再パースされずに実行される
+    """
+
+    def __init__(
+        self,
+        dbname,
+        size=4,
+        timeout=None,
+        cached_statements=128,
+        mmap_size=64 * 1024 * 1024,
+        cache_size=-16384,
+    ):
+        """
+        Args:
+            dbname (str): データベースのファイル名
+            size (int, optional): プールする接続の最大数
+            timeout (float, optional): 接続が空くまで待つ最大秒数 (Noneなら無制限)
+            cached_statements (int, optional): 接続ごとにキャッシュするSQL文の数
+            mmap_size (int, optional): PRAGMA mmap_sizeに設定する値 (バイト)
+            cache_size (int, optional): PRAGMA cache_sizeに設定する値 (負の値はKiB単位)
+        """
+        self.dbname = dbname
+        self.size = size
+        self.timeout = timeout
+        self.cached_statements = cached_statements
+        self.mmap_size = mmap_size
+        self.cache_size = cache_size
+
+        # 最後に返された接続から使う (キャッシュが温まっている接続を優先)
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0  # 作成した接続の数
+
+        # 統計情報
+        self.hits = 0  # 空いている接続をすぐに取得できた回数
+        self.misses = 0  # 新しい接続を作成した回数
+        self.waits = 0  # 接続が空くのを待った回数
+        self.wait_time = 0.0  # 接続が空くのを待った合計秒数
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        読み込み専用の接続を新しく作成
+
+        Returns:
+            sqlite3.Connection: データベースの接続
+        """
+        uri = f"file:{os.path.abspath(self.dbname)}?mode=ro"
+        con = sqlite3.connect(
+            uri,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=self.cached_statements,
+        )
+        con.text_factory = str
+        # WALモードはデータベース構築時に設定済み (読み込み専用の接続からは変更できない)
+        con.execute("PRAGMA query_only = ON")
+        con.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        con.execute(f"PRAGMA cache_size = {int(self.cache_size)}")
+        con.execute("PRAGMA temp_store = MEMORY")
+        return con
+
+    def _acquire(self) -> sqlite3.Connection:
+        """
+        プールから接続を取得 (空いていなければ作成するか、空くまで待つ)
+
+        Returns:
+            sqlite3.Connection: データベースの接続
+        """
+        try:
+            con = self._idle.get_nowait()
+            with self._lock:
+                self.hits += 1
+            return con
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+                self.misses += 1
+        if can_create:
+            try:
+                return self._connect()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        start = time.perf_counter()
+        try:
+            con = self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError("データベースの接続が空くのを待つ間にタイムアウトしました")
+        with self._lock:
+            self.waits += 1
+            self.wait_time += time.perf_counter() - start
+        return con
+
+    def _release(self, con) -> None:
+        """
+        接続をプールに戻す
+
+        Args:
+            con (sqlite3.Connection): データベースの接続
+        """
+        # 読み込み途中のトランザクションが残っていれば終了してから戻す
+        if con.in_transaction:
+            con.rollback()
+        self._idle.put(con)
+
+    @contextmanager
+    def connection(self):
+        """
+        withブロックの間だけプールの接続を借りる
+
+        Yields:
+            sqlite3.Connection: データベースの接続
+        """
+        con = self._acquire()
+        try:
+            yield con
+        except sqlite3.Error:
+            # エラーが起きた接続は破棄して、次回は新しい接続を作成する
+            con.close()
+            with self._lock:
+                self._created -= 1
+            raise
+        except BaseException:
+            self._release(con)
+            raise
+        else:
+            self._release(con)
+
+    def close(self) -> None:
+        """プールしているすべての接続を閉じる"""
+        while True:
+            try:
+                con = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            con.close()
+            with self._lock:
+                self._created -= 1
+
+    def stats(self) -> dict:
+        """
+        プールの統計情報を取得
+
+        Returns:
+            dict: 接続数・ヒット数・ミス数・待ち回数・待ち時間の辞書
+        """
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "idle": self._idle.qsize(),
+                "hits": self.hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "wait_time": self.wait_time,
+            }
@@ -0,0 +1,544 @@
+# -*- coding: utf-8 -*-
+
+"""データベースのスキーマ作成・移行・CSV取り込み・差分同期に関する関数"""
+
+import csv
+import hashlib
+import os
+import sqlite3
+import time
+
+from utils import create_placeholder, normalize_text
+
+from data import Column
+
+# スキーマのバージョン (PRAGMA user_versionに記録する)
+# 0: 型・インデックスなしの旧スキーマ, 1: 型付きスキーマ + 主キー + インデックス,
+# 2: 1 + 楽曲名・作曲者の全文検索インデックス (sdvx_search),
+# 3: 2 + レベル・難易度ごとの集計表 (sdvx_summary)
+SCHEMA_VERSION = 3
+
+# CSVを取り込む際の1バッチあたりの行数 (デフォルト値)
+DEFAULT_BATCH_SIZE = 1000
+
+
+def create_table_sql(table_name="sdvx_stats", temporary=False) -> str:
+    """
+    Column.column_infoから型付きのCREATE TABLE文を生成
+
+    Args:
+        table_name (str, optional): 作成するテーブル名
+        temporary (bool, optional): 一時テーブルとして作成するかどうか
+
+    Returns:
+        str: CREATE TABLE文
+    """
+    column_defs = [f"{key} {Column.column_type(key)}" for key in Column.column_info]
+    # 楽曲名と難易度の組を主キーにする (ss_musicページの完全一致検索に使用される)
+    column_defs.append(f"PRIMARY KEY ({', '.join(Column.primary_key)})")
+    table_type = "TEMP TABLE" if temporary else "TABLE"
+    return f"CREATE {table_type} IF NOT EXISTS {table_name} ({', '.join(column_defs)})"
+
+
+def create_index_sqls(table_name="sdvx_stats") -> list:
+    """
+    Column.indexesからCREATE INDEX文のリストを生成
+
+    Args:
+        table_name (str, optional): インデックスを張るテーブル名
+
+    Returns:
+        list: CREATE INDEX文のリスト
+    """
+    return [
+        f"CREATE INDEX IF NOT EXISTS {index_name} ON {table_name} ({', '.join(columns)})"
+        for index_name, columns in Column.indexes.items()
+    ]
+
+
+def build_search_index(con, table_name="sdvx_stats") -> None:
+    """
+    楽曲名・作曲者の部分一致検索のための全文検索インデックス (FTS5, trigram) を作り直す
+
+    各カラムについて、元の文字列と正規化した文字列 (全角・半角, カタカナ・ひらがなを区別しない) の
+    2つを登録する. 行はテーブルのrowidで対応付ける (トランザクションは呼び出し側で管理する)
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+        table_name (str, optional): インデックスを作成する対象のテーブル名
+    """
+    search_columns = list(Column.search_filters.values())
+    fts_columns = search_columns + [f"{key}_norm" for key in search_columns]
+    con.create_function("normalize_text", 1, normalize_text, deterministic=True)
+    con.execute(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS sdvx_search USING fts5("
+        + f"{', '.join(fts_columns)}, tokenize = 'trigram')"
+    )
+    con.execute("DELETE FROM sdvx_search")
+    con.execute(
+        f"INSERT INTO sdvx_search (rowid, {', '.join(fts_columns)}) "
+        + f"SELECT rowid, {', '.join(search_columns)}, "
+        + ", ".join(f"normalize_text({key})" for key in search_columns)
+        + f" FROM {table_name}"
+    )
+
+
+def _percentile(sorted_values, percent) -> int:
+    """
+    昇順に並べた値のパーセンタイルを求める (最近順位法)
+
+    Args:
+        sorted_values (list): 昇順に並べた値のリスト
+        percent (int): パーセンタイル (0～100)
+
+    Returns:
+        int: パーセンタイルの値
+    """
+    rank = max(-(-len(sorted_values) * percent // 100), 1)
+    return sorted_values[rank - 1]
+
+
+def build_summary_table(con, table_name="sdvx_stats") -> None:
+    """
+    レベル・難易度ごとの集計表 (sdvx_summary) を作り直す (トランザクションは呼び出し側で管理する)
+
+    達成人数はプレイ人数と同じく合計を記録するため、表示時に合計同士で割ると
+    プレイ人数で重み付けした達成率になる. スキルレベル・VF帯ごとの平均スコアは
+    データがない (0の) 譜面を除いて平均する
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+        table_name (str, optional): 集計する対象のテーブル名
+    """
+    column_defs = [f"{key} {Column.column_type(key)}" for key in Column.summary_keys]
+    con.execute("DROP TABLE IF EXISTS sdvx_summary")
+    con.execute(
+        f"CREATE TABLE sdvx_summary ({', '.join(column_defs)}, "
+        + "PRIMARY KEY (level, difficulty_name))"
+    )
+
+    # 譜面の平均スコアのパーセンタイルはSQLiteでは求められないため、並べた値から求める
+    avg_scores = {}
+    for level, difficulty_name, avg_score in con.execute(
+        f"SELECT level, difficulty_name, avg_score FROM {table_name} ORDER BY avg_score"
+    ):
+        avg_scores.setdefault((level, difficulty_name), []).append(avg_score)
+
+    sum_columns = Column.clear_mark + Column.score_grade
+    mean_columns = Column.skill_level + Column.vf_class
+    # パーセンタイルは平均スコアの直後に入れる
+    split = 5 + len(sum_columns)
+    rows = []
+    for row in con.execute(
+        "SELECT level, difficulty_name, COUNT(*), SUM(count), "
+        + "".join(f"SUM({key}), " for key in sum_columns)
+        + "CAST(ROUND(SUM(avg_score * count) * 1.0 / SUM(count)) AS INTEGER), "
+        + ", ".join(
+            f"CAST(ROUND(AVG(NULLIF({key}, 0))) AS INTEGER)" for key in mean_columns
+        )
+        + f" FROM {table_name} GROUP BY level, difficulty_name"
+    ):
+        values = avg_scores[(row[0], row[1])]
+        percentiles = [_percentile(values, p) for p in Column.summary_percentiles]
+        rows.append(row[:split] + tuple(percentiles) + row[split:])
+    con.executemany(
+        f"INSERT INTO sdvx_summary ({', '.join(Column.summary_keys)}) "
+        + f"VALUES ({create_placeholder(Column.summary_keys)})",
+        rows,
+    )
+
+
+def create_meta_table(con) -> None:
+    """
+    データベースのメタ情報 (CSVのフィンガープリント・データのバージョン) を格納するテーブルを作成
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+    """
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS sdvx_meta (key TEXT PRIMARY KEY, value TEXT)"
+    )
+
+
+def read_meta(con) -> dict:
+    """
+    メタ情報を辞書として取得
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+
+    Returns:
+        dict: メタ情報の辞書 (値はすべて文字列)
+    """
+    return dict(con.execute("SELECT key, value FROM sdvx_meta"))
+
+
+def write_meta(con, meta) -> None:
+    """
+    メタ情報を書き込む
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+        meta (dict): 書き込むメタ情報の辞書
+    """
+    con.executemany(
+        "INSERT OR REPLACE INTO sdvx_meta (key, value) VALUES (?, ?)",
+        [(key, str(value)) for key, value in meta.items()],
+    )
+
+
+def get_data_version(con) -> int:
+    """
+    データのバージョンを取得 (データが変更されるたびに1ずつ増える)
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+
+    Returns:
+        int: データのバージョン
+    """
+    row = con.execute(
+        "SELECT value FROM sdvx_meta WHERE key = 'data_version'"
+    ).fetchone()
+    return int(row[0]) if row else 0
+
+
+def get_data_updated(con):
+    """
+    データが最後に変更された時刻を取得
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+
+    Returns:
+        float or None: UNIX時刻 (記録されていない古いデータベースの場合はNone)
+    """
+    row = con.execute(
+        "SELECT value FROM sdvx_meta WHERE key = 'data_updated'"
+    ).fetchone()
+    return float(row[0]) if row else None
+
+
+def get_schema_version(con) -> int:
+    """
+    データベースに記録されたスキーマのバージョンを取得
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+
+    Returns:
+        int: スキーマのバージョン
+    """
+    return con.execute("PRAGMA user_version").fetchone()[0]
+
+
+def finish_schema(con, table_name="sdvx_stats") -> None:
+    """
+    データ投入後のテーブルにインデックス・全文検索インデックス・集計表を作成し、統計情報とバージョンを記録
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+        table_name (str, optional): 対象のテーブル名
+    """
+    for sql in create_index_sqls(table_name):
+        con.execute(sql)
+    build_search_index(con, table_name)
+    build_summary_table(con, table_name)
+    # クエリプランナが適切なインデックスを選べるように統計情報を更新
+    con.execute("ANALYZE")
+    con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def migrate_db(con) -> bool:
+    """
+    旧スキーマのデータベースを現在のスキーマに移行
+
+    型・インデックスなしのスキーマの場合はテーブルを作り直し、それ以外はインデックスだけを作成する
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+
+    Returns:
+        bool: 移行を行った場合はTrue
+    """
+    schema_version = get_schema_version(con)
+    if schema_version >= SCHEMA_VERSION:
+        return False
+    columns = ", ".join(Column.column_info.keys())
+    # 移行全体を1つのトランザクションで行う (途中で失敗した場合は旧スキーマのまま)
+    isolation_level = con.isolation_level
+    con.isolation_level = None
+    try:
+        con.execute("BEGIN")
+        if schema_version < 1:
+            con.execute("DROP TABLE IF EXISTS sdvx_stats_migrate")
+            con.execute(create_table_sql("sdvx_stats_migrate"))
+            # INTEGER型のカラムへの挿入時に文字列の数値は整数に変換される
+            con.execute(
+                f"INSERT OR REPLACE INTO sdvx_stats_migrate ({columns}) "
+                + f"SELECT {columns} FROM sdvx_stats"
+            )
+            con.execute("DROP TABLE sdvx_stats")
+            con.execute("ALTER TABLE sdvx_stats_migrate RENAME TO sdvx_stats")
+        finish_schema(con)
+        create_meta_table(con)
+        con.execute("COMMIT")
+    except Exception:
+        con.execute("ROLLBACK")
+        raise
+    finally:
+        con.isolation_level = isolation_level
+    return True
+
+
+def iter_csv_batches(csv_file, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    CSVファイルを一定行数ずつ読み込み、Column.column_infoの順に並べた行のリストを返すジェネレータ
+
+    Args:
+        csv_file (str): CSVファイル名
+        batch_size (int, optional): 1バッチあたりの行数
+
+    Yields:
+        list: 行 (カラムの値のリスト) のリスト
+    """
+    # utf-8-sigでヘッダ行先頭のBOMを取り除く
+    with open(csv_file, "r", encoding="utf-8-sig", newline="") as file:
+        reader = csv.reader(file)
+        header = [name.strip() for name in next(reader)]
+        missing_columns = [key for key in Column.column_info if key not in header]
+        if missing_columns:
+            raise ValueError(f"CSVファイルに必要なカラムがありません: {missing_columns}")
+        # CSVのカラム順がテーブルと異なっていても取り込めるように並べ替える
+        order = [header.index(key) for key in Column.column_info]
+        if order == list(range(len(order))) and len(header) == len(order):
+            order = None
+
+        batch = []
+        for row in reader:
+            if not row:
+                continue
+            batch.append(row if order is None else [row[i] for i in order])
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+
+def load_csv(con, csv_file, table_name="sdvx_stats", batch_size=DEFAULT_BATCH_SIZE) -> int:
+    """
+    CSVファイルをバッチ単位でテーブルに挿入 (トランザクションは呼び出し側で管理する)
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+        csv_file (str): CSVファイル名
+        table_name (str, optional): 挿入先のテーブル名
+        batch_size (int, optional): 1バッチあたりの行数
+
+    Returns:
+        int: 挿入した行数
+    """
+    columns = list(Column.column_info.keys())
+    # 数値はINTEGER型のカラムへの挿入時に整数に変換される
+    sql = (
+        f"INSERT OR REPLACE INTO {table_name} ({', '.join(columns)}) "
+        + f"VALUES ({create_placeholder(columns)})"
+    )
+    row_count = 0
+    for batch in iter_csv_batches(csv_file, batch_size):
+        con.executemany(sql, batch)
+        row_count += len(batch)
+    return row_count
+
+
+def build_db(dbname, csv_file, batch_size=DEFAULT_BATCH_SIZE) -> int:
+    """
+    CSVファイルからデータベースを新規に構築
+
+    一時ファイルに構築してから置き換えるため、途中で失敗しても壊れたデータベースは残らない
+
+    Args:
+        dbname (str): データベースのファイル名
+        csv_file (str): CSVファイル名
+        batch_size (int, optional): 1バッチあたりの行数
+
+    Returns:
+        int: 挿入した行数
+    """
+    tmp_dbname = dbname + ".tmp"
+    if os.path.exists(tmp_dbname):
+        os.remove(tmp_dbname)
+    start = time.perf_counter()
+    con = sqlite3.connect(tmp_dbname, isolation_level=None)
+    try:
+        # 一括読み込み用の設定 (一時ファイルなのでジャーナル・同期書き込みは不要)
+        con.execute("PRAGMA journal_mode = OFF")
+        con.execute("PRAGMA synchronous = OFF")
+        con.execute("PRAGMA cache_size = -65536")
+        con.execute("PRAGMA temp_store = MEMORY")
+        # 取り込み全体を1つのトランザクションで行う
+        con.execute("BEGIN")
+        con.execute(create_table_sql())
+        row_count = load_csv(con, csv_file, batch_size=batch_size)
+        # インデックスはデータ投入後にまとめて作成する
+        finish_schema(con)
+        # 差分同期のためにCSVのフィンガープリントを記録
+        create_meta_table(con)
+        write_meta(
+            con,
+            dict(csv_fingerprint(csv_file), data_version=1, data_updated=time.time()),
+        )
+        con.execute("COMMIT")
+        # 差分同期中も読み込みを続けられるようにWALモードにする (設定はファイルに保存される)
+        con.execute("PRAGMA journal_mode = WAL")
+    except Exception:
+        # 構築途中の一時ファイルを残さない (閉じてから削除する)
+        con.close()
+        for filename in (tmp_dbname, tmp_dbname + "-wal", tmp_dbname + "-shm"):
+            if os.path.exists(filename):
+                os.remove(filename)
+        raise
+    con.close()
+    os.replace(tmp_dbname, dbname)
+
+    elapsed = time.perf_counter() - start
+    rows_per_sec = row_count / elapsed if elapsed > 0 else float("inf")
+    print(
+        f"\n{csv_file}から{row_count}行を取り込みました "
+        + f"({elapsed:.3f}秒, {rows_per_sec:.0f}行/秒)\n"
+    )
+    return row_count
+
+
+def csv_fingerprint(csv_file, with_hash=True) -> dict:
+    """
+    CSVファイルのフィンガープリント (更新時刻・サイズ・SHA-256) を計算
+
+    Args:
+        csv_file (str): CSVファイル名
+        with_hash (bool, optional): ハッシュ値を計算するかどうか
+
+    Returns:
+        dict: csv_mtime, csv_size, (csv_sha256) をキーとする辞書
+    """
+    stat = os.stat(csv_file)
+    fingerprint = {"csv_mtime": str(stat.st_mtime_ns), "csv_size": str(stat.st_size)}
+    if with_hash:
+        sha256 = hashlib.sha256()
+        with open(csv_file, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                sha256.update(chunk)
+        fingerprint["csv_sha256"] = sha256.hexdigest()
+    return fingerprint
+
+
+def is_csv_modified(con, csv_file) -> bool:
+    """
+    CSVファイルが前回の取り込みから変更されたかどうかを判定
+
+    更新時刻とサイズが一致すればハッシュ値は計算しない.
+    更新時刻だけが変わって内容が同じ場合は、次回からハッシュ値を計算しないように新しい更新時刻を記録する
+
+    Args:
+        con (sqlite3.Connection): データベースの接続
+        csv_file (str): CSVファイル名
+
+    Returns:
+        bool: 変更されている場合はTrue
+    """
+    meta = read_meta(con)
+    fingerprint = csv_fingerprint(csv_file, with_hash=False)
+    if all(meta.get(key) == value for key, value in fingerprint.items()):
+        return False
+    fingerprint = csv_fingerprint(csv_file)
+    if meta.get("csv_sha256") != fingerprint["csv_sha256"]:
+        return True
+    try:
+        write_meta(con, fingerprint)
+        con.commit()
+    except sqlite3.OperationalError:
+        # 他のプロセスが書き込み中の場合は記録しない (次回もハッシュ値で判定する)
+        con.rollback()
+    return False
+
+
+def sync_db(dbname, csv_file, batch_size=DEFAULT_BATCH_SIZE) -> dict:
+    """
+    CSVファイルとの差分だけをデータベースに反映する
+
+    変更された譜面 (楽曲名, 難易度) の行だけを更新・追加し、CSVから消えた行を削除する.
+    全体を1つのトランザクションで行うため、WALモードで読み込み中の接続からは
+    コミットの瞬間に新しいデータへ切り替わって見える
+
+    Args:
+        dbname (str): データベースのファイル名
+        csv_file (str): CSVファイル名
+        batch_size (int, optional): 1バッチあたりの行数
+
+    Returns:
+        dict: upserted (更新・追加した行数), deleted (削除した行数), data_version
+    """
+    columns = list(Column.column_info.keys())
+    value_columns = [key for key in columns if key not in Column.primary_key]
+    primary_key = ", ".join(Column.primary_key)
+    start = time.perf_counter()
+    con = sqlite3.connect(dbname, isolation_level=None)
+    try:
+        con.execute("PRAGMA journal_mode = WAL")
+        con.execute("PRAGMA temp_store = MEMORY")
+        # 書き込みロックを先に取得してから同期を行う
+        con.execute("BEGIN IMMEDIATE")
+        create_meta_table(con)
+        fingerprint = csv_fingerprint(csv_file)
+        # CSVを一時テーブルに取り込む
+        con.execute("DROP TABLE IF EXISTS temp.sdvx_stats_incoming")
+        con.execute(create_table_sql("sdvx_stats_incoming", temporary=True))
+        load_csv(con, csv_file, "sdvx_stats_incoming", batch_size)
+
+        # 値が変わった行だけを更新・追加 (upsert)
+        changes = con.total_changes
+        con.execute(
+            f"INSERT INTO sdvx_stats ({', '.join(columns)}) "
+            + f"SELECT {', '.join(columns)} FROM sdvx_stats_incoming WHERE true "
+            + f"ON CONFLICT ({primary_key}) DO UPDATE SET "
+            + ", ".join(f"{key} = excluded.{key}" for key in value_columns)
+            + f" WHERE ({', '.join('sdvx_stats.' + key for key in value_columns)}) "
+            + f"IS NOT ({', '.join('excluded.' + key for key in value_columns)})"
+        )
+        upserted = con.total_changes - changes
+
+        # CSVから消えた行を削除
+        changes = con.total_changes
+        con.execute(
+            f"DELETE FROM sdvx_stats WHERE ({primary_key}) NOT IN "
+            + f"(SELECT {primary_key} FROM sdvx_stats_incoming)"
+        )
+        deleted = con.total_changes - changes
+        con.execute("DROP TABLE sdvx_stats_incoming")
+
+        # データが変わった場合のみバージョンを上げる
+        data_version = get_data_version(con)
+        meta = dict(fingerprint)
+        if upserted or deleted:
+            data_version += 1
+            meta["data_updated"] = time.time()
+            # 全文検索インデックス・集計表も同じトランザクションで作り直す
+            build_search_index(con)
+            build_summary_table(con)
+            con.execute("ANALYZE")
+        write_meta(con, dict(meta, data_version=data_version))
+        con.execute("COMMIT")
+    except Exception:
+        if con.in_transaction:
+            con.execute("ROLLBACK")
+        raise
+    finally:
+        con.close()
+
+    elapsed = time.perf_counter() - start
+    print(
+        f"\n{csv_file}と同期しました "
+        + f"(更新・追加: {upserted}行, 削除: {deleted}行, {elapsed:.3f}秒)\n"
+    )
+    return {"upserted": upserted, "deleted": deleted, "data_version": data_version}
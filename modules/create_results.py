@@ -2,9 +2,23 @@
 
 """検索結果のhtml文作成に関する関数"""
 
-from utils import calculate_achiever_rate, calculate_deviation, validate_score
+import html
+from urllib.parse import urlencode
+
+from utils import (
+    calculate_achiever_rate,
+    calculate_achiever_rates,
+    calculate_deviation,
+    validate_score,
+)
 
 from data import Column
+from modules.make_sql import (
+    DEFAULT_PAGE_SIZE,
+    DEFAULT_SORT_KEY,
+    PAGE_SIZES,
+    encode_page_cursor,
+)
 
 
 # 結果の表の仕様
@@ -78,6 +92,233 @@ def _create_table_data(class_name, data, is_music=False) -> str:
         return f'<td class="{class_name}">{data}</td>'
 
 
+def _create_column_cells(key, column, counts, is_percent, is_count_display):
+    """
+    検索結果の1列分のセルのHTMLコードをまとめて作成
+
+    クリアマークとスコアグレードの達成率は列全体をcalculate_achiever_ratesで一度に計算する
+
+    Args:
+        key (str): 列名
+        column (tuple): 各行の列の値
+        counts (tuple): 各行のプレイ人数
+        is_percent (bool): 達成率を表示するかどうか
+        is_count_display (bool): プレイ人数を表示するかどうか
+
+    Returns:
+        list or None: 各行のセルのHTMLコード (表示しない列の場合はNone)
+    """
+    if key == "music_title":
+        return [
+            _create_table_data("music_title", music_title, is_music=True)
+            for music_title in column
+        ]
+    # 難易度名の色指定のために別枠でclassを追加
+    if key == "difficulty_name":
+        return [
+            f'<td class="difficulty_{difficulty_name}">{difficulty_name}</td>'
+            for difficulty_name in column
+        ]
+    # クリアマークとスコアグレードは人数または達成者率を計算して表示
+    if key in Column.clear_mark + Column.score_grade and is_percent:
+        achiever_rates, achiever_classes = calculate_achiever_rates(column, counts)
+        return list(
+            map('<td class="{}">{}</td>'.format, achiever_classes, achiever_rates)
+        )
+    # プレイ人数を表示するかどうかを判定
+    if key == "count" and not is_count_display:
+        return None
+    return [f'<td class="{key}">{data}</td>' for data in column]
+
+
+def iter_results_rows(
+    cur,
+    sql,
+    values,
+    select_keys,
+    is_percent=True,
+    is_count_display=False,
+    is_ranking=False,
+    batch_size=200,
+    fragment_cache=None,
+):
+    """
+    指定されたSQLクエリの結果をカーソルから少しずつ取り出し、テーブルの本文を一定行数ずつ生成するジェネレータ
+
+    Args:
+        cur (sqlite3.Cursor): データベースのカーソル
+        sql (str): SQLクエリ
+        values (tuple or list): SQLクエリのプレースホルダに対応する値
+        select_keys (list): 表示する列のリスト
+        is_percent (bool, optional): 達成率を表示するかどうか.
+        is_count_display (bool, optional): プレイ人数を表示するかどうか.
+        is_ranking (bool, optional): ホームのランキングテーブルであるかどうか.
+        batch_size (int, optional): 1度に生成する行数
+        fragment_cache (RowFragmentCache, optional): 生成済みの行のHTMLのキャッシュ
+
+    Yields:
+        str: batch_size行分のテーブル本文のHTMLコード
+    """
+    # valuesがタプルではない場合はタプルに変換
+    if not isinstance(values, tuple):
+        values = tuple(values)
+    cur.execute(sql, values)
+    data_number = 0
+    while True:
+        search_results = cur.fetchmany(batch_size)
+        if not search_results:
+            break
+        yield create_rows_html(
+            search_results,
+            select_keys,
+            is_percent,
+            is_count_display,
+            is_ranking,
+            start_number=data_number,
+            fragment_cache=fragment_cache,
+        )
+        data_number += len(search_results)
+
+
+def iter_rows_html(
+    search_results,
+    select_keys,
+    is_percent=True,
+    is_count_display=False,
+    is_ranking=False,
+    batch_size=200,
+    fragment_cache=None,
+):
+    """
+    取得済みの検索結果の行から、テーブルの本文を一定行数ずつ生成するジェネレータ
+
+    Args:
+        search_results (list): 検索結果の行のリスト
+        select_keys (list): 表示する列のリスト
+        is_percent (bool, optional): 達成率を表示するかどうか.
+        is_count_display (bool, optional): プレイ人数を表示するかどうか.
+        is_ranking (bool, optional): ホームのランキングテーブルであるかどうか.
+        batch_size (int, optional): 1度に生成する行数
+        fragment_cache (RowFragmentCache, optional): 生成済みの行のHTMLのキャッシュ
+
+    Yields:
+        str: batch_size行分のテーブル本文のHTMLコード
+    """
+    for start in range(0, len(search_results), batch_size):
+        yield create_rows_html(
+            search_results[start : start + batch_size],
+            select_keys,
+            is_percent,
+            is_count_display,
+            is_ranking,
+            start_number=start,
+            fragment_cache=fragment_cache,
+        )
+
+
+def _create_row_fragments(
+    search_results, select_keys, is_percent, is_count_display, is_ranking, start_number
+) -> list:
+    """
+    取得済みの検索結果の行から、行ごとのHTMLコードを作成
+
+    Args:
+        search_results (list): 検索結果の行のリスト
+        select_keys (list): 表示する列のリスト
+        is_percent (bool): 達成率を表示するかどうか
+        is_count_display (bool): プレイ人数を表示するかどうか
+        is_ranking (bool): ホームのランキングテーブルであるかどうか
+        start_number (int): 最初の行の行番号 (0始まり)
+
+    Returns:
+        list: 1行分 (<tr>～</tr>) のHTMLコードのリスト
+    """
+    # 達成率を計算するためのプレイ人数のインデックス取得
+    count_index = select_keys.index("count")
+    # 行ごとではなく列ごとにセルを作成し、最後に行にまとめる
+    columns = list(zip(*search_results))
+    cells = []
+    # ランキングのときのみRankを表示
+    if is_ranking:
+        cells.append(
+            [
+                f'<td class="rank">{data_number}</td>\n'
+                for data_number in range(
+                    start_number + 1, start_number + len(search_results) + 1
+                )
+            ]
+        )
+    for key_number, key in enumerate(select_keys):
+        column_cells = _create_column_cells(
+            key, columns[key_number], columns[count_index], is_percent, is_count_display
+        )
+        if column_cells is not None:
+            cells.append(column_cells)
+    return ["<tr>\n" + "".join(row) + "</tr>\n" for row in zip(*cells)]
+
+
+def create_rows_html(
+    search_results,
+    select_keys,
+    is_percent=True,
+    is_count_display=False,
+    is_ranking=False,
+    start_number=0,
+    fragment_cache=None,
+) -> str:
+    """
+    取得済みの検索結果の行からテーブルの本文を作成
+
+    fragment_cacheを指定した場合は、譜面 (楽曲名, 難易度) ごとに生成済みの行のHTMLを再利用し、
+    キャッシュにない行だけを生成する (ランキングは行番号を含むため再利用しない)
+
+    Args:
+        search_results (list): 検索結果の行のリスト
+        select_keys (list): 表示する列のリスト
+        is_percent (bool, optional): 達成率を表示するかどうか.
+        is_count_display (bool, optional): プレイ人数を表示するかどうか.
+        is_ranking (bool, optional): ホームのランキングテーブルであるかどうか.
+        start_number (int, optional): 最初の行の行番号 (0始まり)
+        fragment_cache (RowFragmentCache, optional): 生成済みの行のHTMLのキャッシュ
+
+    Returns:
+        str: テーブルの本文のHTMLコード
+    """
+    if not search_results:
+        return ""
+    if fragment_cache is None or is_ranking:
+        return "".join(
+            _create_row_fragments(
+                search_results,
+                select_keys,
+                is_percent,
+                is_count_display,
+                is_ranking,
+                start_number,
+            )
+        )
+    # 行のHTMLは譜面のデータと表示形式 (表示する列, 達成率表示, プレイ人数表示) だけで決まる
+    mode = (tuple(select_keys), bool(is_percent), bool(is_count_display))
+    title_index = select_keys.index("music_title")
+    difficulty_index = select_keys.index("difficulty_name")
+    charts = [(row[title_index], row[difficulty_index]) for row in search_results]
+    fragments = fragment_cache.get_many(mode, charts)
+    missing = [index for index, fragment in enumerate(fragments) if fragment is None]
+    if missing:
+        created = _create_row_fragments(
+            [search_results[index] for index in missing],
+            select_keys,
+            is_percent,
+            is_count_display,
+            is_ranking,
+            start_number,
+        )
+        for index, fragment in zip(missing, created):
+            fragments[index] = fragment
+        fragment_cache.put_many(mode, [charts[index] for index in missing], created)
+    return "".join(fragments)
+
+
 def create_results_table(
     cur,
     sql,
@@ -108,52 +349,174 @@ def create_results_table(
     )
 
     # テーブルの本文を生成
-    results_table = ""
-    # valuesがタプルではない場合はタプルに変換
-    if not isinstance(values, tuple):
-        values = tuple(values)
-    for data_number, search_result in enumerate(cur.execute(sql, values)):
-        results_table += "<tr>\n"
-        # 達成率を計算するためのプレイ人数のインデックス取得
-        count_index = select_keys.index("count")
-        # ランキングのときのみRankを表示
-        if is_ranking:
-            results_table += '<td class="rank">' + str(data_number + 1) + "</td>\n"
+    results_table = "".join(
+        iter_results_rows(
+            cur, sql, values, select_keys, is_percent, is_count_display, is_ranking
+        )
+    )
+    return header, results_table
+
+
+def create_summary_table(search_results, select_keys, is_percent=True) -> tuple:
+    """
+    レベル・難易度ごとの集計表のテーブルを作成
+
+    達成率はクリアマーク・スコアグレードの達成人数の合計をプレイ人数の合計で割って求める
+
+    Args:
+        search_results (list): 集計表の行のリスト
+        select_keys (list): 各行の列名のリスト
+        is_percent (bool, optional): 達成率を表示するかどうか
+
+    Returns:
+        tuple (str, str): 生成されたテーブルのヘッダと本文
+    """
+    header = "<tr>\n"
+    for index, key in enumerate(select_keys):
+        header_name = Column.summary_info.get(key) or Column.column_info[key]
+        if key in Column.score_grade + Column.clear_mark:
+            header_name += " (%)" if is_percent else " (人)"
+        header += f"<th class='con' id='{index}'>{header_name}</th>\n"
+    header += "</tr>\n"
+
+    count_index = select_keys.index("count")
+    rows = []
+    for search_result in search_results:
+        row = "<tr>\n"
         for key_number, key in enumerate(select_keys):
-            if key == "music_title":
-                music_title = search_result[key_number]
-                results_table += _create_table_data(
-                    "music_title", music_title, is_music=True
-                )
-            # 難易度名の色指定のために別枠でclassを追加
-            elif key == "difficulty_name":
-                difficulty_name = search_result[key_number]
-                results_table += _create_table_data(
-                    f"difficulty_{difficulty_name}", difficulty_name
+            data = search_result[key_number]
+            if key == "difficulty_name":
+                row += _create_table_data(f"difficulty_{data}", data)
+            elif key in Column.clear_mark + Column.score_grade and is_percent:
+                data, css_class = calculate_achiever_rate(
+                    int(data), int(search_result[count_index])
                 )
-            # クリアマークとスコアグレードは人数または達成者率を計算して表示
-            elif key in Column.clear_mark + Column.score_grade:
-                # ％表示
-                if is_percent:
-                    data, css_class = calculate_achiever_rate(
-                        int(search_result[key_number]),
-                        int(search_result[count_index]),
-                    )
-                # 人数表示
-                else:
-                    data, css_class = search_result[key_number], key
-                results_table += _create_table_data(css_class, data)
+                row += _create_table_data(css_class, data)
             else:
-                # プレイ人数を表示するかどうかを判定
-                if key == "count" and not is_count_display:
-                    continue
-                data = search_result[key_number]
-                results_table += _create_table_data(key, data)
-        results_table += "</tr>\n"
-    return header, results_table
+                # データがない平均スコアは"-"と表示
+                row += _create_table_data(key, "-" if data is None else data)
+        row += "</tr>\n"
+        rows.append(row)
+    return header, "".join(rows)
+
+
+def create_sort_options(display, page=None) -> str:
+    """
+    並び替えの列・順序・1ページの件数を選択するselect要素のHTMLコードを作成
+
+    Args:
+        display (list): 並び替えに指定できる列のリスト
+        page (dict, optional): 現在のページ送りの条件 (選択状態の復元に使用). Noneならデフォルト値を選択
+
+    Returns:
+        str: select要素のHTMLコード
+    """
+    if page is None:
+        page = {"sort": DEFAULT_SORT_KEY, "order": "asc", "page_size": DEFAULT_PAGE_SIZE}
+
+    def option(value, label, selected):
+        return f'<option value="{value}"{" selected" if selected else ""}>{label}</option>\n'
+
+    sort_options = "".join(
+        option(key, Column.column_info[key], key == page["sort"]) for key in display
+    )
+    order_options = option("asc", "昇順", page["order"] == "asc") + option(
+        "desc", "降順", page["order"] == "desc"
+    )
+    size_options = "".join(
+        option(size, f"{size}件" if size else "全件", size == page["page_size"])
+        for size in PAGE_SIZES
+    )
+    return (
+        '<b id="lbl_sort" for="sel_sort">並び替え</b>\n'
+        + f'<select name="sort">\n{sort_options}</select>\n'
+        + f'<select name="order">\n{order_options}</select>\n'
+        + f'<select name="page_size">\n{size_options}</select>\n'
+    )
+
+
+def split_page(search_results, page) -> tuple:
+    """
+    make_sql_from_form(page指定)で取得した1ページ分 (+1行) の行から表示する行と前後のページの有無を求める
+
+    Args:
+        search_results (list): 取得した行のリスト
+        page (dict): ページ送りの条件
+
+    Returns:
+        tuple (list, bool, bool): 表示する行, 前のページがあるかどうか, 次のページがあるかどうか
+    """
+    has_more = len(search_results) > page["page_size"]
+    rows = search_results[: page["page_size"]]
+    if page["is_backward"]:
+        # 逆順に取得しているので元の順に戻す
+        rows.reverse()
+        return rows, has_more, True
+    return rows, page["cursor"] is not None, has_more
+
+
+def create_page_cursors(rows, select_keys, has_prev, has_next) -> tuple:
+    """
+    前のページ・次のページを取得するためのカーソルを作成
+
+    Args:
+        rows (list): 表示する行のリスト (各行の末尾は並び替えの列の値)
+        select_keys (list): 表示する列のリスト
+        has_prev (bool): 前のページがあるかどうか
+        has_next (bool): 次のページがあるかどうか
+
+    Returns:
+        tuple (str, str): 前のページ・次のページのカーソル (ページがない場合は空文字列)
+    """
+    if not rows:
+        return "", ""
+    title_index = select_keys.index("music_title")
+    difficulty_index = select_keys.index("difficulty_name")
+
+    def cursor(row):
+        return encode_page_cursor([row[-1], row[title_index], row[difficulty_index]])
+
+    return (
+        cursor(rows[0]) if has_prev else "",
+        cursor(rows[-1]) if has_next else "",
+    )
+
+
+def create_page_links(form, prev_cursor, next_cursor) -> str:
+    """
+    前のページ・次のページへのリンクのHTMLコードを作成
+
+    Args:
+        form (dict): 検索条件・表示項目を含むフォームデータ
+        prev_cursor (str): 前のページのカーソル (ページがない場合は空文字列)
+        next_cursor (str): 次のページのカーソル (ページがない場合は空文字列)
+
+    Returns:
+        str: ページ送りのリンクのHTMLコード
+    """
+    if not prev_cursor and not next_cursor:
+        return ""
+    # カーソル以外の検索条件はそのまま引き継ぐ (URLが一意になるようにキーの順に並べる)
+    params = [
+        (key, value)
+        for key in sorted(form.keys())
+        if key not in ("after", "before")
+        for value in form.getlist(key)
+    ]
+
+    def page_link(direction, cursor, label):
+        query = html.escape(urlencode(params + [(direction, cursor)]))
+        return f'<a href="/?{query}" class="page_{direction}">{label}</a>\n'
+
+    links = ""
+    if prev_cursor:
+        links += page_link("before", prev_cursor, "&lt;&lt;前のページ")
+    if next_cursor:
+        links += page_link("after", next_cursor, "次のページ&gt;&gt;")
+    return f'<div class="pagination">\n{links}</div>\n'
 
 
-def create_deviation_score_results(ss_score, sd_score, avg_score):
+def create_deviation_score_results(ss_score, sd_score, avg_score, percentile=None):
     """
     偏差値計算の結果を表示するページを作成
 
@@ -161,6 +524,7 @@ def create_deviation_score_results(ss_score, sd_score, avg_score):
         ss_score (int): プレイヤーのスコア
         sd_score (int): データベース上の標準偏差
         avg_score (int): データベース上の平均スコア
+        percentile (float, optional): スコア分布から求めたパーセンタイル (指定した場合は上位何%かも表示する)
 
     Returns:
         str: 偏差値計算結果のHTMLコード
@@ -169,6 +533,12 @@ def create_deviation_score_results(ss_score, sd_score, avg_score):
     is_valid, error_message = validate_score(ss_score, sd_score)
     if is_valid:
         deviation_score = calculate_deviation(ss_score, avg_score, sd_score)
-        return f"<h3>偏差値は{deviation_score}です。</h3>\n"
+        results = f"<h3>偏差値は{deviation_score}です。</h3>\n"
+        if percentile is not None:
+            results += (
+                f"<h3>スコア分布から推定した順位は上位{round(100 - percentile, 1)}%"
+                + f" (パーセンタイル: {percentile})です。</h3>\n"
+            )
+        return results
     else:
         return error_message
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+
+"""リクエストのフォームデータ (クエリ文字列・リクエストボディ) の解析"""
+
+from urllib.parse import parse_qs
+
+# 受け付けるリクエストボディの最大サイズ (バイト)
+MAX_BODY_SIZE = 8 * 1024 * 1024
+
+
+class FormData:
+    """
+    cgi.FieldStorageと同じ使い方 (getvalue, getlist, keys, in) ができるフォームデータ
+
+    クエリ文字列とリクエストボディ (application/x-www-form-urlencoded, multipart/form-data) を解析する.
+    それ以外の形式のリクエストボディ (CSVなど) は文字列のままbodyに保持する
+    """
+
+    def __init__(self, fields=None, body=""):
+        """
+        Args:
+            fields (dict, optional): キーと値のリストの辞書
+            body (str, optional): フォーム以外の形式のリクエストボディ
+        """
+        self.fields = fields if fields is not None else {}
+        self.body = body
+
+    @classmethod
+    def parse(cls, query_string="", body=b"", content_type="") -> "FormData":
+        """
+        クエリ文字列とリクエストボディからフォームデータを生成
+
+        Args:
+            query_string (str, optional): クエリ文字列
+            body (bytes, optional): リクエストボディ
+            content_type (str, optional): リクエストボディのContent-Type
+
+        Returns:
+            FormData: フォームデータ (値が空のキーも残す)
+        """
+        fields = parse_qs(query_string, keep_blank_values=True)
+        raw_body = ""
+        if body:
+            media_type = content_type.split(";", 1)[0].strip().lower()
+            if media_type == "application/x-www-form-urlencoded":
+                body_fields = parse_qs(
+                    body.decode("utf-8", "replace"), keep_blank_values=True
+                )
+            elif media_type == "multipart/form-data":
+                body_fields = _parse_multipart(body, content_type)
+            else:
+                body_fields = {}
+                raw_body = body.decode("utf-8-sig", "replace")
+            for key, values in body_fields.items():
+                fields.setdefault(key, []).extend(values)
+        return cls(fields, raw_body)
+
+    def getvalue(self, key, default=None):
+        """
+        キーに対応する値を取得
+
+        Args:
+            key (str): キー
+            default (optional): キーが存在しない場合の値
+
+        Returns:
+            str or list: 値 (複数ある場合はリスト)
+        """
+        values = self.fields.get(key)
+        if not values:
+            return default
+        return values[0] if len(values) == 1 else list(values)
+
+    def getfirst(self, key, default=None):
+        """
+        キーに対応する最初の値を取得
+
+        Args:
+            key (str): キー
+            default (optional): キーが存在しない場合の値
+
+        Returns:
+            str: 最初の値
+        """
+        values = self.fields.get(key)
+        return values[0] if values else default
+
+    def getlist(self, key) -> list:
+        """
+        キーに対応する値をすべて取得
+
+        Args:
+            key (str): キー
+
+        Returns:
+            list: 値のリスト (キーが存在しない場合は空のリスト)
+        """
+        return list(self.fields.get(key, []))
+
+    def keys(self) -> list:
+        """
+        フォームデータのキーを取得
+
+        Returns:
+            list: キーのリスト
+        """
+        return list(self.fields)
+
+    def __contains__(self, key) -> bool:
+        return key in self.fields
+
+    def __len__(self) -> int:
+        return len(self.fields)
+
+
+def _parse_multipart(body, content_type) -> dict:
+    """
+    multipart/form-dataのリクエストボディを解析
+
+    Args:
+        body (bytes): リクエストボディ
+        content_type (str): boundaryを含むContent-Type
+
+    Returns:
+        dict: キーと値 (ファイルの場合は内容) のリストの辞書
+    """
+    # emailパッケージは読み込みに時間がかかるため、multipart/form-dataを受け取ったときに読み込む
+    from email.parser import BytesParser
+    from email.policy import HTTP
+
+    message = BytesParser(policy=HTTP).parsebytes(
+        b"Content-Type: " + content_type.encode("latin-1") + b"\r\n\r\n" + body
+    )
+    fields = {}
+    if not message.is_multipart():
+        return fields
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        if name is None:
+            continue
+        payload = part.get_payload(decode=True) or b""
+        charset = part.get_content_charset() or "utf-8"
+        fields.setdefault(name, []).append(payload.decode(charset, "replace"))
+    return fields
+
+
+def get_content_length(environ) -> int:
+    """
+    リクエストボディの長さを取得
+
+    Args:
+        environ (dict): WSGI環境変数の辞書オブジェクト
+
+    Returns:
+        int: リクエストボディの長さ (不明な場合は0)
+    """
+    try:
+        return max(int(environ.get("CONTENT_LENGTH") or 0), 0)
+    except ValueError:
+        return 0
+
+
+def parse_wsgi_form(environ) -> FormData:
+    """
+    WSGIのリクエストからフォームデータを生成
+
+    Args:
+        environ (dict): WSGI環境変数の辞書オブジェクト
+
+    Returns:
+        FormData: フォームデータ
+    """
+    body = b""
+    if environ.get("REQUEST_METHOD", "GET") not in ("GET", "HEAD"):
+        content_length = get_content_length(environ)
+        if content_length:
+            body = environ["wsgi.input"].read(min(content_length, MAX_BODY_SIZE))
+    return FormData.parse(
+        environ.get("QUERY_STRING", ""), body, environ.get("CONTENT_TYPE", "")
+    )
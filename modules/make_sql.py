@@ -2,72 +2,515 @@
 
 """SQLの作成に関する関数"""
 
-from utils import create_placeholder
+import base64
+import hashlib
+import json
+import math
+
+from utils import create_placeholder, normalize_text
 
 from data import Column
 
+# 1ページに表示する件数の選択肢 (0は全件表示) とデフォルト値
+PAGE_SIZES = [50, 100, 500, 0]
+DEFAULT_PAGE_SIZE = 50
+# デフォルトの並び替えの列
+DEFAULT_SORT_KEY = "music_title"
+# 表示項目を指定した場合も必ず取得する列 (楽曲名, 難易度, プレイ人数)
+REQUIRED_KEYS = ["music_title", "difficulty_name", "count"]
+# 絞り込みの条件の順序 (WHERE句の条件はこの順に並べる. music_titleは楽曲名の完全一致)
+FILTER_ORDER = ["music_title"] + Column.filter_info
+# ページ送りの条件のキー (問い合わせのキーに含める順)
+PAGE_KEYS = ["page_size", "sort", "order", "cursor", "is_backward"]
+_DIFFICULTY_ORDER = {name: i for i, name in enumerate(Column.difficulties)}
+
+
+def encode_page_cursor(key_values) -> str:
+    """
+    ページの境界となる行のキー (並び替えの列の値, 楽曲名, 難易度) をURLに埋め込める文字列に変換
+
+    Args:
+        key_values (list): 並び替えの列の値, 楽曲名, 難易度のリスト
+
+    Returns:
+        str: URLセーフなBase64文字列
+    """
+    data = json.dumps(list(key_values), ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_page_cursor(cursor):
+    """
+    encode_page_cursorで変換した文字列を元に戻す
+
+    Args:
+        cursor (str): URLセーフなBase64文字列
+
+    Returns:
+        list or None: 並び替えの列の値, 楽曲名, 難易度のリスト (不正な文字列の場合はNone)
+    """
+    try:
+        data = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        key_values = json.loads(data.decode("utf-8"))
+    except (ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(key_values, list) or len(key_values) != 3:
+        return None
+    # SQLのプレースホルダとスナップショットの比較に使えない値 (配列・オブジェクトなど) を含む場合は不正とみなす
+    for value in key_values:
+        if value is None or isinstance(value, str):
+            continue
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            return None
+        if isinstance(value, float) and not math.isfinite(value):
+            return None
+    return key_values
+
 
-def make_sql_from_form(form, filter, display) -> tuple:
+def parse_page_params(form, display) -> dict:
     """
-    検索フォームから受け取った検索条件・表示項目からSQL文を生成
+    検索フォームからページ送りの条件 (件数・並び替え・カーソル) を取得
 
     Args:
         form (dict): 検索条件・表示項目を含むフォームデータ
-        filter (list): 検索条件に用いるhtml内のnameリスト
-        display (list): 表示項目に用いるhtml内のnameリスト
+        display (list): 並び替えに指定できる列のリスト
+
+    Returns:
+        dict: page_size, sort, order, cursor, is_backward をキーとする辞書
+    """
+    try:
+        page_size = int(form.getvalue("page_size", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+    if page_size not in PAGE_SIZES:
+        page_size = DEFAULT_PAGE_SIZE
+    # 並び替えの列はSQL文に直接埋め込むため、表示項目の列名に限定する
+    sort = form.getvalue("sort", DEFAULT_SORT_KEY)
+    if sort not in display:
+        sort = DEFAULT_SORT_KEY
+    order = "desc" if form.getvalue("order") == "desc" else "asc"
+    # after: 次のページ (カーソルより後ろ), before: 前のページ (カーソルより前)
+    cursor, is_backward = None, False
+    if form.getvalue("before"):
+        cursor, is_backward = decode_page_cursor(form.getvalue("before")), True
+    elif form.getvalue("after"):
+        cursor = decode_page_cursor(form.getvalue("after"))
+    if cursor is None:
+        is_backward = False
+    return {
+        "page_size": page_size,
+        "sort": sort,
+        "order": order,
+        "cursor": cursor,
+        "is_backward": is_backward,
+    }
+
+
+def make_search_condition(column, value, normalize=False) -> tuple:
+    """
+    楽曲名・作曲者の部分一致検索の条件を生成
+
+    3文字以上の場合はtrigramの全文検索インデックス (sdvx_search) を用いる.
+    3文字未満の場合やワイルドカード (%, _) を含む場合はインデックスを使えないため、各行を走査する
+
+    Args:
+        column (str): 検索するカラム名 (music_titleまたはartist)
+        value (str): 検索する文字列
+        normalize (bool, optional): 全角・半角, カタカナ・ひらがなを区別しないかどうか
+
+    Returns:
+        tuple (str, str): WHERE句の条件, プレースホルダに対応する値
+    """
+    if normalize:
+        column += "_norm"
+        value = normalize_text(value)
+    if len(value) >= 3 and "%" not in value and "_" not in value:
+        condition = f"rowid IN (SELECT rowid FROM sdvx_search WHERE {column} LIKE ?)"
+    elif normalize:
+        # 正規化した文字列はsdvx_searchにのみあるため、インデックスを使わずに走査する
+        # (FTS5は3バイト以上のパターンにインデックスを使おうとするため、式にして無効にする)
+        condition = (
+            f"rowid IN (SELECT rowid FROM sdvx_search WHERE {column} || '' LIKE ?)"
+        )
+    else:
+        condition = f"{column} LIKE ?"
+    return condition, f"%{value}%"
+
+
+def parse_format(form) -> bool:
+    """
+    検索フォームから表示形式を取得
+
+    Args:
+        form (dict): 表示形式を含むフォームデータ
 
     Returns:
-        tuple (str, list, list, bool, bool):
-        SQL文, プレースホルダに対応する値, 表示項目, 達成人数の割合表示フラグ, プレイ人数表示フラグ
+        bool: 達成人数の割合表示フラグ (整数でない値の場合は割合表示)
     """
-    # 1. SELECT句の作成
     # formatフラグを取得
     # 0 (False): 人数表示, 1 (True): 達成率表示
-    is_percent = bool(int(form.getvalue("format")))
+    is_percent = _parse_int(form.getvalue("format", "1"))
+    return True if is_percent is None else bool(is_percent)
+
+
+def parse_display_keys(form, display) -> tuple:
+    """
+    検索フォームから表示項目と表示形式を取得
+
+    表示項目はチェックボックスの順序・重複によらず、displayの順に並べる
+
+    Args:
+        form (dict): 検索条件・表示項目を含むフォームデータ
+        display (list): 表示項目に用いるhtml内のnameリスト
+
+    Returns:
+        tuple (list, bool, bool): 表示項目, 達成人数の割合表示フラグ, プレイ人数表示フラグ
+    """
+    is_percent = parse_format(form)
     # 表示する項目を取得して記憶
-    select_keys = [name for name in display if form.getvalue(name)]
-    is_count_display = "count" in select_keys
+    selected = {name for name in display if form.getvalue(name)}
+    is_count_display = "count" in selected
     # 表示する列がない場合は全ての列を表示する
-    if not select_keys:
-        columns = "*"
-        select_keys = Column.display_info
-    else:
+    if selected:
         # プレイ人数, 難易度, 楽曲名は必ず検索する (プレイ人数は指定がなければ表示しない)
-        # TODO: プレイ人数周りの処理の冗長性を解消したい
-        required_columns = ["count", "difficulty_name", "music_title"]
-        for col in required_columns:
-            if col not in select_keys:
-                select_keys.insert(0, col)
-        columns = ", ".join(select_keys)
-
-    # 2. WHERE句の作成
-    conditions = []
-    # プレースホルダに対応する値を格納 (SQLインジェクション対策)
-    values = []
+        selected.update(REQUIRED_KEYS)
+    return (
+        [name for name in display if not selected or name in selected],
+        is_percent,
+        is_count_display,
+    )
+
+
+def parse_filters(form, filter) -> dict:
+    """
+    検索フォームから絞り込みの条件を取得
+
+    Args:
+        form (dict): 検索条件・表示項目を含むフォームデータ
+        filter (list): 検索条件に用いるhtml内のnameリスト
+
+    Returns:
+        dict: 指定された条件のnameと値 (レベルは整数のリスト, 難易度は難易度名のリスト, 部分一致検索は文字列) の辞書
+    """
+    filters = {}
     for name in filter:
         value = form.getlist(name)
         if value:
             if name == "level_filter":
-                level_values = [f"{int(v)}" for v in value]
-                conditions.append(f"level IN ({create_placeholder(level_values)})")
-                values.extend(level_values)
+                # 整数でない値は無視する
+                levels = [
+                    level for level in map(_parse_int, value) if level is not None
+                ]
+                if levels:
+                    filters[name] = levels
+            elif name == "difficulty":
+                # 難易度の番号の範囲外 (負の値を含む) の値は無視する
+                difficulties = [
+                    Column.difficulties[index]
+                    for index in map(_parse_int, value)
+                    if index is not None and 0 <= index < len(Column.difficulties)
+                ]
+                if difficulties:
+                    filters[name] = difficulties
+            elif name in Column.search_filters and value != [""]:
+                filters[name] = value[0]
+    return filters
+
+
+def _parse_int(value):
+    """
+    フォームの値を整数に変換
+
+    Args:
+        value (str): フォームの値
+
+    Returns:
+        int or None: 整数 (変換できない場合はNone)
+    """
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_filters(filters) -> dict:
+    """
+    絞り込みの条件を正規化
+
+    レベルは昇順, 難易度はColumn.difficultiesの順に並べて重複を除き, 条件はFILTER_ORDERの順に並べる
+
+    Args:
+        filters (dict): 絞り込みの条件 (FILTER_ORDERにない条件は無視する)
+
+    Returns:
+        dict: 正規化した絞り込みの条件
+    """
+    normalized = {}
+    for name in FILTER_ORDER:
+        if name not in filters:
+            continue
+        value = filters[name]
+        if name == "level_filter":
+            value = sorted(set(value))
+        elif name == "difficulty":
+            value = sorted(
+                set(value),
+                key=lambda v: (_DIFFICULTY_ORDER.get(v, len(_DIFFICULTY_ORDER)), v),
+            )
+        normalized[name] = value
+    return normalized
+
+
+class Query:
+    """
+    正規化した問い合わせ (取得する列・絞り込みの条件・並び替え・件数) とそのSQL文
+
+    絞り込みの値は整列して重複を除き、条件は決まった順に並べるため、同じ意味の問い合わせからは
+    同じSQL文 (SQLiteの文キャッシュで再利用される) と同じキーが得られる.
+    keyは検索結果のキャッシュのキー, digestはプロセスをまたいでも変わらないハッシュとして使う
+    """
+
+    def __init__(
+        self,
+        select_keys,
+        filters=None,
+        table="sdvx_stats",
+        order=None,
+        limit=None,
+        page=None,
+        normalize=False,
+    ):
+        """
+        Args:
+            select_keys (list): 取得する列のリスト (重複は除く)
+            filters (dict, optional): 絞り込みの条件 (parse_filtersの条件と楽曲名の完全一致のmusic_title)
+            table (str, optional): テーブル名
+            order (list, optional): 並び替えの (式, "ASC"または"DESC") のリスト
+            limit (int, optional): 取得する行数の上限
+            page (dict, optional): parse_page_paramsで取得したページ送りの条件 (指定した場合はorder・limitより優先する)
+            normalize (bool, optional): 部分一致検索で全角・半角, カタカナ・ひらがなを区別しないかどうか
+        """
+        self.table = table
+        self.select_keys = list(dict.fromkeys(select_keys))
+        self.filters = normalize_filters(filters or {})
+        self.order = [tuple(item) for item in order or []]
+        self.limit = limit
+        # 全件表示 (page_sizeが0) はページ送りなしと同じ問い合わせになる
+        self.page = page if page is not None and page["page_size"] else None
+        # 部分一致検索がない場合は正規化の有無でSQL文が変わらない
+        self.normalize = bool(normalize) and any(
+            name in Column.search_filters for name in self.filters
+        )
+        self.sql, self.values = self._build_sql()
+        self.key = json.dumps(
+            [
+                self.table,
+                self.select_keys,
+                list(self.filters.items()),
+                self.order,
+                self.limit,
+                None if self.page is None else [self.page[k] for k in PAGE_KEYS],
+                self.normalize,
+            ],
+            ensure_ascii=False,
+        )
+        self.digest = hashlib.sha256(self.key.encode("utf-8")).hexdigest()[:16]
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Query) and self.key == other.key
+
+    def __hash__(self) -> int:
+        return hash(self.key)
+
+    def __repr__(self) -> str:
+        return f"Query({self.digest}: {self.sql})"
+
+    def _build_sql(self) -> tuple:
+        """
+        SQL文を生成
+
+        pageを指定した場合は、カーソル (前のページの境界の行) を起点に並び替えの列・楽曲名・難易度の順で
+        ソートし、1ページ分 (+1行) だけを取得するSQL文を生成する (キーセットページング).
+        並び替えの列の値は各行の末尾に追加される.
+        楽曲名・作曲者の部分一致検索は全文検索インデックス (sdvx_search) を用いる
+
+        Returns:
+            tuple (str, list): SQL文, プレースホルダに対応する値
+        """
+        # 1. SELECT句の作成
+        # 表示する列がすべての列の場合は*で取得する
+        if self.table == "sdvx_stats" and self.select_keys == Column.display_info:
+            columns = "*"
+        else:
+            columns = ", ".join(self.select_keys)
+
+        # 2. WHERE句の作成
+        conditions = []
+        # プレースホルダに対応する値を格納 (SQLインジェクション対策)
+        values = []
+        for name, value in self.filters.items():
+            if name == "music_title":
+                conditions.append("music_title = ?")
+                values.append(value)
+            elif name == "level_filter":
+                conditions.append(f"level IN ({create_placeholder(value)})")
+                values.extend(value)
             elif name == "difficulty":
-                difficulty_values = [f"{Column.difficulties[int(v)]}" for v in value]
+                conditions.append(f"difficulty_name IN ({create_placeholder(value)})")
+                values.extend(value)
+            else:
+                condition, search_value = make_search_condition(
+                    Column.search_filters[name], value, self.normalize
+                )
+                conditions.append(condition)
+                values.append(search_value)
+
+        # 3. 並び替え (ページ送りの場合はキーセットページング)
+        order_clause = ""
+        if self.page is not None:
+            page = self.page
+            sort = page["sort"]
+            # 前のページを取得する場合は逆順に並べて取得し、表示時に元の順に戻す
+            is_desc = (page["order"] == "desc") != page["is_backward"]
+            direction = "DESC" if is_desc else "ASC"
+            if page["cursor"] is not None:
                 conditions.append(
-                    f"difficulty_name IN ({create_placeholder(difficulty_values)})"
+                    f"({sort}, music_title, difficulty_name) {'<' if is_desc else '>'} (?, ?, ?)"
                 )
-                values.extend(difficulty_values)
-            elif name == "music_title_filter" and value != [""]:
-                conditions.append("music_title LIKE ?")
-                values.append(f"%{value[0]}%")
-            elif name == "artist_filter" and value != [""]:
-                conditions.append("artist LIKE ?")
-                values.append(f"%{value[0]}%")
+                values.extend(page["cursor"])
+            columns += f", {sort}"
+            order_clause = (
+                f" ORDER BY {sort} {direction}, music_title {direction}, "
+                + f"difficulty_name {direction} LIMIT {page['page_size'] + 1}"
+            )
+        else:
+            if self.order:
+                order_clause = " ORDER BY " + ", ".join(
+                    f"{expression} {direction}" for expression, direction in self.order
+                )
+            if self.limit is not None:
+                order_clause += f" LIMIT {int(self.limit)}"
+
+        where_clause = " AND ".join(conditions)
+        if where_clause:
+            where_clause = f" WHERE {where_clause}"
+        return f"SELECT {columns} FROM {self.table}{where_clause}{order_clause}", values
+
+
+def make_sql_from_form(form, filter, display, page=None, normalize=False) -> tuple:
+    """
+    検索フォームから受け取った検索条件・表示項目から問い合わせを生成
+
+    同じ意味のフォーム (チェックボックスの順序・重複が違うだけのフォーム) からは同じ問い合わせが得られる
+
+    Args:
+        form (dict): 検索条件・表示項目を含むフォームデータ
+        filter (list): 検索条件に用いるhtml内のnameリスト
+        display (list): 表示項目に用いるhtml内のnameリスト
+        page (dict, optional): parse_page_paramsで取得したページ送りの条件
+        normalize (bool, optional): 部分一致検索で全角・半角, カタカナ・ひらがなを区別しないかどうか
+
+    Returns:
+        tuple (Query, bool, bool): 問い合わせ, 達成人数の割合表示フラグ, プレイ人数表示フラグ
+    """
+    select_keys, is_percent, is_count_display = parse_display_keys(form, display)
+    query = Query(
+        select_keys, parse_filters(form, filter), page=page, normalize=normalize
+    )
+    return query, is_percent, is_count_display
+
+
+# ホームのランキングに表示する列
+# 楽曲名, 難易度, レベル, 作曲者, プレイ人数, 全体の平均スコア, インペリアル1の平均スコア, 後光暴龍天の平均スコア
+RANKING_KEYS = [
+    "music_title",
+    "difficulty_name",
+    "level",
+    "artist",
+    "count",
+    "avg_score",
+    "avg_vf_10_i",
+    "avg_skill_12_h",
+]
+
+
+def make_ranking_sql() -> Query:
+    """
+    ホームに載せる平均スコアランキングの問い合わせを生成
+
+    レベル18以上のMXM相当の楽曲の中で平均スコアが低い順に10曲のデータを取得する (トップ10に入りうる楽曲)
+
+    Returns:
+        Query: 問い合わせ
+    """
+    # 18~20のレベルかつMXM相当の楽曲を対象にする
+    filters = {"level_filter": [18, 19, 20], "difficulty": Column.difficulties[3:]}
+    return Query(RANKING_KEYS, filters, order=[("avg_score", "ASC")], limit=10)
+
+
+def make_deviation_sql(music_title, difficulties) -> Query:
+    """
+    偏差値計算のための統計データ (すべての列) を取得する問い合わせを生成
 
-    where_clause = " AND ".join(conditions)
+    Args:
+        music_title (str): 楽曲名
+        difficulties (list): 難易度名のリスト
+
+    Returns:
+        Query: 問い合わせ
+    """
+    filters = {"music_title": music_title, "difficulty": difficulties}
+    return Query(Column.display_info, filters)
 
-    if where_clause:
-        where_clause = f"WHERE {where_clause}"
-    sql = f"SELECT {columns} FROM sdvx_stats {where_clause}"
 
-    return sql, values, select_keys, is_percent, is_count_display
+# make_batch_deviation_sqlで取得する列 (entry_idは渡した譜面のリストの添字)
+BATCH_DEVIATION_KEYS = ["entry_id", "level", "avg_score", "sd_score"]
+
+
+def make_batch_deviation_sql(charts) -> tuple:
+    """
+    複数の譜面の偏差値計算のための統計データを1回で取得するSQL文を生成
+
+    譜面のリストをJSONの配列として1つのプレースホルダに渡し、主キー (楽曲名, 難易度) で結合する
+
+    Args:
+        charts (list): (楽曲名, 難易度) のリスト
+
+    Returns:
+        tuple (str, list, list): SQL文, プレースホルダに対応する値, 取得する列
+    """
+    sql = (
+        "WITH entries (entry_id, music_title, difficulty_name) AS ("
+        + "SELECT key, value ->> 0, value ->> 1 FROM json_each(?)) "
+        + f"SELECT entries.entry_id, {', '.join(BATCH_DEVIATION_KEYS[1:])} "
+        + "FROM entries JOIN sdvx_stats USING (music_title, difficulty_name)"
+    )
+    values = [json.dumps([list(chart) for chart in charts], ensure_ascii=False)]
+    return sql, values, list(BATCH_DEVIATION_KEYS)
+
+
+def make_summary_sql(form) -> Query:
+    """
+    集計表 (sdvx_summary) から検索フォームで指定したレベル・難易度の行を取得する問い合わせを生成
+
+    Args:
+        form (dict): 検索条件を含むフォームデータ
+
+    Returns:
+        Query: 問い合わせ
+    """
+    filters = parse_filters(form, ["level_filter", "difficulty"])
+    # 難易度はColumn.difficultiesの順に並べる
+    difficulty_order = (
+        "CASE difficulty_name "
+        + " ".join(
+            f"WHEN '{name}' THEN {i}" for i, name in enumerate(Column.difficulties)
+        )
+        + " END"
+    )
+    return Query(
+        Column.summary_keys,
+        filters,
+        table="sdvx_summary",
+        order=[("level", "ASC"), (difficulty_order, "ASC")],
+    )
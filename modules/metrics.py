@@ -0,0 +1,498 @@
+# -*- coding: utf-8 -*-
+
+"""リクエストの処理時間の計測とPrometheus形式での出力"""
+
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+# 計測する処理の段階
+# parse: フォームの解析, build_sql: SQL文の生成, query: 問い合わせ (行の取得まで),
+# render: 検索結果のHTMLの生成, template: テンプレートへの埋め込み, encode: エンコード・圧縮
+PHASES = ["parse", "build_sql", "query", "render", "template", "encode"]
+# 処理時間のヒストグラムの上限 (秒)
+DURATION_BUCKETS = [
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+]
+# サンプリングしたリクエストから求める分位数
+SAMPLE_QUANTILES = [0.5, 0.95, 0.99]
+METRICS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# 処理中のリクエストの計測 (スレッド・ASGIのタスクごとに別の値を持つ)
+_current_timer = contextvars.ContextVar("sdvx_request_timer", default=None)
+
+
+class RequestTimer:
+    """
+    1リクエストの段階ごとの処理時間・行数・レスポンスのサイズ
+    """
+
+    __slots__ = ("route", "status", "start", "phases", "rows", "response_bytes")
+
+    def __init__(self, route="other"):
+        """
+        Args:
+            route (str, optional): リクエストの種類 (home, result, api_searchなど)
+        """
+        self.route = route
+        self.status = "200"
+        self.start = time.perf_counter()
+        self.phases = {}  # 段階 -> 処理時間 (秒)
+        self.rows = 0  # 取得した行数
+        self.response_bytes = 0  # レスポンスボディのバイト数
+
+    def add(self, phase, seconds) -> None:
+        """
+        段階の処理時間を加算
+
+        Args:
+            phase (str): 段階
+            seconds (float): 処理時間 (秒)
+        """
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def elapsed(self) -> float:
+        """
+        リクエストの開始からの経過時間を取得
+
+        Returns:
+            float: 経過時間 (秒)
+        """
+        return time.perf_counter() - self.start
+
+
+def start_timer(timer):
+    """
+    処理中のリクエストの計測を設定する
+
+    Args:
+        timer (RequestTimer): 計測
+
+    Returns:
+        contextvars.Token: end_timerに渡すトークン
+    """
+    return _current_timer.set(timer)
+
+
+def end_timer(token) -> None:
+    """
+    start_timerで設定した計測を解除する
+
+    Args:
+        token (contextvars.Token): start_timerの戻り値
+    """
+    _current_timer.reset(token)
+
+
+def current_timer():
+    """
+    処理中のリクエストの計測を取得
+
+    Returns:
+        RequestTimer or None: 計測 (計測していない場合はNone)
+    """
+    return _current_timer.get()
+
+
+@contextmanager
+def timed(phase):
+    """
+    withブロックの処理時間を処理中のリクエストの段階の処理時間に加算する (計測していない場合は何もしない)
+
+    Args:
+        phase (str): 段階
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(phase, time.perf_counter() - start)
+
+
+def count_rows(rows):
+    """
+    取得した行数を処理中のリクエストの計測に加算する
+
+    Args:
+        rows (list): 取得した行のリスト
+
+    Returns:
+        list: rowsをそのまま返す
+    """
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.rows += len(rows)
+    return rows
+
+
+class TimedIterator:
+    """
+    ストリーミングのレスポンスボディを送信しながら、生成にかかった時間とバイト数を計測するイテレータ
+
+    最後まで送信したとき (または途中で閉じられたとき) にon_closeを1度だけ呼び出す
+    """
+
+    def __init__(self, chunks, timer, on_close, phase="render"):
+        """
+        Args:
+            chunks (Iterator[bytes]): レスポンスボディの断片のイテレータ
+            timer (RequestTimer): リクエストの計測
+            on_close (callable): 計測を終えたときにtimerを渡して呼び出す関数
+            phase (str, optional): 断片の生成にかかった時間を加算する段階
+        """
+        self._chunks = chunks
+        self._timer = timer
+        self._on_close = on_close
+        self._phase = phase
+        self._closed = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> bytes:
+        start = time.perf_counter()
+        token = _current_timer.set(self._timer)
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self.close()
+            raise
+        finally:
+            _current_timer.reset(token)
+            self._timer.add(self._phase, time.perf_counter() - start)
+        self._timer.response_bytes += len(chunk)
+        return chunk
+
+    def close(self) -> None:
+        """元のイテレータを閉じて計測を終える"""
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if hasattr(self._chunks, "close"):
+                self._chunks.close()
+        finally:
+            self._on_close(self._timer)
+
+
+def _escape_label(value) -> str:
+    """
+    ラベルの値をPrometheusのテキスト形式でエスケープ
+
+    Args:
+        value: ラベルの値
+
+    Returns:
+        str: エスケープした文字列
+    """
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels) -> str:
+    """
+    ラベルをPrometheusのテキスト形式に変換
+
+    Args:
+        labels (dict): ラベル名 -> 値
+
+    Returns:
+        str: {name="value",...} の文字列 (ラベルがない場合は空文字列)
+    """
+    if not labels:
+        return ""
+    items = ",".join(
+        f'{name}="{_escape_label(value)}"' for name, value in labels.items()
+    )
+    return "{" + items + "}"
+
+
+class _Histogram:
+    """累積のヒストグラム (バケットの上限ごとの件数・合計・件数)"""
+
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(DURATION_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value) -> None:
+        self.counts[bisect_left(DURATION_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    リクエストの計測を集計し、Prometheusのテキスト形式で出力する
+
+    リクエスト数・段階ごとの処理時間のヒストグラム・行数・バイト数はすべてのリクエストで集計し,
+    段階ごとの内訳を含む個々のリクエストの記録はsample_every件に1件だけリングバッファに残す
+    (分位数はリングバッファから求める)
+    """
+
+    def __init__(self, sample_every=10, ring_size=1024):
+        """
+        Args:
+            sample_every (int, optional): 何件に1件のリクエストをリングバッファに残すか
+            ring_size (int, optional): リングバッファに残すリクエストの上限
+        """
+        self.sample_every = max(1, sample_every)
+        self.samples = deque(
+            maxlen=ring_size
+        )  # (経路, 状態, 処理時間, 段階ごとの処理時間, 行数, バイト数)
+        self._lock = threading.Lock()
+        self._recorded = 0
+        self._requests = {}  # (経路, 状態) -> 件数
+        self._durations = {}  # 経路 -> _Histogram
+        self._phases = {}  # 段階 -> _Histogram
+        self._phase_seconds = {}  # (経路, 段階) -> 処理時間の合計
+        self._rows = {}  # 経路 -> 行数の合計
+        self._bytes = {}  # 経路 -> バイト数の合計
+        self.slow_queries = 0
+
+    def record(self, timer) -> None:
+        """
+        1リクエストの計測を集計する
+
+        Args:
+            timer (RequestTimer): リクエストの計測
+        """
+        elapsed = timer.elapsed()
+        route = timer.route
+        with self._lock:
+            key = (route, timer.status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._durations.get(route)
+            if histogram is None:
+                histogram = self._durations[route] = _Histogram()
+            histogram.observe(elapsed)
+            for phase, seconds in timer.phases.items():
+                histogram = self._phases.get(phase)
+                if histogram is None:
+                    histogram = self._phases[phase] = _Histogram()
+                histogram.observe(seconds)
+                key = (route, phase)
+                self._phase_seconds[key] = self._phase_seconds.get(key, 0.0) + seconds
+            self._rows[route] = self._rows.get(route, 0) + timer.rows
+            self._bytes[route] = self._bytes.get(route, 0) + timer.response_bytes
+            self._recorded += 1
+            if self._recorded % self.sample_every == 0:
+                self.samples.append(
+                    (
+                        route,
+                        timer.status,
+                        elapsed,
+                        dict(timer.phases),
+                        timer.rows,
+                        timer.response_bytes,
+                    )
+                )
+
+    def record_slow_query(self) -> None:
+        """遅い問い合わせの件数を加算"""
+        with self._lock:
+            self.slow_queries += 1
+
+    def render(self, gauges=None) -> str:
+        """
+        集計結果をPrometheusのテキスト形式で出力
+
+        Args:
+            gauges (dict, optional): 追加で出力する値 (メトリクス名 -> (説明, 値))
+
+        Returns:
+            str: Prometheusのテキスト形式の文字列
+        """
+        lines = []
+
+        def header(name, help_text, metric_type):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+
+        def histogram_lines(name, labels, histogram):
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS + ["+Inf"], histogram.counts):
+                cumulative += count
+                bucket_labels = dict(labels, le=bound)
+                lines.append(
+                    f"{name}_bucket{_format_labels(bucket_labels)} {cumulative}"
+                )
+            lines.append(f"{name}_sum{_format_labels(labels)} {histogram.total}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram.count}")
+
+        with self._lock:
+            header("sdvx_requests_total", "処理したリクエスト数", "counter")
+            for (route, status), count in sorted(self._requests.items()):
+                labels = _format_labels({"route": route, "status": status})
+                lines.append(f"sdvx_requests_total{labels} {count}")
+
+            header("sdvx_request_duration_seconds", "リクエストの処理時間", "histogram")
+            for route, histogram in sorted(self._durations.items()):
+                histogram_lines(
+                    "sdvx_request_duration_seconds", {"route": route}, histogram
+                )
+
+            header(
+                "sdvx_phase_duration_seconds",
+                "段階ごとの処理時間 (1リクエストあたり)",
+                "histogram",
+            )
+            for phase in PHASES:
+                if phase in self._phases:
+                    histogram_lines(
+                        "sdvx_phase_duration_seconds",
+                        {"phase": phase},
+                        self._phases[phase],
+                    )
+
+            header(
+                "sdvx_phase_seconds_total", "経路・段階ごとの処理時間の合計", "counter"
+            )
+            for (route, phase), seconds in sorted(self._phase_seconds.items()):
+                labels = _format_labels({"route": route, "phase": phase})
+                lines.append(f"sdvx_phase_seconds_total{labels} {seconds}")
+
+            header("sdvx_rows_total", "取得した行数の合計", "counter")
+            for route, rows in sorted(self._rows.items()):
+                lines.append(
+                    f"sdvx_rows_total{_format_labels({'route': route})} {rows}"
+                )
+
+            header(
+                "sdvx_response_bytes_total",
+                "レスポンスボディのバイト数の合計",
+                "counter",
+            )
+            for route, size in sorted(self._bytes.items()):
+                labels = _format_labels({"route": route})
+                lines.append(f"sdvx_response_bytes_total{labels} {size}")
+
+            header("sdvx_slow_queries_total", "遅い問い合わせの件数", "counter")
+            lines.append(f"sdvx_slow_queries_total {self.slow_queries}")
+
+            samples = list(self.samples)
+
+        # サンプリングしたリクエストの処理時間の分位数
+        header(
+            "sdvx_sampled_request_duration_seconds",
+            "サンプリングしたリクエストの処理時間",
+            "summary",
+        )
+        durations = {}
+        for route, _, elapsed, _, _, _ in samples:
+            durations.setdefault(route, []).append(elapsed)
+        for route, values in sorted(durations.items()):
+            values.sort()
+            for quantile in SAMPLE_QUANTILES:
+                index = min(len(values) - 1, int(quantile * len(values)))
+                labels = _format_labels({"route": route, "quantile": quantile})
+                lines.append(
+                    f"sdvx_sampled_request_duration_seconds{labels} {values[index]}"
+                )
+            labels = _format_labels({"route": route})
+            lines.append(
+                f"sdvx_sampled_request_duration_seconds_sum{labels} {sum(values)}"
+            )
+            lines.append(
+                f"sdvx_sampled_request_duration_seconds_count{labels} {len(values)}"
+            )
+
+        for name, (help_text, value) in (gauges or {}).items():
+            header(name, help_text, "gauge")
+            lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_query_plan(plan_rows) -> str:
+    """
+    EXPLAIN QUERY PLANの結果を字下げしたテキストに変換
+
+    Args:
+        plan_rows (list): (id, parent, notused, detail) の行のリスト
+
+    Returns:
+        str: 1行に1ステップの実行計画
+    """
+    depths = {0: 0}
+    lines = []
+    for node_id, parent, _, detail in plan_rows:
+        depth = depths.get(parent, 0) + 1
+        depths[node_id] = depth
+        lines.append("  " * depth + str(detail))
+    return "\n".join(lines)
+
+
+class StartupTimer:
+    """
+    起動処理の段階ごとの所要時間 (python -X importtimeと同じ形式で出力する)
+
+    作成した時点までのプロセスのCPU時間を「インタプリタの起動とモジュールの読み込み」として記録する
+    """
+
+    def __init__(self):
+        self.phases = []  # (段階, 秒) のリスト (記録した順)
+        self._lock = threading.Lock()
+        self.add("interpreter+imports (cpu)", time.process_time())
+
+    def add(self, phase, seconds) -> None:
+        """
+        段階の所要時間を記録
+
+        Args:
+            phase (str): 段階の名前
+            seconds (float): 所要時間 (秒)
+        """
+        with self._lock:
+            self.phases.append((phase, seconds))
+
+    @contextmanager
+    def phase(self, phase):
+        """
+        withブロックの実行時間を段階の所要時間として記録するコンテキストマネージャ
+
+        Args:
+            phase (str): 段階の名前
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start)
+
+    def report(self) -> str:
+        """
+        記録した所要時間をpython -X importtimeと同じ形式のテキストに変換
+
+        Returns:
+            str: 1行に1段階の所要時間 (マイクロ秒) と累計
+        """
+        lines = ["startup time: self [us] | cumulative | phase"]
+        cumulative = 0
+        with self._lock:
+            phases = list(self.phases)
+        for phase, seconds in phases:
+            cumulative += int(seconds * 1e6)
+            lines.append(
+                f"startup time: {int(seconds * 1e6):>9} | {cumulative:>10} | {phase}"
+            )
+        return "\n".join(lines)
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+
+"""検索結果 (生成済みのテーブルHTML・行ごとのHTML) のキャッシュ"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+def make_cache_key(query, is_percent, is_count_display) -> tuple:
+    """
+    問い合わせと表示形式からキャッシュのキーを生成
+
+    Args:
+        query (Query): make_sql_from_formなどで生成した問い合わせ
+        is_percent (bool): 達成率を表示するかどうか
+        is_count_display (bool): プレイ人数を表示するかどうか
+
+    Returns:
+        tuple: ハッシュ可能なキャッシュのキー
+    """
+    # 問い合わせのキーは同じ意味の検索条件で同じになるように正規化されている
+    return (query.key, bool(is_percent), bool(is_count_display))
+
+
+class ResultCache:
+    """
+    件数・合計サイズ・有効期限で上限を設けたLRUキャッシュ
+
+    データのバージョンが変わった (データベースが更新された) 場合はすべて破棄する
+    """
+
+    def __init__(
+        self,
+        max_entries=128,
+        max_bytes=64 * 1024 * 1024,
+        max_entry_bytes=1024 * 1024,
+        ttl=None,
+    ):
+        """
+        Args:
+            max_entries (int, optional): 保持するエントリ数の上限
+            max_bytes (int, optional): 保持するHTMLの合計文字数の上限
+            max_entry_bytes (int, optional): 1エントリあたりのHTMLの文字数の上限
+            ttl (float, optional): エントリの有効期限 (秒, Noneなら無期限)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+
+        self._entries = OrderedDict()  # キー -> (値, サイズ, 保存時刻)
+        self._lock = threading.Lock()
+        self._bytes = 0  # 保持しているHTMLの合計文字数
+        self._version = None  # キャッシュしているデータのバージョン
+
+        # 統計情報
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _sizeof(value) -> int:
+        """
+        キャッシュする値 (文字列またはそのタプル) のサイズを計算
+
+        Args:
+            value (str or tuple): キャッシュする値
+
+        Returns:
+            int: 文字数の合計
+        """
+        if isinstance(value, str):
+            return len(value)
+        return sum(len(item) for item in value)
+
+    def _evict(self, key) -> None:
+        """
+        エントリを削除 (ロックを取得した状態で呼び出す)
+
+        Args:
+            key (tuple): 削除するキー
+        """
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def validate(self, version) -> None:
+        """
+        データのバージョンが変わっていればキャッシュをすべて破棄
+
+        Args:
+            version (int): 現在のデータのバージョン
+        """
+        with self._lock:
+            if self._version != version:
+                self._entries.clear()
+                self._bytes = 0
+                self._version = version
+
+    def get(self, key):
+        """
+        キャッシュから値を取得
+
+        Args:
+            key (tuple): キャッシュのキー
+
+        Returns:
+            キャッシュされた値 (存在しないか期限切れの場合はNone)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self.ttl is not None:
+                if time.monotonic() - entry[2] > self.ttl:
+                    self._evict(key)
+                    entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value) -> None:
+        """
+        キャッシュに値を保存 (上限を超えた場合は最も古く使われたものから破棄)
+
+        Args:
+            key (tuple): キャッシュのキー
+            value (str or tuple): キャッシュする値
+        """
+        size = self._sizeof(value)
+        # 1件で上限を超える値はキャッシュしない
+        if size > min(self.max_entry_bytes, self.max_bytes):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._evict(key)
+            self._entries[key] = (value, size, time.monotonic())
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+
+    def clear(self) -> None:
+        """キャッシュをすべて破棄"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """
+        キャッシュの統計情報を取得
+
+        Returns:
+            dict: エントリ数・合計サイズ・ヒット数・ミス数・ヒット率の辞書
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
+
+
+class RowFragmentCache:
+    """
+    検索結果の行ごとの生成済みのHTML (<tr>～</tr>) を保持するキャッシュ
+
+    キーは表示形式 (表示する列, 達成率表示, プレイ人数表示) と譜面 (楽曲名, 難易度) の組.
+    検索条件が違っても同じ譜面の行は同じHTMLになるため、重なりのある検索結果で再利用できる.
+    合計サイズが上限を超える場合は最も古く使われた表示形式の行からまとめて破棄する.
+    データのバージョンが変わった (データベースが更新された) 場合はすべて破棄する
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024):
+        """
+        Args:
+            max_bytes (int, optional): 保持するHTMLの合計文字数の上限
+        """
+        self.max_bytes = max_bytes
+
+        self._modes = OrderedDict()  # 表示形式 -> {譜面: HTML}
+        self._sizes = {}  # 表示形式 -> 保持しているHTMLの文字数
+        self._lock = threading.Lock()
+        self._bytes = 0  # 保持しているHTMLの合計文字数
+        self._version = None  # キャッシュしているデータのバージョン
+
+        # 統計情報 (行単位)
+        self.hits = 0
+        self.misses = 0
+
+    def validate(self, version) -> None:
+        """
+        データのバージョンが変わっていればキャッシュをすべて破棄
+
+        Args:
+            version (int): 現在のデータのバージョン
+        """
+        with self._lock:
+            if self._version != version:
+                self._clear()
+                self._version = version
+
+    def get_many(self, mode, charts) -> list:
+        """
+        複数の譜面の行のHTMLをキャッシュから取得
+
+        Args:
+            mode (tuple): 表示形式
+            charts (list): 譜面 (楽曲名, 難易度) のリスト
+
+        Returns:
+            list: 行のHTMLのリスト (キャッシュにない譜面はNone)
+        """
+        with self._lock:
+            fragments = self._modes.get(mode)
+            if fragments is None:
+                self.misses += len(charts)
+                return [None] * len(charts)
+            self._modes.move_to_end(mode)
+            found = list(map(fragments.get, charts))
+            misses = found.count(None)
+            self.hits += len(found) - misses
+            self.misses += misses
+            return found
+
+    def put_many(self, mode, charts, fragments) -> None:
+        """
+        複数の譜面の行のHTMLをキャッシュに保存
+
+        Args:
+            mode (tuple): 表示形式
+            charts (list): 譜面 (楽曲名, 難易度) のリスト
+            fragments (list): 各譜面の行のHTML
+        """
+        size = sum(map(len, fragments))
+        with self._lock:
+            # 他の表示形式の行を古いものから破棄して空きを作る
+            for oldest in [other for other in self._modes if other != mode]:
+                if self._bytes + size <= self.max_bytes:
+                    break
+                self._modes.pop(oldest)
+                self._bytes -= self._sizes.pop(oldest)
+            if self._bytes + size > self.max_bytes:
+                return
+            cached = self._modes.setdefault(mode, {})
+            self._modes.move_to_end(mode)
+            for chart, fragment in zip(charts, fragments):
+                previous = cached.get(chart)
+                if previous is not None:
+                    size -= len(previous)
+                cached[chart] = fragment
+            self._sizes[mode] = self._sizes.get(mode, 0) + size
+            self._bytes += size
+
+    def _clear(self) -> None:
+        """キャッシュをすべて破棄 (ロックを取得した状態で呼び出す)"""
+        self._modes.clear()
+        self._sizes.clear()
+        self._bytes = 0
+
+    def clear(self) -> None:
+        """キャッシュをすべて破棄"""
+        with self._lock:
+            self._clear()
+
+    def stats(self) -> dict:
+        """
+        キャッシュの統計情報を取得
+
+        Returns:
+            dict: 表示形式の数・行数・合計サイズ・ヒット数・ミス数・ヒット率の辞書
+        """
+        with self._lock:
+            requests = self.hits + self.misses
+            return {
+                "modes": len(self._modes),
+                "rows": sum(len(fragments) for fragments in self._modes.values()),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+            }
@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+
+"""スコアグレードの達成人数から求めた譜面ごとのスコア分布"""
+
+from array import array
+from bisect import bisect_right
+
+from data import Column
+
+# スコアグレードの下限のスコア (低い順) と最高スコア
+GRADE_SCORES = [Column.score_grade_threshold[key] for key in Column.score_grade]
+_KNOT_SCORES = GRADE_SCORES + [Column.max_score]
+# スコアグレードの区間 (あるグレードの下限から次のグレードの下限まで) の中央のスコア
+_MIDDLE_SCORES = [(low + high) / 2 for low, high in zip(_KNOT_SCORES, _KNOT_SCORES[1:])]
+# 譜面ごとの分布の節点の数 (最低グレード未満の人の下限, スコアグレードの下限, 10,000,000)
+DISTRIBUTION_KNOTS = len(GRADE_SCORES) + 2
+
+
+def distribution_knots(count, grade_counts, puc, avg_score) -> tuple:
+    """
+    スコアグレードの達成人数から、スコアとそのスコア未満の人数の折れ線の節点を求める
+
+    節点の間は人数が一様に分布しているとみなす.
+    最低グレード (B) 未満の人は0～7,000,000の間のどこにいるか分からないため,
+    平均スコアから最低グレード未満の人の平均スコアを逆算し、その平均になる区間に一様に分布させる
+
+    Args:
+        count (int): プレイ人数
+        grade_counts (list): スコアグレードごとの達成人数 (Column.score_gradeの順, そのスコア以上の人数の累積)
+        puc (int): スコアが10,000,000の人数
+        avg_score (int): 平均スコア
+
+    Returns:
+        tuple (list, list): 節点のスコアのリスト, 各スコア未満の人数のリスト
+    """
+    # そのスコア以上の人数 (データの誤差で増えている場合は単調に減るように補正する)
+    at_least = []
+    previous = count
+    for value in list(grade_counts) + [puc]:
+        previous = min(previous, max(value or 0, 0))
+        at_least.append(previous)
+
+    lower = 0
+    low_count = count - at_least[0]
+    if low_count > 0 and avg_score:
+        # 最低グレード以上の人は区間の中央のスコアとみなして合計を求める
+        upper_sum = at_least[-1] * Column.max_score
+        for middle, high, low in zip(_MIDDLE_SCORES, at_least, at_least[1:]):
+            upper_sum += (high - low) * middle
+        low_mean = (count * avg_score - upper_sum) / low_count
+        lower = int(min(max(2 * low_mean - GRADE_SCORES[0], 0), GRADE_SCORES[0] - 1))
+    return [lower] + _KNOT_SCORES, [0] + [count - value for value in at_least]
+
+
+class ScoreDistributionIndex:
+    """
+    譜面ごとのスコア分布 (スコアとそのスコア未満の人数の折れ線) を並べた配列
+
+    平均スコアと標準偏差による偏差値は正規分布を仮定するが、実際の分布は10,000,000付近に偏っているため,
+    スコアグレードの達成人数から求めた分布でスコアのパーセンタイルを求める (節点の二分探索).
+    データベースの内容は変わらない前提で作成し、データのバージョンが変わったら作り直す
+    """
+
+    def __init__(self, rows, version=None):
+        """
+        Args:
+            rows (Iterable[tuple]): (楽曲名, 難易度, プレイ人数, PUCの人数, スコアグレードごとの達成人数..., 平均スコア) の行
+            version (int, optional): 索引を作成したデータのバージョン
+        """
+        self.version = version
+        self._charts = {}  # (楽曲名, 難易度) -> 譜面の番号
+        self._counts = array("q")  # 譜面ごとのプレイ人数
+        self._scores = array("q")  # 譜面ごとの節点のスコア (DISTRIBUTION_KNOTS個ずつ)
+        self._below = array("q")  # 譜面ごとの節点のスコア未満の人数
+        for music_title, difficulty_name, count, puc, *grades, avg_score in rows:
+            count = max(count or 0, 0)
+            scores, below = distribution_knots(count, grades, puc, avg_score)
+            self._charts[(music_title, difficulty_name)] = len(self._counts)
+            self._counts.append(count)
+            self._scores.extend(scores)
+            self._below.extend(below)
+
+    @classmethod
+    def load(cls, con, version=None) -> "ScoreDistributionIndex":
+        """
+        データベースから索引を作成
+
+        Args:
+            con (sqlite3.Connection): データベースの接続
+            version (int, optional): 現在のデータのバージョン
+
+        Returns:
+            ScoreDistributionIndex: 作成した索引
+        """
+        keys = ["music_title", "difficulty_name", "count", "per"]
+        keys += Column.score_grade + ["avg_score"]
+        return cls(con.execute(f"SELECT {', '.join(keys)} FROM sdvx_stats"), version)
+
+    def percentile(self, music_title, difficulty_name, score):
+        """
+        スコアのパーセンタイル (そのスコア未満の人の割合) を求める
+
+        Args:
+            music_title (str): 楽曲名
+            difficulty_name (str): 難易度
+            score (int): スコア
+
+        Returns:
+            float or None: パーセンタイル (0～100, 譜面がない・プレイ人数が0の場合はNone)
+        """
+        index = self._charts.get((music_title, difficulty_name))
+        if index is None or not self._counts[index]:
+            return None
+        start = index * DISTRIBUTION_KNOTS
+        end = start + DISTRIBUTION_KNOTS
+        scores, below = self._scores, self._below
+        position = bisect_right(scores, score, start, end)
+        if position == start:
+            players_below = 0
+        elif position == end:
+            players_below = below[end - 1]
+        else:
+            low, high = position - 1, position
+            players_below = below[low] + (below[high] - below[low]) * (
+                score - scores[low]
+            ) / (scores[high] - scores[low])
+        return round(players_below / self._counts[index] * 100, 3)
@@ -0,0 +1,507 @@
+# -*- coding: utf-8 -*-
+
+"""複数のリクエストを並行して処理するWSGIサーバ"""
+
+import io
+import os
+import queue
+import selectors
+import signal
+import socket
+import threading
+import time
+from wsgiref.simple_server import ServerHandler, WSGIRequestHandler, WSGIServer
+
+
+class KeepAliveServerHandler(ServerHandler):
+    """
+    HTTP/1.1のキープアライブに対応したレスポンスの送信処理
+
+    Content-Lengthが分からないレスポンス (ストリーミング) はchunked形式で送信する
+    """
+
+    http_version = "1.1"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._chunked = False  # chunked形式で送信するかどうか
+
+    def cleanup_headers(self) -> None:
+        """Content-Length・Transfer-Encoding・Connectionヘッダを設定"""
+        super().cleanup_headers()
+        request_handler = self.request_handler
+        status_code = self.status.split(" ", 1)[0]
+        if "Content-Length" not in self.headers and status_code not in ("204", "304"):
+            if request_handler.request_version == "HTTP/1.1":
+                self.headers["Transfer-Encoding"] = "chunked"
+                self._chunked = True
+            else:
+                # 長さが分からない場合は接続を閉じてレスポンスの終わりを伝える
+                request_handler.close_connection = True
+        if request_handler.close_connection:
+            self.headers["Connection"] = "close"
+        elif request_handler.request_version != "HTTP/1.1":
+            self.headers["Connection"] = "keep-alive"
+
+    def write(self, data) -> None:
+        """
+        レスポンスボディを送信 (chunked形式の場合は長さを付けて送信)
+
+        Args:
+            data (bytes): 送信するデータ
+        """
+        assert type(data) is bytes, "write() argument must be a bytes instance"
+        if not self.status:
+            raise AssertionError("write() before start_response()")
+        if not self.headers_sent:
+            self.bytes_sent = 0
+            self.send_headers()
+        if self._chunked:
+            if not data:
+                return
+            self._write(b"%X\r\n" % len(data) + data + b"\r\n")
+        else:
+            self._write(data)
+        self.bytes_sent += len(data)
+        self._flush()
+
+    def sendfile(self) -> bool:
+        """
+        wsgi.file_wrapperで返されたファイルをsendfileでソケットに直接送信する (ユーザ空間にコピーしない)
+
+        chunked形式の場合や、ファイル記述子のないファイルの場合は通常の送信処理 (write) に任せる
+
+        Returns:
+            bool: 送信した場合はTrue
+        """
+        if self._chunked:
+            return False
+        file = getattr(self.result, "filelike", None)
+        try:
+            file.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            return False
+        if not self.headers_sent:
+            self.bytes_sent = 0
+            self.send_headers()
+        self._flush()
+        # socket.sendfileはos.sendfileで送信し、タイムアウトの設定されたソケットでも送信し終わるまで待つ
+        self.bytes_sent += self.request_handler.connection.sendfile(file)
+        return True
+
+    def finish_content(self) -> None:
+        """レスポンスの終わりを送信"""
+        if not self._chunked:
+            super().finish_content()
+            return
+        if not self.headers_sent:
+            self.send_headers()
+        self._write(b"0\r\n\r\n")
+        self._flush()
+
+
+class KeepAliveConnection:
+    """
+    キープアライブ中の接続 (ソケットと、リクエストをまたいで使う読み込みバッファ)
+    """
+
+    def __init__(self, sock, client_address):
+        """
+        Args:
+            sock (socket.socket): 接続のソケット
+            client_address (tuple): クライアントのアドレス
+        """
+        self.socket = sock
+        self.client_address = client_address
+        self.rfile = sock.makefile("rb")
+        self.idle_since = time.monotonic()  # 次のリクエストを待ち始めた時刻
+
+    def fileno(self) -> int:
+        """selectorsで監視するためのファイル記述子"""
+        return self.socket.fileno()
+
+    def has_buffered_request(self) -> bool:
+        """
+        次のリクエストを読み込み済みかどうか (パイプライン化されたリクエスト) を判定
+
+        読み込みバッファにデータがあるとソケットは読み込み可能にならないため、ブロックせずに確認する
+
+        Returns:
+            bool: 読み込みバッファにデータがあればTrue
+        """
+        self.socket.setblocking(False)
+        try:
+            return bool(self.rfile.peek(1))
+        except OSError:
+            return False
+
+    def close(self) -> None:
+        """ソケットを閉じる"""
+        try:
+            self.socket.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+        self.rfile.close()
+        self.socket.close()
+
+
+class KeepAliveRequestHandler(WSGIRequestHandler):
+    """
+    キープアライブの接続で1つのリクエストを処理する (HTTP/1.1のキープアライブ)
+
+    ワーカースレッドは1リクエストだけを処理し、次のリクエストを待つ接続はサーバに返す
+    (アイドル状態の接続がワーカースレッドを占有しないようにする)
+    """
+
+    protocol_version = "HTTP/1.1"
+    # リクエストが届き始めてから読み終わるまでの最大秒数
+    timeout = 10
+    # ヘッダとボディを別々に書き込むため、Nagleアルゴリズムと遅延ACKで送信が約40ms止まらないようにする
+    disable_nagle_algorithm = True
+
+    def setup(self) -> None:
+        """接続の読み込みバッファを引き継ぎ、書き込み用のファイルを作成"""
+        self.connection = self.request.socket
+        self.connection.settimeout(self.timeout)
+        if self.disable_nagle_algorithm:
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, True)
+        self.rfile = self.request.rfile
+        self.wfile = self.connection.makefile("wb", 0)
+
+    def finish(self) -> None:
+        """書き込み用のファイルだけを閉じる (接続と読み込みバッファは次のリクエストで使う)"""
+        self.wfile.close()
+
+    def handle(self) -> None:
+        """1つのリクエストを処理"""
+        self.close_connection = True
+        self.handle_one_request()
+
+    def handle_one_request(self) -> None:
+        """1つのリクエストを処理"""
+        try:
+            self.raw_requestline = self.rfile.readline(65537)
+        except (socket.timeout, ConnectionError):
+            self.close_connection = True
+            return
+        if not self.raw_requestline:
+            self.close_connection = True
+            return
+        if len(self.raw_requestline) > 65536:
+            self.requestline = ""
+            self.request_version = ""
+            self.command = ""
+            self.send_error(414)
+            return
+
+        # parse_requestはConnectionヘッダとHTTPのバージョンからclose_connectionを設定する
+        if not self.parse_request():
+            return
+        # リクエストボディを読み残すと次のリクエストを解析できないため、GET/HEAD以外は接続を閉じる
+        if self.command not in ("GET", "HEAD"):
+            self.close_connection = True
+
+        handler = KeepAliveServerHandler(
+            self.rfile,
+            self.wfile,
+            self.get_stderr(),
+            self.get_environ(),
+            multithread=True,
+        )
+        handler.request_handler = self
+        handler.run(self.server.get_app())
+        self.wfile.flush()
+
+    def log_message(self, format, *args) -> None:
+        """server.quietがTrueの場合はアクセスログを出力しない"""
+        if not getattr(self.server, "quiet", False):
+            super().log_message(format, *args)
+
+
+class PooledWSGIServer(WSGIServer):
+    """
+    一定数のワーカースレッドでリクエストを処理するWSGIサーバ
+
+    受け付けた接続は上限付きのキューに入れられ、キューが一杯の場合は503を返して接続を閉じる.
+    ワーカースレッドは1リクエストごとに接続を返し、次のリクエストを待つ接続は
+    1つのスレッドがselectorsでまとめて監視する (リクエストが届いたらキューに入れ直す).
+    keepalive_timeout秒以上リクエストが届かない接続は閉じる
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        server_address,
+        app,
+        threads=8,
+        queue_size=64,
+        backlog=128,
+        quiet=False,
+        handler_class=KeepAliveRequestHandler,
+        keepalive_timeout=5,
+    ):
+        """
+        Args:
+            server_address (tuple): (ホスト名, ポート番号)
+            app (callable): WSGIアプリケーション
+            threads (int, optional): ワーカースレッドの数
+            queue_size (int, optional): 処理待ちの接続の上限
+            backlog (int, optional): listenのバックログ
+            quiet (bool, optional): アクセスログを出力しないかどうか
+            handler_class (type, optional): リクエストハンドラのクラス
+            keepalive_timeout (float, optional): 次のリクエストを待つ最大秒数
+        """
+        # listen()の前に設定する必要がある
+        self.request_queue_size = backlog
+        self.quiet = quiet
+        super().__init__(server_address, handler_class)
+        self.set_app(app)
+
+        self.threads = threads
+        self.keepalive_timeout = keepalive_timeout
+        self._requests = queue.Queue(maxsize=queue_size)
+        self._workers = []
+        # 次のリクエストを待つ接続 (ワーカースレッドから監視するスレッドに渡す)
+        self._parked = []
+        self._parked_lock = threading.Lock()
+        self._idle_thread = None
+        self._idle_stop = False
+        self._wakeup_reader, self._wakeup_writer = None, None
+
+    def start_workers(self) -> None:
+        """
+        ワーカースレッドと待機中の接続を監視するスレッドを起動する
+
+        プロセスをフォークする場合はフォーク後に呼び出す
+        """
+        for _ in range(self.threads):
+            worker = threading.Thread(target=self._work, daemon=True)
+            worker.start()
+            self._workers.append(worker)
+        self._wakeup_reader, self._wakeup_writer = socket.socketpair()
+        self._wakeup_reader.setblocking(False)
+        self._wakeup_writer.setblocking(False)
+        self._idle_thread = threading.Thread(target=self._watch_idle, daemon=True)
+        self._idle_thread.start()
+
+    def _work(self) -> None:
+        """キューから接続を取り出して1リクエストを処理するワーカースレッド"""
+        while True:
+            connection = self._requests.get()
+            if connection is None:
+                break
+            keep_alive = False
+            try:
+                handler = self.RequestHandlerClass(
+                    connection, connection.client_address, self
+                )
+                keep_alive = not handler.close_connection
+            except Exception:
+                self.handle_error(connection.socket, connection.client_address)
+            if keep_alive and not self._idle_stop:
+                self._park(connection)
+            else:
+                connection.close()
+
+    def _park(self, connection) -> None:
+        """
+        次のリクエストを待つ接続をサーバに返す (読み込み済みのリクエストがあればすぐにキューに入れる)
+
+        Args:
+            connection (KeepAliveConnection): 接続
+        """
+        if connection.has_buffered_request():
+            self._enqueue(connection)
+            return
+        connection.idle_since = time.monotonic()
+        with self._parked_lock:
+            self._parked.append(connection)
+        self._wakeup()
+
+    def _wakeup(self) -> None:
+        """監視するスレッドのselectを中断させる"""
+        try:
+            self._wakeup_writer.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def _watch_idle(self) -> None:
+        """次のリクエストを待つ接続を監視するスレッド"""
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup_reader, selectors.EVENT_READ)
+        while not self._idle_stop:
+            with self._parked_lock:
+                parked, self._parked = self._parked, []
+            for connection in parked:
+                selector.register(connection, selectors.EVENT_READ)
+            for key, _ in selector.select(timeout=1):
+                if key.fileobj is self._wakeup_reader:
+                    try:
+                        self._wakeup_reader.recv(4096)
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                # リクエスト (または切断) が届いた接続はワーカースレッドに渡す
+                selector.unregister(key.fileobj)
+                self._enqueue(key.fileobj)
+            # 一定時間リクエストが届かない接続を閉じる
+            deadline = time.monotonic() - self.keepalive_timeout
+            for key in list(selector.get_map().values()):
+                connection = key.fileobj
+                if connection is not self._wakeup_reader and (
+                    connection.idle_since < deadline
+                ):
+                    selector.unregister(connection)
+                    connection.close()
+        for key in list(selector.get_map().values()):
+            if key.fileobj is not self._wakeup_reader:
+                key.fileobj.close()
+        with self._parked_lock:
+            parked, self._parked = self._parked, []
+        for connection in parked:
+            connection.close()
+        selector.close()
+
+    def _enqueue(self, connection) -> None:
+        """
+        接続をキューに入れる (キューが一杯の場合は503を返して閉じる)
+
+        Args:
+            connection (KeepAliveConnection): 接続
+        """
+        try:
+            self._requests.put_nowait(connection)
+        except queue.Full:
+            try:
+                connection.socket.setblocking(True)
+                connection.socket.sendall(
+                    b"HTTP/1.1 503 Service Unavailable\r\n"
+                    + b"Content-Length: 0\r\nConnection: close\r\nRetry-After: 1\r\n\r\n"
+                )
+            except OSError:
+                pass
+            connection.close()
+
+    def process_request(self, request, client_address) -> None:
+        """
+        受け付けた接続をキューに入れる (キューが一杯の場合は503を返す)
+
+        Args:
+            request (socket.socket): 接続のソケット
+            client_address (tuple): クライアントのアドレス
+        """
+        self._enqueue(KeepAliveConnection(request, client_address))
+
+    def server_close(self) -> None:
+        """処理待ちの接続をすべて処理してからワーカースレッドを終了し、待機中の接続を閉じる"""
+        super().server_close()
+        for _ in self._workers:
+            self._requests.put(None)
+        for worker in self._workers:
+            worker.join()
+        if self._idle_thread is not None:
+            self._idle_stop = True
+            self._wakeup()
+            self._idle_thread.join()
+            self._wakeup_reader.close()
+            self._wakeup_writer.close()
+        # 終了の合図 (None) より後にキューに入れ直された接続・監視に渡されなかった接続を閉じる
+        while True:
+            try:
+                connection = self._requests.get_nowait()
+            except queue.Empty:
+                break
+            if connection is not None:
+                connection.close()
+        with self._parked_lock:
+            parked, self._parked = self._parked, []
+        for connection in parked:
+            connection.close()
+
+
+def _install_shutdown_handler(server) -> None:
+    """
+    SIGTERM・SIGINTを受け取ったらサーバを停止する
+
+    Args:
+        server (socketserver.BaseServer): 停止するサーバ
+    """
+
+    def shutdown(signum, frame):
+        # serve_forever()を実行中のスレッドからshutdown()を呼ぶと停止しないため別スレッドで呼ぶ
+        threading.Thread(target=server.shutdown, daemon=True).start()
+
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+
+
+def serve(
+    app,
+    host="",
+    port=8080,
+    threads=8,
+    processes=1,
+    queue_size=64,
+    backlog=128,
+    quiet=False,
+) -> None:
+    """
+    WSGIアプリケーションを複数スレッド (と複数プロセス) で提供する
+
+    processesが2以上の場合は、待ち受けソケットを作成してからプロセスをフォークし、
+    各プロセスがthreads個のワーカースレッドでリクエストを処理する (SQLiteのファイルは読み込み専用で共有する)
+
+    Args:
+        app (callable): WSGIアプリケーション
+        host (str, optional): 待ち受けるホスト名
+        port (int, optional): 待ち受けるポート番号
+        threads (int, optional): 1プロセスあたりのワーカースレッドの数
+        processes (int, optional): プロセスの数
+        queue_size (int, optional): 1プロセスあたりの処理待ちの接続の上限
+        backlog (int, optional): listenのバックログ
+        quiet (bool, optional): アクセスログを出力しないかどうか
+    """
+    if processes <= 1:
+        server = PooledWSGIServer(
+            (host, port), app, threads, queue_size, backlog, quiet
+        )
+        server.start_workers()
+        _install_shutdown_handler(server)
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+        return
+
+    # ワーカースレッドはフォーク後に各プロセスで起動する
+    server = PooledWSGIServer((host, port), app, threads, queue_size, backlog, quiet)
+    # 複数のプロセスが同じソケットで待ち受けるため、他のプロセスが先に接続を受け付けた場合に
+    # accept()で停止しないようにノンブロッキングにする (受け付けた接続はブロッキングになる)
+    server.socket.setblocking(False)
+    children = []
+    for _ in range(processes):
+        pid = os.fork()
+        if pid == 0:
+            server.start_workers()
+            _install_shutdown_handler(server)
+            try:
+                server.serve_forever()
+            finally:
+                server.server_close()
+            os._exit(0)
+        children.append(pid)
+
+    # 親プロセスはシグナルを子プロセスに転送し、すべての子プロセスの終了を待つ
+    def terminate(signum, frame):
+        for child in children:
+            try:
+                os.kill(child, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, terminate)
+    signal.signal(signal.SIGINT, terminate)
+    for child in children:
+        os.waitpid(child, 0)
+    server.socket.close()
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+
+"""検索のためのメモリ上の列指向スナップショット"""
+
+import re
+import string
+from array import array
+from bisect import bisect_left, bisect_right
+from functools import reduce
+from operator import itemgetter, or_
+
+from utils import normalize_text
+
+from data import Column
+
+# 検索のバックエンドの選択肢 (sqlite: SQLiteに問い合わせる, memory: メモリ上のスナップショットで求める)
+SEARCH_BACKENDS = ["sqlite", "memory"]
+
+# 値ごとのマスクを作っておくカラム (検索フォームの絞り込みに使うカラム)
+BITMAP_COLUMNS = ["level", "difficulty_name", "music_title", "artist"]
+
+# ASCII文字の大文字を小文字に変換する表 (SQLiteのLIKEはASCII文字の大文字・小文字を区別しない)
+_ASCII_LOWER = str.maketrans(string.ascii_uppercase, string.ascii_lowercase)
+
+
+def _int_array(values):
+    """
+    整数の列を配列に変換する (NULLを含む場合はリストのまま)
+
+    Args:
+        values (list): 整数の列
+
+    Returns:
+        array or list: 変換した列
+    """
+    try:
+        return array("q", values)
+    except TypeError:
+        return values
+
+
+def _bitmap(indices, size) -> int:
+    """
+    行番号のリストから行番号をビット位置とするマスクを作成
+
+    Args:
+        indices (list): 行番号のリスト
+        size (int): 行数
+
+    Returns:
+        int: マスク
+    """
+    if not size:
+        return 0
+    bits = bytearray(b"0" * size)
+    for index in indices:
+        bits[size - 1 - index] = ord("1")
+    return int(bits, 2)
+
+
+def _value_bitmaps(values, size) -> dict:
+    """
+    列の値ごとに、その値を持つ行のマスクを作成
+
+    Args:
+        values (Iterable): 列の値
+        size (int): 行数
+
+    Returns:
+        dict: 値 -> マスク
+    """
+    positions = {}
+    for index, value in enumerate(values):
+        positions.setdefault(value, []).append(index)
+    return {value: _bitmap(indices, size) for value, indices in positions.items()}
+
+
+def _like_matcher(value):
+    """
+    SQLiteの「LIKE '%value%'」と同じ判定をする関数を作成
+
+    %は任意の文字列, _は任意の1文字に一致し、ASCII文字の大文字・小文字は区別しない.
+    判定する文字列はASCII文字を小文字に変換しておく
+
+    Args:
+        value (str): 検索する文字列
+
+    Returns:
+        callable: 文字列が一致するかどうかを返す関数
+    """
+    value = value.translate(_ASCII_LOWER)
+    if "%" not in value and "_" not in value:
+        return lambda text: value in text
+    pattern = "".join(
+        ".*" if char == "%" else "." if char == "_" else re.escape(char)
+        for char in value
+    )
+    regex = re.compile(pattern, re.DOTALL)
+    return lambda text: regex.search(text) is not None
+
+
+def _sort_key(values) -> tuple:
+    """
+    並び替えのキーをSQLiteの比較の順序 (NULL < 数値 < 文字列) で比較できるように変換
+
+    Args:
+        values (Iterable): 並び替えの列の値, 楽曲名, 難易度
+
+    Returns:
+        tuple: 変換したキー
+    """
+    key = []
+    for value in values:
+        if value is None:
+            key.append((0, 0))
+        elif isinstance(value, str):
+            key.append((2, value))
+        else:
+            key.append((1, value))
+    return tuple(key)
+
+
+class ColumnarSnapshot:
+    """
+    sdvx_statsの全行を列ごとの配列として保持し、検索フォームの絞り込みをマスクで評価する
+
+    整数型のカラムはarray, 文字列型のカラムは値の辞書と符号の配列 (辞書符号化) で保持する.
+    マスクは行番号をビット位置とする整数で表し、絞り込みの組み合わせは整数のAND・ORで全行分をまとめて求める.
+    データベースの内容は変わらない前提で作成し、データのバージョンが変わったら作り直す
+    """
+
+    def __init__(self, rows, version=None):
+        """
+        Args:
+            rows (Iterable[tuple]): Column.display_infoの順に値を並べたsdvx_statsの行
+            version (int, optional): スナップショットを作成したデータのバージョン
+        """
+        self.version = version
+        rows = list(rows)
+        self.size = len(rows)
+        self.columns = {}  # カラム名 -> 値の配列 (文字列型のカラムは符号の配列)
+        self.dictionaries = {}  # 文字列型のカラム名 -> 符号に対応する値のリスト
+        for index, key in enumerate(Column.display_info):
+            values = [row[index] for row in rows]
+            if key in Column.text_columns:
+                codes = {}
+                self.columns[key] = array(
+                    "I", [codes.setdefault(value, len(codes)) for value in values]
+                )
+                self.dictionaries[key] = list(codes)
+            else:
+                self.columns[key] = _int_array(values)
+        # 絞り込みに使うカラムは値ごとのマスクを作っておく
+        self.bitmaps = {
+            key: _value_bitmaps(self._take(key, range(self.size)), self.size)
+            for key in BITMAP_COLUMNS
+        }
+        # 部分一致検索で判定する値 (ASCII文字を小文字に変換した値と正規化した値) とマスクの組
+        self.search_values = {}
+        self.normalized_values = {}
+        for key in Column.search_filters.values():
+            bitmaps = self.bitmaps[key].items()
+            self.search_values[key] = [
+                (value.translate(_ASCII_LOWER), mask) for value, mask in bitmaps
+            ]
+            self.normalized_values[key] = [
+                (normalize_text(value), mask) for value, mask in bitmaps
+            ]
+        self._orders = {}  # 並び替えの列 -> (並び替えた行番号, 並び替えのキー)
+
+    @classmethod
+    def load(cls, con, version=None) -> "ColumnarSnapshot":
+        """
+        データベースからスナップショットを作成
+
+        Args:
+            con (sqlite3.Connection): データベースの接続
+            version (int, optional): 現在のデータのバージョン
+
+        Returns:
+            ColumnarSnapshot: 作成したスナップショット
+        """
+        return cls(
+            con.execute(
+                f"SELECT {', '.join(Column.display_info)} FROM sdvx_stats ORDER BY rowid"
+            ),
+            version,
+        )
+
+    def _take(self, key, indices, getter=None) -> list:
+        """
+        指定した行の列の値を取り出す
+
+        Args:
+            key (str): カラム名
+            indices (Iterable[int]): 行番号
+            getter (callable, optional): 配列から行番号の値をまとめて取り出す関数 (itemgetter)
+
+        Returns:
+            list: 列の値のリスト
+        """
+        if getter is None:
+            values = list(map(self.columns[key].__getitem__, indices))
+        else:
+            values = getter(self.columns[key])
+        if key in self.dictionaries:
+            values = list(map(self.dictionaries[key].__getitem__, values))
+        return values
+
+    def filter_mask(self, filters, normalize=False) -> int:
+        """
+        絞り込みの条件に合う行のマスクを求める
+
+        Args:
+            filters (dict): Query.filtersの絞り込みの条件 (music_titleは楽曲名の完全一致)
+            normalize (bool, optional): 部分一致検索で全角・半角, カタカナ・ひらがなを区別しないかどうか
+
+        Returns:
+            int: 条件に合う行のマスク
+        """
+        mask = (1 << self.size) - 1
+        for name, value in filters.items():
+            if name == "music_title":
+                mask &= self.bitmaps["music_title"].get(value, 0)
+            elif name == "level_filter":
+                bitmaps = self.bitmaps["level"]
+                mask &= reduce(or_, (bitmaps.get(v, 0) for v in value), 0)
+            elif name == "difficulty":
+                bitmaps = self.bitmaps["difficulty_name"]
+                mask &= reduce(or_, (bitmaps.get(v, 0) for v in value), 0)
+            elif name in Column.search_filters:
+                key = Column.search_filters[name]
+                if normalize:
+                    matches = _like_matcher(normalize_text(value))
+                    candidates = self.normalized_values[key]
+                else:
+                    matches = _like_matcher(value)
+                    candidates = self.search_values[key]
+                mask &= reduce(
+                    or_, (bitmap for text, bitmap in candidates if matches(text)), 0
+                )
+        return mask
+
+    def _order(self, sort) -> tuple:
+        """
+        並び替えの列・楽曲名・難易度の昇順に並べた行番号と並び替えのキーを求める (列ごとに1度だけ求める)
+
+        Args:
+            sort (str): 並び替えの列
+
+        Returns:
+            tuple (list, list): 並び替えた行番号, 並び替えのキー
+        """
+        order = self._orders.get(sort)
+        if order is None:
+            rows = zip(
+                self._take(sort, range(self.size)),
+                self._take("music_title", range(self.size)),
+                self._take("difficulty_name", range(self.size)),
+            )
+            keys = sorted((_sort_key(row), index) for index, row in enumerate(rows))
+            order = ([index for _, index in keys], [key for key, _ in keys])
+            self._orders[sort] = order
+        return order
+
+    def _page_indices(self, bits, page) -> list:
+        """
+        1ページ分 (+1行) の行番号を、make_sql_from_form(page指定)のSQL文と同じ順序で求める
+
+        Args:
+            bits (str): 行番号の位置の文字が"1"の行が条件に合う
+            page (dict): ページ送りの条件
+
+        Returns:
+            list: 行番号のリスト
+        """
+        order, keys = self._order(page["sort"])
+        # 前のページを取得する場合は逆順に並べて取得する
+        is_desc = (page["order"] == "desc") != page["is_backward"]
+        if page["cursor"] is None:
+            start = len(order) - 1 if is_desc else 0
+        elif is_desc:
+            start = bisect_left(keys, _sort_key(page["cursor"])) - 1
+        else:
+            start = bisect_right(keys, _sort_key(page["cursor"]))
+        positions = range(start, -1, -1) if is_desc else range(start, len(order))
+        limit = page["page_size"] + 1
+        indices = []
+        for position in positions:
+            index = order[position]
+            if bits[index] == "1":
+                indices.append(index)
+                if len(indices) >= limit:
+                    break
+        return indices
+
+    def search(self, filters, select_keys, page=None, normalize=False) -> list:
+        """
+        make_sql_from_formのSQL文と同じ行をスナップショットから求める
+
+        pageを指定しない場合はrowidの順に並べる
+
+        Args:
+            filters (dict): Query.filtersの絞り込みの条件
+            select_keys (list): 表示する列のリスト
+            page (dict, optional): parse_page_paramsで取得したページ送りの条件
+            normalize (bool, optional): 部分一致検索で全角・半角, カタカナ・ひらがなを区別しないかどうか
+
+        Returns:
+            list: 検索結果の行のリスト (pageを指定した場合は各行の末尾に並び替えの列の値を追加)
+        """
+        # 行番号の位置の文字が"1"の行が条件に合う
+        bits = format(self.filter_mask(filters, normalize), f"0{self.size}b")[::-1]
+        if page is not None and page["page_size"]:
+            indices = self._page_indices(bits, page)
+            keys = select_keys + [page["sort"]]
+        else:
+            indices = [index for index, bit in enumerate(bits) if bit == "1"]
+            keys = select_keys
+        if len(indices) < 2:
+            return list(zip(*(self._take(key, indices) for key in keys)))
+        # 取り出す行番号は全列で同じなので、itemgetterで列ごとにまとめて取り出す
+        getter = itemgetter(*indices)
+        return list(zip(*(self._take(key, indices, getter) for key in keys)))
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+
+"""静的ファイル (スタイルシート・画像) の配信"""
+
+import hashlib
+import os
+import posixpath
+import re
+import threading
+from urllib.parse import parse_qs
+
+from modules.api import format_http_date, is_not_modified
+from modules.compression import (
+    COMPRESS_MIN_SIZE,
+    accepts_gzip,
+    add_vary,
+    compressed_headers,
+    gzip_bytes,
+    is_compressible,
+)
+
+# 配信するディレクトリと拡張子 (これ以外のファイルは配信しない)
+STATIC_DIRS = {
+    "html": [".css"],
+    "img": [".jpg", ".jpeg", ".png", ".gif", ".svg", ".ico", ".webp"],
+}
+# 拡張子とContent-Typeの対応 (mimetypesはシステムの設定ファイルの読み込みに時間がかかるため使わない)
+CONTENT_TYPES = {
+    ".css": "text/css; charset=utf-8",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".svg": "image/svg+xml",
+    ".ico": "image/vnd.microsoft.icon",
+    ".webp": "image/webp",
+}
+# これ以下の大きさのファイルはメモリ上に保持する (大きいファイルは送信のたびにファイルから読み込む)
+STATIC_CACHE_MAX_SIZE = 64 * 1024
+# ファイルから送信する場合の1回あたりの読み込みサイズ
+STATIC_CHUNK_SIZE = 64 * 1024
+# 内容のハッシュ付きのURLと付いていないURLのCache-Control
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+DEFAULT_CACHE_CONTROL = "no-cache"
+
+# スタイルシート中のurl(...)のパターン
+CSS_URL_PATTERN = re.compile(r"url\(\s*(['\"]?)([^'\")?#]+)\1\s*\)")
+
+
+class StaticAsset:
+    """
+    配信する静的ファイルの情報 (小さいファイルは内容とgzipで圧縮した内容も保持する)
+    """
+
+    def __init__(self, url, filename, data, mtime, rewritten=False):
+        """
+        Args:
+            url (str): 配信するパス (例: /html/sty.css)
+            filename (str): ファイル名
+            data (bytes): ファイルの内容 (スタイルシートはURLを書き換えた内容)
+            mtime (int): ファイルの更新時刻 (ナノ秒)
+            rewritten (bool, optional): 内容を書き換えたかどうか (書き換えた場合は大きさによらずメモリ上に保持する)
+        """
+        self.url = url
+        self.filename = filename
+        self.mtime = mtime
+        self.size = len(data)
+        self.digest = hashlib.sha256(data).hexdigest()[:12]
+        self.content_type = CONTENT_TYPES.get(
+            os.path.splitext(filename)[1].lower(), "application/octet-stream"
+        )
+        self.data = data if rewritten or self.size <= STATIC_CACHE_MAX_SIZE else None
+        headers = [("Content-Type", self.content_type)]
+        self.compressible = is_compressible(headers) and self.size >= COMPRESS_MIN_SIZE
+        self.gzip_data = (
+            gzip_bytes(data) if self.compressible and self.data is not None else None
+        )
+
+    @property
+    def versioned_url(self) -> str:
+        """内容のハッシュを付けたURL"""
+        return f"{self.url}?v={self.digest}"
+
+
+class StaticFiles:
+    """
+    STATIC_DIRSのファイルを起動時に読み込み、内容のハッシュ付きのURLで配信する
+
+    ハッシュ付きのURL (?v=ハッシュ) は内容が変わるとURLも変わるため、長期間キャッシュさせる.
+    スタイルシート中の画像のURLもハッシュ付きのURLに書き換える.
+    auto_reloadがTrueの場合は、ファイルの更新時刻が変わったときに読み込み直す (開発用)
+    """
+
+    def __init__(self, directories=None, auto_reload=False):
+        """
+        Args:
+            directories (dict, optional): ディレクトリと配信する拡張子のリストの辞書
+            auto_reload (bool, optional): ファイルの更新を検知して読み込み直すかどうか
+        """
+        self.directories = STATIC_DIRS if directories is None else directories
+        self.auto_reload = auto_reload
+        self.assets = {}  # 配信するパス -> StaticAsset
+        self._lock = threading.Lock()
+        self.scan()
+
+    def scan(self) -> None:
+        """配信するファイルをすべて読み込む (スタイルシートは画像を読み込んだ後に読み込む)"""
+        filenames = []
+        for directory, extensions in self.directories.items():
+            if not os.path.isdir(directory):
+                continue
+            for name in sorted(os.listdir(directory)):
+                if os.path.splitext(name)[1].lower() in extensions:
+                    filenames.append(posixpath.join(directory, name))
+        filenames.sort(key=lambda filename: filename.endswith(".css"))
+        for filename in filenames:
+            self._load(filename)
+
+    def _load(self, filename) -> StaticAsset:
+        """
+        ファイルを読み込んで保持する
+
+        Args:
+            filename (str): ファイル名
+
+        Returns:
+            StaticAsset: 読み込んだファイルの情報
+        """
+        mtime = os.stat(filename).st_mtime_ns
+        with open(filename, "rb") as file:
+            data = file.read()
+        url = "/" + filename
+        rewritten = filename.endswith(".css")
+        if rewritten:
+            data = self._rewrite_css(url, data.decode("utf-8")).encode("utf-8")
+        asset = StaticAsset(url, filename, data, mtime, rewritten)
+        with self._lock:
+            self.assets[url] = asset
+        return asset
+
+    def _rewrite_css(self, url, css) -> str:
+        """
+        スタイルシート中の相対URLを、内容のハッシュ付きのURLに書き換える
+
+        Args:
+            url (str): スタイルシートのパス
+            css (str): スタイルシートの内容
+
+        Returns:
+            str: 書き換えたスタイルシート
+        """
+
+        def replace(match):
+            quote, target = match.groups()
+            path = posixpath.normpath(posixpath.join(posixpath.dirname(url), target))
+            asset = self.assets.get(path)
+            if asset is None:
+                return match.group(0)
+            return f"url({quote}{target}?v={asset.digest}{quote})"
+
+        return CSS_URL_PATTERN.sub(replace, css)
+
+    def digest(self) -> str:
+        """
+        配信するすべてのファイルの内容から求めたハッシュ
+
+        Returns:
+            str: ハッシュ (ファイルのどれかが変わると変わる)
+        """
+        with self._lock:
+            parts = [
+                f"{url}:{asset.digest}" for url, asset in sorted(self.assets.items())
+            ]
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:12]
+
+    def url_for(self, url) -> str:
+        """
+        配信するファイルのパスを内容のハッシュ付きのURLに変換 (テンプレートの書き換えに使用)
+
+        Args:
+            url (str): ファイルのパス (例: /html/sty.css)
+
+        Returns:
+            str: ハッシュ付きのURL (配信するファイルでない場合はそのまま)
+        """
+        asset = self.assets.get(url)
+        return url if asset is None else asset.versioned_url
+
+    def get(self, path):
+        """
+        パスに対応するファイルの情報を取得
+
+        Args:
+            path (str): リクエストのパス
+
+        Returns:
+            StaticAsset or None: ファイルの情報 (配信するファイルでない場合はNone)
+        """
+        asset = self.assets.get(path)
+        if asset is None or not self.auto_reload:
+            return asset
+        try:
+            if os.stat(asset.filename).st_mtime_ns != asset.mtime:
+                return self._load(asset.filename)
+        except OSError:
+            return None
+        return asset
+
+    def respond(self, environ, asset) -> tuple:
+        """
+        静的ファイルのレスポンスを作成
+
+        メモリ上に保持しているファイルはその内容 (gzipを受け付ける場合は圧縮済みの内容) を返し,
+        大きいファイルは開いたファイルを返す (wsgi.file_wrapperなどで送信する)
+
+        Args:
+            environ (dict): WSGI環境変数の辞書オブジェクト
+            asset (StaticAsset): 配信するファイルの情報
+
+        Returns:
+            tuple (str, list, bytes or file): ステータス, レスポンスヘッダ, レスポンスボディ
+        """
+        version = parse_qs(environ.get("QUERY_STRING", "")).get("v", [""])[0]
+        etag = f'"{asset.digest}"'
+        last_modified = asset.mtime / 1e9
+        headers = [
+            ("Content-Type", asset.content_type),
+            ("ETag", etag),
+            ("Last-Modified", format_http_date(last_modified)),
+            (
+                "Cache-Control",
+                (
+                    IMMUTABLE_CACHE_CONTROL
+                    if version == asset.digest
+                    else DEFAULT_CACHE_CONTROL
+                ),
+            ),
+        ]
+        if asset.compressible:
+            headers = add_vary(headers)
+        if is_not_modified(environ, etag, last_modified):
+            return "304 Not Modified", headers[1:], b""
+
+        if asset.data is None:
+            headers.append(("Content-Length", str(asset.size)))
+            return "200 OK", headers, open(asset.filename, "rb")
+        body = asset.data
+        if asset.gzip_data is not None and accepts_gzip(environ):
+            body = asset.gzip_data
+            headers = compressed_headers(headers)
+        return "200 OK", headers + [("Content-Length", str(len(body)))], body
+
+
+def iter_file(file, chunk_size=STATIC_CHUNK_SIZE):
+    """
+    ファイルを少しずつ読み込むジェネレータ (wsgi.file_wrapperがない場合に使用)
+
+    Args:
+        file (file): 開いたファイル
+        chunk_size (int, optional): 1回あたりの読み込みサイズ
+
+    Yields:
+        bytes: ファイルの内容の断片
+    """
+    try:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
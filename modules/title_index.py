@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+"""楽曲名の入力補完のためのメモリ上の索引"""
+
+from bisect import bisect_left
+
+from utils import normalize_text
+
+from data import Column
+
+# 入力補完で返す候補の数 (デフォルト値と上限)
+DEFAULT_COMPLETE_LIMIT = 10
+MAX_COMPLETE_LIMIT = 50
+
+
+class TitleIndex:
+    """
+    正規化した楽曲名の昇順に並べた楽曲名と、楽曲ごとの難易度のリスト
+
+    前方一致の候補は二分探索で求め、足りない場合は部分一致の候補で補う.
+    データベースの内容は変わらない前提で作成し、データのバージョンが変わったら作り直す
+    """
+
+    def __init__(self, rows, version=None):
+        """
+        Args:
+            rows (Iterable[tuple]): (楽曲名, 難易度) の行
+            version (int, optional): 索引を作成したデータのバージョン
+        """
+        self.version = version
+        difficulty_order = {name: i for i, name in enumerate(Column.difficulties)}
+        self.difficulties = {}  # 楽曲名 -> 難易度のリスト
+        for music_title, difficulty_name in rows:
+            self.difficulties.setdefault(music_title, []).append(difficulty_name)
+        for difficulties in self.difficulties.values():
+            difficulties.sort(
+                key=lambda name: difficulty_order.get(name, len(Column.difficulties))
+            )
+        # 全角・半角, カタカナ・ひらがなを区別しないように正規化した楽曲名で並べる
+        entries = sorted(
+            (normalize_text(music_title), music_title)
+            for music_title in self.difficulties
+        )
+        self._keys = [key for key, _ in entries]
+        self._titles = [music_title for _, music_title in entries]
+
+    @classmethod
+    def load(cls, con, version=None) -> "TitleIndex":
+        """
+        データベースから索引を作成
+
+        Args:
+            con (sqlite3.Connection): データベースの接続
+            version (int, optional): 現在のデータのバージョン
+
+        Returns:
+            TitleIndex: 作成した索引
+        """
+        return cls(
+            con.execute("SELECT music_title, difficulty_name FROM sdvx_stats"), version
+        )
+
+    def complete(self, query, limit=DEFAULT_COMPLETE_LIMIT) -> list:
+        """
+        入力途中の楽曲名から候補を求める (前方一致を優先し、足りない分を部分一致で補う)
+
+        Args:
+            query (str): 入力途中の楽曲名
+            limit (int, optional): 候補の最大数
+
+        Returns:
+            list: (楽曲名, 難易度のリスト) のリスト
+        """
+        key = normalize_text(query)
+        if not key or limit <= 0:
+            return []
+        music_titles = []
+        index = bisect_left(self._keys, key)
+        while (
+            index < len(self._keys)
+            and self._keys[index].startswith(key)
+            and len(music_titles) < limit
+        ):
+            music_titles.append(self._titles[index])
+            index += 1
+        if len(music_titles) < limit:
+            for title_key, music_title in zip(self._keys, self._titles):
+                if key in title_key and not title_key.startswith(key):
+                    music_titles.append(music_title)
+                    if len(music_titles) >= limit:
+                        break
+        return [
+            (music_title, self.difficulties[music_title])
+            for music_title in music_titles
+        ]
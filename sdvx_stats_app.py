@@ -2,58 +2,759 @@
 
 """SDVXのスコアデータベースを扱うWebアプリケーション"""
 
-# CGIモジュールをインポート
-import cgi
-import cgitb
+import hashlib
+import json
 import os
 
 # sqlite3（SQLサーバ）モジュールをインポート
 import sqlite3
 import sys
-from wsgiref import simple_server
-
-import pandas as pd
+import threading
+import time
 
 from data import Column
 from modules import (
+    API_CONTENT_TYPES,
+    COMPLETE_KEYS,
+    COMPRESS_MIN_SIZE,
+    DEFAULT_BATCH_SIZE,
+    DEFAULT_BATCH_TOP,
+    DEFAULT_COMPLETE_LIMIT,
+    DEVIATION_KEYS,
+    MAX_BATCH_ENTRIES,
+    MAX_BODY_SIZE,
+    MAX_COMPLETE_LIMIT,
+    METRICS_CONTENT_TYPE,
+    SEARCH_BACKENDS,
+    STATIC_CHUNK_SIZE,
+    BoundedExecutor,
+    ColumnarSnapshot,
+    ConnectionPool,
+    ExecutorBusy,
+    FormData,
+    MetricsRegistry,
+    Query,
+    RequestTimer,
+    ResultCache,
+    RowFragmentCache,
+    ScoreDistributionIndex,
+    StartupTimer,
+    StaticFiles,
+    TimedIterator,
+    TitleIndex,
+    accepts_gzip,
+    add_vary,
+    asgi_environ,
+    build_db,
+    compressed_headers,
+    count_rows,
+    create_batch_deviation,
+    create_deviation_rows,
     create_deviation_score_results,
+    create_page_cursors,
+    create_page_links,
+    create_results_header,
     create_results_table,
+    create_rows_html,
+    create_sort_options,
+    create_summary_table,
+    encode_headers,
+    end_timer,
+    format_http_date,
+    format_query_plan,
+    get_api_format,
+    get_content_length,
+    get_data_updated,
+    get_data_version,
+    gzip_bytes,
+    is_compressible,
+    is_csv_modified,
+    is_not_modified,
+    iter_api_rows,
+    iter_file,
+    iter_gzip,
+    iter_results_rows,
+    iter_rows_html,
+    make_batch_deviation_sql,
+    make_build_version,
+    make_cache_key,
+    make_deviation_sql,
+    make_etag,
+    make_ranking_sql,
     make_sql_from_form,
+    make_summary_sql,
+    migrate_db,
+    parse_difficulty_names,
+    parse_format,
+    parse_limit,
+    parse_page_params,
+    parse_score,
+    parse_score_entries,
+    parse_wsgi_form,
+    read_asgi_body,
+    send_response,
+    split_page,
+    start_timer,
+    sync_db,
+    timed,
 )
-from utils import create_placeholder, load_html, print_sql
+from utils import TemplateLoader, encode_chunks
+
+# CGIとして実行された場合だけ例外の詳細をブラウザに表示する
+# (cgitbはpydocなどを読み込み起動が遅くなるため、サーバとして起動する場合は読み込まない)
+if "GATEWAY_INTERFACE" in os.environ:
+    import cgitb
 
-cgitb.enable()
+    cgitb.enable()
 
 
 class SdvxStatsApp:
     """SDVXのスコアデータベースを扱うWebアプリケーション"""
 
-    def __init__(self, dbname="data/sdvx_stats.db", csv_file="data/sdvx_stats.csv"):
+    # 使用するHTMLテンプレート
+    TEMPLATE_FILES = [
+        "html/home.html",
+        "html/about.html",
+        "html/result.html",
+        "html/ss.html",
+        "html/summary.html",
+    ]
+    # 起動時の準備 (楽曲名の索引・スナップショット・行のキャッシュの作成) の実行方法
+    # sync: コンストラクタ内で済ませる, background: バックグラウンドのスレッドで実行する, none: 最初に必要になったときに作成する
+    WARM_UP_MODES = ["sync", "background", "none"]
+
+    def __init__(
+        self,
+        dbname="data/sdvx_stats.db",
+        csv_file="data/sdvx_stats.csv",
+        batch_size=DEFAULT_BATCH_SIZE,
+        sync_interval=60,
+        pool_size=4,
+        pool_timeout=10,
+        cache_size=128,
+        cache_ttl=None,
+        row_cache_bytes=32 * 1024 * 1024,
+        template_reload=False,
+        streaming=True,
+        asgi_queue_size=64,
+        search_normalize=False,
+        backend="sqlite",
+        slow_query_ms=None,
+        metrics_sample_every=10,
+        warm_up="background",
+        score_percentile=True,
+    ):
+        # 起動処理の段階ごとの所要時間 (startup_reportで出力する)
+        self.startup = StartupTimer()
         self.dbname = dbname  # DB名
         self.csv_file = csv_file  # CSVファイル名
-        self.select_keys = []  # 表示する項目管理
-        self.is_count_display = False  # プレイ人数を表示するかどうかのフラグ
-        self.is_percent = False  # 達成者を%表示するかどうかのフラグ
+        self.batch_size = batch_size  # CSV取り込み時の1バッチあたりの行数
+        self.sync_interval = sync_interval  # CSVの更新を確認する間隔 (秒, Noneなら確認しない)
+        self.db_version = 0  # データのバージョン (データが変わるたびに増える)
+        self._last_sync_check = time.monotonic()  # 最後にCSVの更新を確認した時刻
+        self._sync_lock = threading.Lock()  # 差分同期の排他制御
+        self.streaming = streaming  # 検索結果をストリーミングで送信するかどうかのフラグ
+        # 部分一致検索で全角・半角, カタカナ・ひらがなを区別しないかどうかのフラグ
+        self.search_normalize = search_normalize
+        # 検索フォームの絞り込みを求めるバックエンド ("sqlite"または"memory")
+        self.backend = backend
+        # 偏差値計算ページでスコア分布から求めたパーセンタイルも表示するかどうかのフラグ
+        self.score_percentile = score_percentile
+        # リクエストの段階ごとの処理時間の集計 (/metricsで出力する)
+        self.metrics = MetricsRegistry(sample_every=metrics_sample_every)
+        # これより時間のかかった問い合わせを実行計画とともに標準エラー出力に記録する (秒, Noneなら記録しない)
+        self.slow_query_seconds = (
+            None if slow_query_ms is None else slow_query_ms / 1000
+        )
+
+        # 静的ファイル (スタイルシート・画像) は起動時に読み込み、内容のハッシュ付きのURLで配信する
+        with self.startup.phase("static"):
+            self.static = StaticFiles(auto_reload=template_reload)
+        # HTMLテンプレートは起動時に1度だけ読み込む (template_reload=Trueなら更新時に読み込み直す)
+        # テンプレート中の静的ファイルのURLはハッシュ付きのURLに書き換える
+        with self.startup.phase("templates"):
+            self.templates = TemplateLoader(
+                auto_reload=template_reload, url_for=self.static.url_for
+            )
+            self.templates.preload(self.TEMPLATE_FILES)
+        # テンプレート・静的ファイル・プログラムの内容から求めたバージョン (ETagに含め、デプロイ後は304を返さない)
+        self._source_digest = None
+        self.build_version = self._compute_build_version()
+        # 起動時刻 (Last-Modifiedはデータの更新時刻と起動時刻の新しいほうにする)
+        self.started_at = time.time()
 
-        self.init_db()  # データベースの初期化
+        with self.startup.phase("init_db"):
+            self.init_db()  # データベースの初期化
+        # 読み込み専用の接続プール (リクエストごとに接続を開閉しない)
+        # pool_timeout秒待っても接続が空かない場合は503を返す
+        with self.startup.phase("pool"):
+            self.pool = ConnectionPool(
+                self.dbname, size=pool_size, timeout=pool_timeout
+            )
+        # 検索結果のキャッシュ (データベースが更新されると破棄される)
+        self.result_cache = ResultCache(max_entries=cache_size, ttl=cache_ttl)
+        # gzipで圧縮したレスポンスのキャッシュ (GETのレスポンスをURLごとに保持する)
+        self.compressed_cache = ResultCache(max_entries=64, max_bytes=16 * 1024 * 1024)
+        self._last_modified = None  # (データのバージョン, データの最終更新時刻)
+        # 行ごとの生成済みHTMLのキャッシュ (0なら使わない, データベースが更新されると破棄される)
+        self.row_cache = RowFragmentCache(row_cache_bytes) if row_cache_bytes else None
+        # 楽曲名の入力補完の索引と検索用のスナップショット (データベースが更新されたときだけ作り直す)
+        self._title_index = None
+        self._snapshot = None
+        self._score_distribution = None
+        self._index_lock = threading.Lock()
+        # ASGIで問い合わせを実行するスレッドプール (接続プールと同じ数のスレッドで実行する)
+        self.executor = BoundedExecutor(
+            max_workers=pool_size, max_pending=asgi_queue_size
+        )
+        # ASGIで同時に送信中のストリーミングレスポンスの上限
+        # ストリーミング中は送信待ちの間も接続を借りたままになるため、
+        # 少なくとも1つの接続を他のリクエストのために空けておく (すべて借りられるとスレッドが接続待ちで止まる)
+        # asyncioはASGIで起動した場合だけ必要なため、セマフォは最初のリクエストで作成する
+        self._asgi_stream_limit = pool_size - 1
+        self._asgi_streams = None
+        # WSGIで同時に送信中のストリーミングレスポンスの上限 (ASGIと同じく1つの接続を空けておく)
+        self._wsgi_streams = (
+            threading.BoundedSemaphore(pool_size - 1) if pool_size > 1 else None
+        )
+
+        if warm_up == "sync":
+            with self.startup.phase("warm_up"):
+                self.warm_up()
+            # SQLiteの接続はforkをまたいで使えないため、準備に使った接続を閉じる
+            # (子プロセスが共有するのはPythonのオブジェクトの索引・キャッシュだけにする)
+            self.pool.close()
+        elif warm_up == "background":
+            # 準備が終わる前のリクエストは、索引を自分で作るか作成中の索引を待つ (_get_versioned) ため正しく処理される
+            threading.Thread(
+                target=self._background_warm_up, name="sdvx-warm-up", daemon=True
+            ).start()
 
     def init_db(self) -> None:
         """データベースの初期化"""
         if not os.path.exists(self.dbname):
-            csv_f = pd.read_csv(self.csv_file, header=None, sep=",")
-            rows = [list(csv_f.iloc[i]) for i in range(1, len(csv_f))]
+            # CSVファイルをバッチ単位で読み込んでデータベースを構築
+            build_db(self.dbname, self.csv_file, self.batch_size)
+        else:
+            # 既存のデータベースが旧スキーマの場合は型付きスキーマに移行
             con = sqlite3.connect(self.dbname)
-            cur = con.cursor()
-            # SQLテーブルの作成
-            columns = ", ".join(col for col in Column.column_info.keys())
-            cur.execute(f"CREATE TABLE IF NOT EXISTS sdvx_stats ({columns})")
-            cur.executemany(
-                f"INSERT INTO sdvx_stats ({columns}) VALUES ({create_placeholder(columns.split(','))})",
-                rows,
-            )
-            con.commit()
-            cur.close()
+            migrate_db(con)
+            is_modified = is_csv_modified(con, self.csv_file)
             con.close()
+            # CSVファイルが更新されていれば差分だけを反映
+            if is_modified:
+                sync_db(self.dbname, self.csv_file, self.batch_size)
+        self.db_version = self._read_db_version()
+
+    def _read_db_version(self) -> int:
+        """
+        データベースに記録されたデータのバージョンを取得
+
+        Returns:
+            int: データのバージョン
+        """
+        con = sqlite3.connect(self.dbname)
+        db_version = get_data_version(con)
+        con.close()
+        return db_version
+
+    def sync_db(self) -> bool:
+        """
+        CSVファイルが更新されていればデータベースに差分を反映する
+
+        同期中も他のリクエストは同期前のデータを読み込み続けられる
+
+        Returns:
+            bool: データが変更された場合はTrue
+        """
+        # 他のスレッドが同期中の場合は何もしない
+        if not self._sync_lock.acquire(blocking=False):
+            return False
+        try:
+            con = sqlite3.connect(self.dbname)
+            is_modified = is_csv_modified(con, self.csv_file)
+            db_version = get_data_version(con)
+            con.close()
+            if is_modified:
+                db_version = sync_db(self.dbname, self.csv_file, self.batch_size)[
+                    "data_version"
+                ]
+            # 他のプロセスが同期した場合もデータのバージョンの変化を反映する
+            is_changed = db_version != self.db_version
+            self.db_version = db_version
+            return is_changed
+        finally:
+            self._sync_lock.release()
+
+    def check_csv_update(self) -> None:
+        """
+        sync_intervalごとにCSVファイルの更新をバックグラウンドのスレッドで確認し、更新されていれば差分を反映する
+
+        確認・同期の間もリクエストは待たずに同期前のデータで処理される.
+        スレッドはリクエストを処理するプロセスで起動する (プロセスをフォークした場合も子プロセスごとに確認する)
+        """
+        if self.sync_interval is None:
+            return
+        now = time.monotonic()
+        if now - self._last_sync_check < self.sync_interval:
+            return
+        self._last_sync_check = now
+        # 前回の同期が終わっていなければ起動しない
+        if self._sync_lock.locked():
+            return
+        threading.Thread(
+            target=self._background_sync, name="sdvx-sync", daemon=True
+        ).start()
+
+    def _background_sync(self) -> None:
+        """バックグラウンドのスレッドでsync_dbを実行する (失敗しても次の確認で再び同期する)"""
+        try:
+            self.sync_db()
+        except Exception as error:
+            print(f"CSVファイルとの同期に失敗しました: {error}", file=sys.stderr)
+
+    def get_last_modified(self) -> float:
+        """
+        データの最終更新時刻を取得する (記録がない古いデータベースの場合はファイルの更新時刻)
+
+        Returns:
+            float: UNIX時刻
+        """
+        cached = self._last_modified
+        db_version = self.db_version
+        if cached is not None and cached[0] == db_version:
+            return cached[1]
+        con = sqlite3.connect(self.dbname)
+        last_modified = get_data_updated(con)
+        con.close()
+        if last_modified is None:
+            last_modified = os.path.getmtime(self.dbname)
+        self._last_modified = (db_version, last_modified)
+        return last_modified
+
+    def _compute_build_version(self) -> str:
+        """
+        テンプレート・静的ファイル・プログラムの内容からビルドのバージョンを求める
+
+        Returns:
+            str: ビルドのバージョン
+        """
+        if self._source_digest is None:
+            # プログラムは起動中に変わらないため、ハッシュは1度だけ求める
+            app_dir = os.path.dirname(os.path.abspath(__file__))
+            filenames = [os.path.abspath(__file__)]
+            for package in ("data", "modules", "utils"):
+                directory = os.path.join(app_dir, package)
+                if os.path.isdir(directory):
+                    filenames += [
+                        os.path.join(directory, name)
+                        for name in sorted(os.listdir(directory))
+                        if name.endswith(".py")
+                    ]
+            source = hashlib.sha256()
+            for filename in filenames:
+                with open(filename, "rb") as file:
+                    source.update(file.read())
+            self._source_digest = source.hexdigest()[:12]
+        return make_build_version(
+            [self.templates.digest(), self.static.digest(), self._source_digest]
+        )
+
+    def _validator_headers(self) -> tuple:
+        """
+        条件付きGETのためのETag・Last-Modifiedヘッダを作成する
+
+        データ・テンプレート・静的ファイル・プログラムが変わらない限り同じURLのレスポンスは同じなので,
+        データのバージョンとビルドのバージョンから生成する
+
+        Returns:
+            tuple (str, float, list): ETag, 最終更新時刻, レスポンスヘッダ
+        """
+        if self.templates.auto_reload:
+            # 開発用にテンプレートを読み込み直す場合は、変更を反映するため毎回求める
+            self.build_version = self._compute_build_version()
+        etag = make_etag(self.db_version, self.build_version)
+        last_modified = max(self.get_last_modified(), self.started_at)
+        headers = [
+            ("ETag", etag),
+            ("Last-Modified", format_http_date(last_modified)),
+            ("Cache-Control", "no-cache"),
+        ]
+        return etag, last_modified, headers
+
+    def _not_modified(self, environ, validator_headers) -> tuple:
+        """
+        304 Not Modifiedのレスポンスを作成する
+
+        gzipを受け付けるクライアントには圧縮したレスポンスと同じETag (-gzip) とVaryヘッダを返す
+
+        Args:
+            environ (dict): WSGI環境変数の辞書オブジェクト
+            validator_headers (list): _validator_headersで作成したレスポンスヘッダ
+
+        Returns:
+            tuple (str, list, list): ステータス, レスポンスヘッダ, 空のレスポンスボディ
+        """
+        headers = add_vary(validator_headers)
+        if accepts_gzip(environ):
+            # ボディのない304にはContent-Encodingを付けない
+            headers = [
+                (name, value)
+                for name, value in compressed_headers(headers)
+                if name != "Content-Encoding"
+            ]
+        return "304 Not Modified", headers, []
+
+    def _get_versioned(self, name, index_class):
+        """
+        データベースから作成した索引を取得する (データのバージョンが変わっていれば作り直す)
+
+        Args:
+            name (str): 索引を保存するインスタンス変数名
+            index_class (type): loadで索引を作成するクラス
+
+        Returns:
+            object: 索引
+        """
+        index = getattr(self, name)
+        if index is not None and index.version == self.db_version:
+            return index
+        with self._index_lock:
+            # 他のスレッドが作り直していればそれを使う
+            index = getattr(self, name)
+            if index is None or index.version != self.db_version:
+                db_version = self.db_version
+                with self.pool.connection() as con:
+                    index = index_class.load(con, db_version)
+                setattr(self, name, index)
+        return index
+
+    def get_title_index(self) -> TitleIndex:
+        """
+        楽曲名の入力補完の索引を取得する (データのバージョンが変わっていれば作り直す)
+
+        Returns:
+            TitleIndex: 楽曲名の索引
+        """
+        return self._get_versioned("_title_index", TitleIndex)
+
+    def get_snapshot(self) -> ColumnarSnapshot:
+        """
+        検索用の列指向スナップショットを取得する (データのバージョンが変わっていれば作り直す)
+
+        Returns:
+            ColumnarSnapshot: sdvx_statsのスナップショット
+        """
+        return self._get_versioned("_snapshot", ColumnarSnapshot)
+
+    def get_score_distribution(self) -> ScoreDistributionIndex:
+        """
+        譜面ごとのスコア分布を取得する (データのバージョンが変わっていれば作り直す)
+
+        Returns:
+            ScoreDistributionIndex: スコア分布の索引
+        """
+        return self._get_versioned("_score_distribution", ScoreDistributionIndex)
+
+    def _uses_snapshot(self, query) -> bool:
+        """
+        問い合わせをスナップショットから求めるかどうかを判定
+
+        スナップショットは検索フォームの問い合わせ (sdvx_statsの絞り込みとキーセットページング) にのみ対応する
+
+        Args:
+            query (Query): 問い合わせ
+
+        Returns:
+            bool: backendが"memory"で、スナップショットで求められる問い合わせであればTrue
+        """
+        return (
+            self.backend == "memory"
+            and query.table == "sdvx_stats"
+            and not query.order
+            and query.limit is None
+        )
+
+    def _search_rows(self, query) -> list:
+        """
+        検索結果の行を取得する (backendが"memory"の場合はスナップショットから求める)
+
+        Args:
+            query (Query): make_sql_from_formなどで生成した問い合わせ
+
+        Returns:
+            list: 検索結果の行のリスト
+        """
+        if self._uses_snapshot(query):
+            with timed("query"):
+                return count_rows(
+                    self.get_snapshot().search(
+                        query.filters, query.select_keys, query.page, query.normalize
+                    )
+                )
+        with self.pool.connection() as con:
+            return self._fetch_rows(con, query.sql, query.values)
+
+    def _fetch_rows(self, con, sql, values) -> list:
+        """
+        SQL文を実行して全行を取得する (処理時間を計測し、遅い問い合わせを記録する)
+
+        Args:
+            con (sqlite3.Connection): データベースの接続
+            sql (str): SQLクエリ
+            values (list): SQLクエリのプレースホルダに対応する値
+
+        Returns:
+            list: 取得した行のリスト
+        """
+        with timed("query"):
+            start = time.perf_counter()
+            rows = con.execute(sql, values).fetchall()
+            self._log_slow_query(con, sql, values, time.perf_counter() - start)
+        return count_rows(rows)
+
+    def _log_slow_query(self, con, sql, values, seconds) -> None:
+        """
+        時間のかかった問い合わせをEXPLAIN QUERY PLANの結果とともに標準エラー出力に記録する
+
+        Args:
+            con (sqlite3.Connection): データベースの接続
+            sql (str): SQLクエリ
+            values (list): SQLクエリのプレースホルダに対応する値
+            seconds (float): 処理時間 (秒)
+        """
+        if self.slow_query_seconds is None or seconds < self.slow_query_seconds:
+            return
+        self.metrics.record_slow_query()
+        plan = format_query_plan(
+            con.execute("EXPLAIN QUERY PLAN " + sql, values).fetchall()
+        )
+        print(
+            f"遅い問い合わせ ({seconds * 1000:.1f}ms)\n {sql}\n"
+            + f"プレースホルダ {values}\n実行計画\n{plan}",
+            file=sys.stderr,
+        )
+
+    def _iter_slow_query(self, chunks, con, sql, values):
+        """
+        カーソルから少しずつ取り出す問い合わせの、生成にかかった時間 (送信待ちの時間を除く) で遅い問い合わせを記録する
+
+        Args:
+            chunks (Iterable[str]): 検索結果から生成した断片
+            con (sqlite3.Connection): データベースの接続
+            sql (str): SQLクエリ
+            values (list): SQLクエリのプレースホルダに対応する値
+
+        Yields:
+            str: 断片
+        """
+        chunks = iter(chunks)
+        elapsed = 0.0
+        while True:
+            start = time.perf_counter()
+            chunk = next(chunks, None)
+            elapsed += time.perf_counter() - start
+            if chunk is None:
+                break
+            yield chunk
+        self._log_slow_query(con, sql, values, elapsed)
+
+    def _iter_rows_html(self, query, is_percent, is_count_display):
+        """
+        検索結果テーブルの本文を一定行数ずつ生成するジェネレータ
+
+        Args:
+            query (Query): make_sql_from_formで生成した問い合わせ
+            is_percent (bool): 達成率を表示するかどうか
+            is_count_display (bool): プレイ人数を表示するかどうか
+
+        Yields:
+            str: テーブル本文のHTMLコード
+        """
+        select_keys = query.select_keys
+        if self._uses_snapshot(query):
+            yield from iter_rows_html(
+                self._search_rows(query),
+                select_keys,
+                is_percent,
+                is_count_display,
+                fragment_cache=self._get_row_cache(),
+            )
+            return
+        # 送信が終わるまで接続をプールから借りる
+        with self.pool.connection() as con:
+            yield from self._iter_slow_query(
+                iter_results_rows(
+                    con.cursor(),
+                    query.sql,
+                    query.values,
+                    select_keys,
+                    is_percent,
+                    is_count_display,
+                    fragment_cache=self._get_row_cache(),
+                ),
+                con,
+                query.sql,
+                query.values,
+            )
+
+    def _get_row_cache(self):
+        """
+        行ごとの生成済みHTMLのキャッシュを取得する (データベースが更新されていれば破棄する)
+
+        Returns:
+            RowFragmentCache or None: キャッシュ (使わない場合はNone)
+        """
+        if self.row_cache is not None:
+            self.row_cache.validate(self.db_version)
+        return self.row_cache
+
+    def warm_up(self) -> None:
+        """楽曲名の索引・検索用のスナップショット・スコア分布・行のキャッシュを作成しておく (最初のリクエストを速くする)"""
+        self.get_title_index()
+        if self.backend == "memory":
+            self.get_snapshot()
+        if self.score_percentile:
+            self.get_score_distribution()
+        self.warm_row_cache()
+
+    def _background_warm_up(self) -> None:
+        """バックグラウンドのスレッドでwarm_upを実行する (失敗しても最初に必要になったときに作り直す)"""
+        try:
+            with self.startup.phase("warm_up (background)"):
+                self.warm_up()
+        except Exception as error:
+            print(f"起動時の準備に失敗しました: {error}", file=sys.stderr)
+
+    def startup_report(self) -> str:
+        """
+        起動処理の段階ごとの所要時間をpython -X importtimeと同じ形式で取得
+
+        Returns:
+            str: 段階ごとの所要時間 (マイクロ秒)
+        """
+        return self.startup.report()
+
+    def warm_row_cache(self) -> None:
+        """検索フォームのデフォルトの表示形式 (すべての列, 達成率表示) で全譜面の行を生成しておく"""
+        if self.row_cache is None:
+            return
+        for _ in self._iter_rows_html(Query(Column.display_info), True, False):
+            pass
+
+    def create_cached_results(
+        self, query, is_percent, is_count_display, is_ranking=False
+    ) -> tuple:
+        """
+        検索結果テーブルを生成する (同じ問い合わせ・表示形式の結果はキャッシュから返す)
+
+        Args:
+            query (Query): 問い合わせ
+            is_percent (bool): 達成率を表示するかどうか
+            is_count_display (bool): プレイ人数を表示するかどうか
+            is_ranking (bool, optional): ホームのランキングテーブルであるかどうか
+
+        Returns:
+            tuple (str, str): 生成されたテーブルのヘッダと本文
+        """
+        # データベースが更新されていればキャッシュを破棄
+        self.result_cache.validate(self.db_version)
+        key = make_cache_key(query, is_percent, is_count_display)
+        results = self.result_cache.get(key)
+        if results is None and not is_ranking:
+            with timed("render"):
+                results = (
+                    create_results_header(
+                        query.select_keys, is_percent, is_count_display
+                    ),
+                    "".join(self._iter_rows_html(query, is_percent, is_count_display)),
+                )
+            self.result_cache.put(key, results)
+        elif results is None:
+            # 接続はプールから借りる (create_results_tableは問い合わせも実行するため、すべてrenderに含める)
+            with self.pool.connection() as con, timed("render"):
+                results = create_results_table(
+                    con.cursor(),
+                    query.sql,
+                    query.values,
+                    query.select_keys,
+                    is_percent,
+                    is_count_display,
+                    is_ranking,
+                )
+            self.result_cache.put(key, results)
+        return results
+
+    def create_cached_page(self, query, is_percent, is_count_display) -> tuple:
+        """
+        1ページ分の検索結果テーブルと前後のページのカーソルを生成する (キャッシュがあれば再利用)
+
+        Args:
+            query (Query): make_sql_from_form(page指定)で生成した問い合わせ
+            is_percent (bool): 達成率を表示するかどうか
+            is_count_display (bool): プレイ人数を表示するかどうか
+
+        Returns:
+            tuple (str, str, str, str): テーブルのヘッダと本文, 前のページ・次のページのカーソル
+        """
+        self.result_cache.validate(self.db_version)
+        key = make_cache_key(query, is_percent, is_count_display)
+        results = self.result_cache.get(key)
+        if results is None:
+            select_keys = query.select_keys
+            search_results = self._search_rows(query)
+            with timed("render"):
+                rows, has_prev, has_next = split_page(search_results, query.page)
+                results = (
+                    create_results_header(select_keys, is_percent, is_count_display),
+                    create_rows_html(
+                        rows,
+                        select_keys,
+                        is_percent,
+                        is_count_display,
+                        fragment_cache=self._get_row_cache(),
+                    ),
+                ) + create_page_cursors(rows, select_keys, has_prev, has_next)
+            self.result_cache.put(key, results)
+        return results
+
+    def stream_cached_results(self, query, is_percent, is_count_display) -> tuple:
+        """
+        検索結果テーブルのヘッダと、本文を少しずつ生成するイテラブルを返す
+
+        キャッシュがあればキャッシュした本文を返す. キャッシュがない場合は送信しながら本文を集め、
+        キャッシュの1エントリの上限以下の大きさであれば送信後にキャッシュする
+
+        Args:
+            query (Query): make_sql_from_formで生成した問い合わせ
+            is_percent (bool): 達成率を表示するかどうか
+            is_count_display (bool): プレイ人数を表示するかどうか
+
+        Returns:
+            tuple (str, Iterable[str]): テーブルのヘッダと本文のイテラブル
+        """
+        self.result_cache.validate(self.db_version)
+        key = make_cache_key(query, is_percent, is_count_display)
+        results = self.result_cache.get(key)
+        if results is not None:
+            return results[0], [results[1]]
+        header = create_results_header(query.select_keys, is_percent, is_count_display)
+
+        def iter_rows():
+            collected = []  # キャッシュに保存するための本文
+            collected_size = len(header)
+            for rows in self._iter_rows_html(query, is_percent, is_count_display):
+                if collected is not None:
+                    collected.append(rows)
+                    collected_size += len(rows)
+                    # 大きすぎる結果はキャッシュしない (メモリ使用量を一定に保つ)
+                    if collected_size > self.result_cache.max_entry_bytes:
+                        collected = None
+                yield rows
+            if collected is not None:
+                self.result_cache.put(key, (header, "".join(collected)))
+
+        return header, iter_rows()
 
     def handle_home(self) -> str:
         """
@@ -63,64 +764,29 @@ class SdvxStatsApp:
             str: トップページのHTMLページ
         """
         # 入力フォームの内容が空の場合（初めてページを開いた場合も含む）
-        # HTML(入力フォーム部分)
-        response = load_html("html/home.html")
-
-        con = sqlite3.connect(self.dbname)
-        cur = con.cursor()
-        con.text_factory = str
-
         # 送信するページデータの辞書
-        page_data = {"results_header": "", "results": ""}
+        page_data = {
+            "results_header": "",
+            "results": "",
+            "sort_options": create_sort_options(Column.display_info),
+        }
 
         # トップページに載せる平均スコアランキング
         # レベル18以上のMXM相当の楽曲の中で平均スコアが低い順に10曲のデータを表示 (トップ10に入りうる楽曲)
-        # 楽曲名, 難易度, レベル, 作曲者, プレイ人数, 全体の平均スコア, インペリアル1の平均スコア, 後光暴龍天の平均スコアを表示
-        self.select_keys = [
-            "music_title",
-            "difficulty_name",
-            "level",
-            "artist",
-            "count",
-            "avg_score",
-            "avg_vf_10_i",
-            "avg_skill_12_h",
-        ]
-        # 18~20のレベルかつMXM相当の楽曲を対象にする
-        ranking_display_levels = ["18", "19", "20"]
-        ranking_display_difficulties = Column.difficulties[3:]
-        ranking_display_values = ranking_display_difficulties + ranking_display_levels
-
-        # TODO: make_sqlを使ってSQL文を生成したい
-        sql = (
-            f"SELECT {', '.join(self.select_keys)} FROM sdvx_stats "
-            + f"WHERE difficulty_name IN ({create_placeholder(ranking_display_difficulties)}) "
-            + f"AND level IN ({create_placeholder(ranking_display_levels)}) "
-            + "ORDER BY avg_score ASC LIMIT 0, 10"
-        )
+        with timed("build_sql"):
+            query = make_ranking_sql()
+        # ランキングは人数表示・プレイ人数は非表示
+        is_percent = False
+        is_count_display = False
 
-        # 生成したSQL文を表示
-        print_sql(sql, ranking_display_values)
-
-        # SQL文の検索結果からHTML文を作成
-        page_data["results_header"], page_data["results"] = create_results_table(
-            cur,
-            sql,
-            ranking_display_values,
-            self.select_keys,
-            self.is_percent,
-            self.is_count_display,
-            is_ranking=True,
+        # SQL文の検索結果からHTML文を作成 (キャッシュがあれば再利用)
+        page_data["results_header"], page_data["results"] = self.create_cached_results(
+            query, is_percent, is_count_display, is_ranking=True
         )
 
-        # 結果部分のHTML出力
-        for key, value in page_data.items():
-            response = response.replace("{% " + key + " %}", value)
-
-        # カーソルと接続を閉じる
-        cur.close()
-        con.close()
-        return response
+        # 結果部分をHTML(入力フォーム部分)に埋め込んで出力
+        with timed("template"):
+            return self.templates.get("html/home.html").render(page_data)
 
     def handle_about(self) -> str:
         """
@@ -129,10 +795,40 @@ class SdvxStatsApp:
         Returns:
             str: AboutのHTMLページ
         """
-        response = load_html("html/about.html")
-        return response
+        with timed("template"):
+            return self.templates.get("html/about.html").render()
+
+    def handle_summary(self, form) -> str:
+        """
+        レベル・難易度別の集計表のHTMLページを生成する
 
-    def handle_result(self, form) -> str:
+        Args:
+            form (dict): 表示するレベル・難易度を含むフォームデータ
+
+        Returns:
+            str: 集計表のHTMLページ
+        """
+        with timed("build_sql"):
+            query = make_summary_sql(form)
+        is_percent = parse_format(form)
+
+        # 集計表は事前に計算してあるので、行数はレベルと難易度の組の数だけ
+        self.result_cache.validate(self.db_version)
+        key = make_cache_key(query, is_percent, False)
+        results = self.result_cache.get(key)
+        if results is None:
+            with self.pool.connection() as con:
+                search_results = self._fetch_rows(con, query.sql, query.values)
+            with timed("render"):
+                results = create_summary_table(
+                    search_results, query.select_keys, is_percent
+                )
+            self.result_cache.put(key, results)
+        page_data = {"results_header": results[0], "results": results[1]}
+        with timed("template"):
+            return self.templates.get("html/summary.html").render(page_data)
+
+    def handle_result(self, form):
         """
         検索結果のHTMLページを生成する
 
@@ -140,42 +836,53 @@ class SdvxStatsApp:
             form (dict): 検索条件・表示項目を含むフォームデータ
 
         Returns:
-            str: 検索結果のHTMLページ
+            str or Iterator[str]: 検索結果のHTMLページ (streamingがTrueの場合はHTMLの断片を生成するイテレータ)
         """
-        response = load_html("html/result.html")
-        con = sqlite3.connect(self.dbname)
-        cur = con.cursor()
-        con.text_factory = str
-
         # HTMLに追加するHTML文
-        page_data = {"results_header": "", "results": ""}
+        page_data = {"results_header": "", "results": "", "pagination": ""}
 
-        # 検索フォームの内容からSQL文を生成
-        sql, sql_values, self.select_keys, self.is_percent, self.is_count_display = (
-            make_sql_from_form(form, Column.filter_info, Column.display_info)
-        )
+        with timed("build_sql"):
+            # ページ送りの条件 (1ページの件数・並び替え・カーソル) を取得
+            page = parse_page_params(form, Column.display_info)
+            page_data["sort_options"] = create_sort_options(Column.display_info, page)
 
-        # 生成したSQL文を表示
-        print_sql(sql, sql_values)
-
-        # SQL文の検索結果からHTML文を作成
-        page_data["results_header"], page_data["results"] = create_results_table(
-            cur,
-            sql,
-            sql_values,
-            self.select_keys,
-            self.is_percent,
-            self.is_count_display,
-        )
+            # 検索フォームの内容から正規化した問い合わせを生成
+            # 表示項目などのリクエストごとの状態はインスタンスに保存しない (複数スレッドで共有されるため)
+            query, is_percent, is_count_display = make_sql_from_form(
+                form,
+                Column.filter_info,
+                Column.display_info,
+                page,
+                self.search_normalize,
+            )
 
-        # 結果部分のHTML出力
-        for key, value in page_data.items():
-            response = response.replace("{% " + key + " %}", value)
+        # 1ページ分だけを取得して表示
+        if query.page is not None:
+            (
+                page_data["results_header"],
+                page_data["results"],
+                prev_cursor,
+                next_cursor,
+            ) = self.create_cached_page(query, is_percent, is_count_display)
+            page_data["pagination"] = create_page_links(form, prev_cursor, next_cursor)
+            with timed("template"):
+                return self.templates.get("html/result.html").render(page_data)
 
-        # カーソルと接続を閉じる
-        cur.close()
-        con.close()
-        return response
+        # 全件表示の場合は検索結果の行をカーソルから少しずつ取り出しながら送信する
+        if self.streaming:
+            page_data["results_header"], page_data["results"] = self.stream_cached_results(
+                query, is_percent, is_count_display
+            )
+            return self.templates.get("html/result.html").render_iter(page_data)
+
+        # SQL文の検索結果からHTML文を作成 (キャッシュがあれば再利用)
+        page_data["results_header"], page_data["results"] = self.create_cached_results(
+            query, is_percent, is_count_display
+        )
+
+        # 結果部分をHTMLに埋め込んで出力
+        with timed("template"):
+            return self.templates.get("html/result.html").render(page_data)
 
     def handle_calculate(self, form) -> str:
         """
@@ -187,10 +894,6 @@ class SdvxStatsApp:
         Returns:
             str: 検索結果のHTMLページ
         """
-        response = load_html("html/ss.html")
-        con = sqlite3.connect(self.dbname)
-        cur = con.cursor()
-        con.text_factory = str
         # ss_results: 偏差値計算結果
         # data_info: 「"楽曲名”の統計データ」という文字列 (データがある場合)
         # results_header: 統計テーブルヘッダ
@@ -213,79 +916,636 @@ class SdvxStatsApp:
             search_difficulty = form.getvalue("ss_difficulty").split(",")
             # 偏差値計算を行うスコア
             ss_score = form.getvalue("ss_score")
-            # すべての列を表示
-            self.select_keys = Column.display_info
-            # TODO: make_sqlを使ってSQL文を生成したい
-            # 偏差値計算のためのSQL文
-            sql = (
-                "SELECT * FROM sdvx_stats "
-                + f"WHERE music_title=? AND difficulty_name IN ({create_placeholder(search_difficulty)})"
-            )
-            sql_values = [music_title] + search_difficulty
-
-            print_sql(sql, sql_values)
-
-            # 偏差値計算のためのデータを取得
-            search_result = cur.execute(sql, sql_values).fetchone()
-            if search_result:
-                # 平均スコアと標準偏差を取得
-                avg_score = search_result[self.select_keys.index("avg_score")]
-                sd_score = search_result[self.select_keys.index("sd_score")]
-                # 偏差値の計算結果と統計データのHTML文を生成
-                page_data["ss_results"] = create_deviation_score_results(
-                    ss_score, sd_score, avg_score
-                )
-                page_data["data_info"] = f"<h4>'{music_title}'の統計データ</h4>\n"
-                page_data["results_header"], page_data["results_table"] = (
-                    create_results_table(
-                        cur,
-                        sql,
-                        sql_values,
-                        self.select_keys,
-                        is_percent=True,
-                        is_count_display=True,
+            # 偏差値計算のためのSQL文 (すべての列を表示)
+            with timed("build_sql"):
+                query = make_deviation_sql(music_title, search_difficulty)
+                select_keys = query.select_keys
+
+            # 偏差値計算のためのデータを取得 (接続はプールから借りる)
+            with self.pool.connection() as con:
+                cur = con.cursor()
+                search_results = self._fetch_rows(con, query.sql, query.values)
+                if search_results:
+                    search_result = search_results[0]
+                    # 平均スコアと標準偏差を取得
+                    avg_score = search_result[select_keys.index("avg_score")]
+                    sd_score = search_result[select_keys.index("sd_score")]
+                    # スコア分布から求めたパーセンタイル (スコアが不正な場合は求めない)
+                    percentile = None
+                    score, _ = parse_score(ss_score)
+                    if self.score_percentile and score is not None:
+                        percentile = self.get_score_distribution().percentile(
+                            search_result[select_keys.index("music_title")],
+                            search_result[select_keys.index("difficulty_name")],
+                            score,
+                        )
+                    # 偏差値の計算結果と統計データのHTML文を生成
+                    page_data["ss_results"] = create_deviation_score_results(
+                        ss_score, sd_score, avg_score, percentile
                     )
-                )
-        for key, value in page_data.items():
-            response = response.replace("{% " + key + " %}", value)
-        # カーソルと接続を閉じる
-        cur.close()
-        con.close()
-        return response
+                    page_data["data_info"] = f"<h4>'{music_title}'の統計データ</h4>\n"
+                    with timed("render"):
+                        page_data["results_header"], page_data["results_table"] = (
+                            create_results_table(
+                                cur,
+                                query.sql,
+                                query.values,
+                                select_keys,
+                                is_percent=True,
+                                is_count_display=True,
+                            )
+                        )
+        with timed("template"):
+            return self.templates.get("html/ss.html").render(page_data)
 
-    def application(self, environ, start_response) -> list:
+    def _iter_query(self, query, output):
         """
-        Webアプリケーションのエントリーポイント
+        問い合わせの結果をカーソルから少しずつ取り出し、APIの出力形式に変換するジェネレータ
 
         Args:
+            query (Query): 問い合わせ
+            output (str): 出力形式 ("jsonl"または"csv")
+
+        Yields:
+            str: 変換した行
+        """
+        keys = query.select_keys
+        if self._uses_snapshot(query):
+            yield from iter_api_rows(self._search_rows(query), keys, output)
+            return
+        # 送信が終わるまで接続をプールから借りる
+        with self.pool.connection() as con:
+            yield from self._iter_slow_query(
+                iter_api_rows(con.execute(query.sql, query.values), keys, output),
+                con,
+                query.sql,
+                query.values,
+            )
+
+    def handle_api(self, path, form, environ) -> tuple:
+        """
+        API (/api/search, /api/ranking, /api/summary, /api/deviation, /api/deviation/batch, /api/complete)
+        のレスポンスを生成する
+
+        Args:
+            path (str): リクエストのパス
+            form (dict): 検索条件を含むフォームデータ
             environ (dict): WSGI環境変数の辞書オブジェクト
-            start_response (callable): レスポンスヘッダーを設定するための関数
 
         Returns:
-            list: レスポンスボディのリスト
+            tuple (str, list, Iterable[str]): ステータス, レスポンスヘッダ, レスポンスボディ
+        """
+        output = get_api_format(form)
+        etag, last_modified, validator_headers = self._validator_headers()
+        headers = [("Content-Type", API_CONTENT_TYPES[output])] + validator_headers
+        if path not in (
+            "/api/search",
+            "/api/ranking",
+            "/api/summary",
+            "/api/deviation",
+            "/api/deviation/batch",
+            "/api/complete",
+        ):
+            return (
+                "404 Not Found",
+                [("Content-Type", "text/plain; charset=utf-8")],
+                ["Not Found\n"],
+            )
+        if path == "/api/deviation/batch":
+            # アップロードされた一覧によって結果が変わるためETagは付けない
+            return self.handle_batch_deviation(form)
+        if is_not_modified(environ, etag, last_modified):
+            return self._not_modified(environ, validator_headers)
+
+        if path == "/api/search":
+            # 検索条件に合うすべての行をカーソルから直接送信する
+            query, _, _ = make_sql_from_form(
+                form,
+                Column.filter_info,
+                Column.display_info,
+                normalize=self.search_normalize,
+            )
+            return "200 OK", headers, self._iter_query(query, output)
+
+        if path == "/api/ranking":
+            return "200 OK", headers, self._iter_query(make_ranking_sql(), output)
+
+        if path == "/api/summary":
+            # レベル・難易度別の集計表 (達成人数は合計値のまま返す)
+            return "200 OK", headers, self._iter_query(make_summary_sql(form), output)
+
+        if path == "/api/complete":
+            # 入力途中の楽曲名 (q) から楽曲名と難易度の候補をメモリ上の索引で求める
+            # 同じパラメータが複数ある場合は最初の値を使う
+            limit = parse_limit(
+                form.getfirst("limit"), DEFAULT_COMPLETE_LIMIT, MAX_COMPLETE_LIMIT
+            )
+            candidates = self.get_title_index().complete(form.getfirst("q", ""), limit)
+            rows = [
+                (music_title, ",".join(difficulties))
+                for music_title, difficulties in candidates
+            ]
+            return "200 OK", headers, iter_api_rows(rows, COMPLETE_KEYS, output)
+
+        # /api/deviation: 楽曲名・難易度名 (カンマ区切り・複数指定可, 省略時はすべて)・スコアから偏差値を計算
+        # 難易度は/api/searchのdifficulty (難易度の番号) と区別するため、difficulty_nameで難易度名を受け取る
+        score, error_message = None, "楽曲名とスコアは1つだけ指定してください。"
+        difficulties, difficulty_error = parse_difficulty_names(
+            form.getlist("difficulty_name")
+        )
+        if difficulties is None:
+            error_message = difficulty_error
+        elif len(form.getlist("music_title")) <= 1 and len(form.getlist("score")) <= 1:
+            score, error_message = parse_score(form.getfirst("score", ""))
+        if score is None:
+            body = json.dumps({"error": error_message}, ensure_ascii=False) + "\n"
+            return (
+                "400 Bad Request",
+                [("Content-Type", API_CONTENT_TYPES["jsonl"])],
+                [body],
+            )
+        query = make_deviation_sql(form.getfirst("music_title", ""), difficulties)
+        with self.pool.connection() as con:
+            search_results = self._fetch_rows(con, query.sql, query.values)
+        rows = create_deviation_rows(search_results, query.select_keys, score)
+        return "200 OK", headers, iter_api_rows(rows, DEVIATION_KEYS, output)
+
+    def handle_batch_deviation(self, form) -> tuple:
+        """
+        アップロードされた (楽曲名, 難易度, スコア) の一覧から譜面ごとの偏差値と集計を計算する
+
+        一覧はリクエストボディ (CSVまたはJSON Lines), multipart/form-dataのfile, フォームのentriesで受け取る
+
+        Args:
+            form (FormData): フォームデータ
+
+        Returns:
+            tuple (str, list, list): ステータス, レスポンスヘッダ, レスポンスボディ (JSON)
+        """
+        headers = [("Content-Type", "application/json; charset=utf-8")]
+        text = form.getfirst("file") or form.getfirst("entries") or form.body
+        entries, invalid = parse_score_entries(text)
+        error_message = ""
+        if not entries and not invalid:
+            error_message = "楽曲名, 難易度, スコアの一覧を指定してください。"
+        elif len(entries) > MAX_BATCH_ENTRIES:
+            error_message = f"一度に計算できる譜面は{MAX_BATCH_ENTRIES}件までです。"
+        if error_message:
+            body = json.dumps({"error": error_message}, ensure_ascii=False) + "\n"
+            return "400 Bad Request", headers, [body]
+
+        # すべての譜面の統計データを1回の問い合わせで取得する
+        sql, sql_values, select_keys = make_batch_deviation_sql(
+            [
+                (music_title, difficulty_name)
+                for music_title, difficulty_name, _ in entries
+            ]
+        )
+        with self.pool.connection() as con:
+            search_results = self._fetch_rows(con, sql, sql_values)
+        top = parse_limit(form.getvalue("top"), DEFAULT_BATCH_TOP, MAX_BATCH_ENTRIES)
+        results = create_batch_deviation(entries, search_results, select_keys, top)
+        results["invalid"] = [
+            {"line": line_number, "error": message} for line_number, message in invalid
+        ]
+        return "200 OK", headers, [json.dumps(results, ensure_ascii=False) + "\n"]
+
+    def handle_request(self, path, form, environ) -> tuple:
         """
-        # フォームデータを取得
-        form = cgi.FieldStorage(environ=environ, keep_blank_values=True)
+        リクエストに対するレスポンスを生成する (WSGIとASGIで共通)
+
+        Args:
+            path (str): リクエストのパス
+            form (FormData): フォームデータ
+            environ (dict): WSGI環境変数の辞書オブジェクト
+
+        Returns:
+            tuple (str, list, str or Iterable[str]): ステータス, レスポンスヘッダ, レスポンスボディ
+        """
+        # CSVファイルが更新されていればバックグラウンドでデータベースに反映
+        self.check_csv_update()
+
+        # 処理時間の集計 (Prometheusのテキスト形式)
+        if path == "/metrics":
+            return (
+                "200 OK",
+                [("Content-Type", METRICS_CONTENT_TYPE), ("Cache-Control", "no-store")],
+                self.render_metrics(),
+            )
+
+        # API (JSON Lines / CSV)
+        if path.startswith("/api/"):
+            return self.handle_api(path, form, environ)
+
+        headers = [("Content-Type", "text/html; charset=utf-8")]
+        # GETのページは条件付きGETに対応する (データが変わっていなければ304を返す)
+        if environ.get("REQUEST_METHOD", "GET") in ("GET", "HEAD"):
+            etag, last_modified, validator_headers = self._validator_headers()
+            if is_not_modified(environ, etag, last_modified):
+                return self._not_modified(environ, validator_headers)
+            headers += validator_headers
+
         if "ss_music" in form:
             response = self.handle_calculate(form)
         elif "submit" in form:
             response = self.handle_result(form)
+        elif "summary" in form:
+            response = self.handle_summary(form)
         elif "about" in form:
             response = self.handle_about()
         else:
             response = self.handle_home()
+        return "200 OK", headers, response
+
+    @staticmethod
+    def request_route(path, form) -> str:
+        """
+        処理時間の集計に使うリクエストの種類を求める (handle_requestの振り分けと同じ順序で判定する)
+
+        Args:
+            path (str): リクエストのパス
+            form (FormData): フォームデータ
+
+        Returns:
+            str: リクエストの種類 (home, result, api_searchなど)
+        """
+        if path == "/metrics":
+            return "metrics"
+        if path.startswith("/api/"):
+            return path.strip("/").replace("/", "_")
+        for key, route in (
+            ("ss_music", "calculate"),
+            ("submit", "result"),
+            ("summary", "summary"),
+            ("about", "about"),
+        ):
+            if key in form:
+                return route
+        return "home"
+
+    def render_metrics(self) -> str:
+        """
+        処理時間の集計とキャッシュ・接続プールの統計情報をPrometheusのテキスト形式で出力
+
+        Returns:
+            str: Prometheusのテキスト形式の文字列
+        """
+        gauges = {}
+        caches = [
+            ("result_cache", self.result_cache),
+            ("gzip_cache", self.compressed_cache),
+        ]
+        if self.row_cache is not None:
+            caches.append(("row_cache", self.row_cache))
+        for name, cache in caches:
+            for key, value in cache.stats().items():
+                gauges[f"sdvx_{name}_{key}"] = (f"{name}の{key}", value)
+        for key, value in self.pool.stats().items():
+            gauges[f"sdvx_pool_{key}"] = (f"接続プールの{key}", value)
+        gauges["sdvx_data_version"] = ("データのバージョン", self.db_version)
+        return self.metrics.render(gauges)
+
+    def encode_response(self, environ, status, headers, response) -> tuple:
+        """
+        レスポンスボディをUTF-8にエンコードし、クライアントが受け付ける場合はgzipで圧縮する (WSGIとASGIで共通)
+
+        文字列のレスポンスはCOMPRESS_MIN_SIZE以上の場合のみ圧縮し、GETのレスポンスは圧縮したものをキャッシュする.
+        ストリーミングのレスポンスは断片ごとに圧縮しながら送信する
+
+        Args:
+            environ (dict): WSGI環境変数の辞書オブジェクト
+            status (str): ステータス
+            headers (list): レスポンスヘッダ
+            response (str or Iterable[str]): レスポンスボディ
+
+        Returns:
+            tuple (list, bytes or Iterator[bytes]): レスポンスヘッダ, エンコードしたレスポンスボディ
+        """
+        is_compressible_response = is_compressible(headers)
+        use_gzip = (
+            is_compressible_response
+            and not status.startswith("304")
+            and accepts_gzip(environ)
+        )
+        if is_compressible_response:
+            headers = add_vary(headers)
+
+        # ストリーミングの場合はContent-Lengthを付けずに少しずつ送信
+        if not isinstance(response, str):
+            chunks = encode_chunks(response)
+            if use_gzip:
+                return compressed_headers(headers), iter_gzip(chunks)
+            return headers, chunks
+
+        with timed("encode"):
+            body = response.encode("utf-8")
+            if use_gzip and len(body) >= COMPRESS_MIN_SIZE:
+                # ETagがある (データが変わらない限り同じ内容の) レスポンスだけキャッシュする
+                is_cacheable = any(name == "ETag" for name, _ in headers)
+                body = self._gzip_cached(environ, body, is_cacheable)
+                headers = compressed_headers(headers)
+        return headers + [("Content-Length", str(len(body)))], body
+
+    def _gzip_cached(self, environ, body, is_cacheable=True) -> bytes:
+        """
+        レスポンスボディをgzipで圧縮する (GETのレスポンスは圧縮したものをURLごとにキャッシュする)
+
+        Args:
+            environ (dict): WSGI環境変数の辞書オブジェクト
+            body (bytes): 圧縮するレスポンスボディ
+            is_cacheable (bool, optional): 圧縮したものをキャッシュしてよいかどうか
+
+        Returns:
+            bytes: 圧縮したレスポンスボディ
+        """
+        if not is_cacheable or environ.get("REQUEST_METHOD", "GET") not in (
+            "GET",
+            "HEAD",
+        ):
+            return gzip_bytes(body)
+        # テンプレート・静的ファイルが変わった場合も (ETagと同じく) 作り直す
+        self.compressed_cache.validate((self.db_version, self.build_version))
+        key = (environ.get("PATH_INFO", "/"), environ.get("QUERY_STRING", ""))
+        cached = self.compressed_cache.get(key)
+        if cached is None:
+            cached = (gzip_bytes(body),)
+            self.compressed_cache.put(key, cached)
+        return cached[0]
+
+    def application(self, environ, start_response):
+        """
+        Webアプリケーションのエントリーポイント
+
+        Args:
+            environ (dict): WSGI環境変数の辞書オブジェクト
+            start_response (callable): レスポンスヘッダーを設定するための関数
+
+        Returns:
+            Iterable[bytes]: レスポンスボディ
+        """
+        # 静的ファイルはフォームを解析せずに返す (大きいファイルはwsgi.file_wrapperで送信する)
+        asset = self.static.get(environ.get("PATH_INFO", "/"))
+        if asset is not None:
+            status, headers, body = self.static.respond(environ, asset)
+            start_response(status, headers)
+            if isinstance(body, bytes):
+                return [body]
+            file_wrapper = environ.get("wsgi.file_wrapper")
+            if file_wrapper is not None:
+                return file_wrapper(body, STATIC_CHUNK_SIZE)
+            return iter_file(body)
+
+        if get_content_length(environ) > MAX_BODY_SIZE:
+            start_response("413 Payload Too Large", [("Content-Length", "0")])
+            return []
+
+        # 段階ごとの処理時間を計測する (ストリーミングの場合は送信し終えたときに集計する)
+        timer = RequestTimer()
+        token = start_timer(timer)
+        try:
+            # フォームデータを取得
+            with timed("parse"):
+                form = parse_wsgi_form(environ)
 
-        response = response.encode("utf-8")
+            path = environ.get("PATH_INFO", "/")
+            timer.route = self.request_route(path, form)
+            status, headers, response = self.handle_request(path, form, environ)
+            timer.status = status.split(" ", 1)[0]
+            headers, body = self.encode_response(environ, status, headers, response)
+            # ストリーミング中は送信し終えるまで接続を借りたままになるため、同時に送信する数を制限する
+            # (上限に達している場合はまとめて生成してから送信する)
+            is_streaming = not isinstance(body, bytes)
+            if is_streaming and not self._acquire_wsgi_stream():
+                body = b"".join(TimedIterator(body, timer, lambda timer: None))
+                is_streaming = False
+        except TimeoutError:
+            # 接続プールの接続が空かない場合
+            status = "503 Service Unavailable"
+            headers = [("Content-Length", "0"), ("Retry-After", "1")]
+            body, is_streaming = b"", False
+            timer.status = "503"
+        finally:
+            end_timer(token)
 
         # レスポンス
-        start_response(
-            "200 OK",
-            [
-                ("Content-Type", "text/html; charset=utf-8"),
-                ("Content-Length", str(len(response))),
-            ],
+        start_response(status, headers)
+        if not is_streaming:
+            timer.response_bytes = len(body)
+            self.metrics.record(timer)
+            return [body]
+        return TimedIterator(body, timer, self._finish_wsgi_stream)
+
+    def _acquire_wsgi_stream(self) -> bool:
+        """
+        WSGIでストリーミングレスポンスを送信する枠を確保する
+
+        Returns:
+            bool: 確保できた場合はTrue (上限に達している・接続プールに余裕がない場合はFalse)
+        """
+        return self._wsgi_streams is not None and self._wsgi_streams.acquire(
+            blocking=False
         )
-        return [response]
+
+    def _finish_wsgi_stream(self, timer) -> None:
+        """
+        ストリーミングレスポンスを送信し終えたときに枠を返して処理時間を集計する
+
+        Args:
+            timer (RequestTimer): リクエストの計測
+        """
+        self._wsgi_streams.release()
+        self.metrics.record(timer)
+
+    def _get_asgi_streams(self):
+        """
+        同時に送信中のストリーミングレスポンスの数を制限するセマフォを取得 (最初の呼び出しで作成する)
+
+        Returns:
+            asyncio.Semaphore or None: セマフォ (接続プールに余裕がない場合はNone)
+        """
+        if self._asgi_streams is None and self._asgi_stream_limit > 0:
+            import asyncio
+
+            self._asgi_streams = asyncio.Semaphore(self._asgi_stream_limit)
+        return self._asgi_streams
+
+    async def asgi(self, scope, receive, send) -> None:
+        """
+        ASGIアプリケーションのエントリーポイント
+
+        SQLiteへの問い合わせとHTMLの生成はイベントループを止めないようにワーカースレッドで実行する
+
+        Args:
+            scope (dict): 接続の情報
+            receive (callable): メッセージを受信するための関数
+            send (callable): メッセージを送信するための関数
+        """
+        # ASGIサーバがイベントループを動かしているため、ここでの読み込みは辞書の参照だけで済む
+        import asyncio
+
+        if scope["type"] == "lifespan":
+            await self._asgi_lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        environ = asgi_environ(scope)
+        asset = self.static.get(environ["PATH_INFO"])
+        if asset is not None:
+            await self._asgi_static(scope, send, environ, asset)
+            return
+        if get_content_length(environ) > MAX_BODY_SIZE:
+            await send_response(send, "413 Payload Too Large", [])
+            return
+        body = await read_asgi_body(receive)
+        if body is None:
+            await send_response(send, "413 Payload Too Large", [])
+            return
+        # 段階ごとの処理時間を計測する (ワーカースレッドにはexecutor.runがコンテキストごと引き継ぐ)
+        timer = RequestTimer()
+        token = start_timer(timer)
+        try:
+            with timed("parse"):
+                form = FormData.parse(
+                    environ["QUERY_STRING"], body, environ.get("CONTENT_TYPE", "")
+                )
+            timer.route = self.request_route(environ["PATH_INFO"], form)
+
+            try:
+                status, headers, response = await self.executor.run(
+                    self.handle_request, environ["PATH_INFO"], form, environ
+                )
+            except (ExecutorBusy, TimeoutError):
+                # スレッドプール・接続プールに空きがない場合
+                await send_response(
+                    send, "503 Service Unavailable", [("Retry-After", "1")]
+                )
+                return
+            timer.status = status.split(" ", 1)[0]
+
+            # リクエストの処理を始めた後は、スレッドプールに空きがなくても503にせず空きを待つ
+            if isinstance(response, str):
+                headers, body = await self.executor.run(
+                    self.encode_response, environ, status, headers, response, wait=True
+                )
+                await send_response(send, status, headers, body)
+                timer.response_bytes = len(body)
+                self.metrics.record(timer)
+                return
+
+            headers, chunks = self.encode_response(environ, status, headers, response)
+        finally:
+            end_timer(token)
+        chunks = TimedIterator(chunks, timer, self.metrics.record)
+
+        # 接続プールに余裕がない場合はワーカースレッドでまとめて生成してから送信する
+        streams = self._get_asgi_streams()
+        if streams is None:
+            response = b"".join(await self.executor.run(list, chunks, wait=True))
+            await send_response(send, status, headers, response)
+            return
+
+        # ストリーミングの場合は次の断片の生成 (カーソルからの読み込み) をワーカースレッドで実行する
+        await streams.acquire()
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": int(status.split(" ", 1)[0]),
+                    "headers": encode_headers(headers),
+                }
+            )
+            while True:
+                chunk = await self.executor.run(next, chunks, None, wait=True)
+                if chunk is None:
+                    break
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            # 途中で切断された場合もプールから借りた接続を返す
+            await asyncio.get_running_loop().run_in_executor(None, chunks.close)
+            streams.release()
+
+    async def _asgi_static(self, scope, send, environ, asset) -> None:
+        """
+        静的ファイルをASGIで送信する
+
+        大きいファイルは、サーバがhttp.response.pathsend拡張に対応している場合はパスを渡して送信させ,
+        対応していない場合はワーカースレッドで少しずつ読み込みながら送信する
+
+        Args:
+            scope (dict): 接続の情報
+            send (callable): メッセージを送信するための関数
+            environ (dict): WSGI環境変数の辞書オブジェクト
+            asset (StaticAsset): 配信するファイルの情報
+        """
+        status, headers, body = self.static.respond(environ, asset)
+        if isinstance(body, bytes):
+            await send_response(send, status, headers, body)
+            return
+        chunks = iter_file(body)
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": int(status.split(" ", 1)[0]),
+                    "headers": encode_headers(headers),
+                }
+            )
+            if "http.response.pathsend" in scope.get("extensions", {}):
+                await send(
+                    {
+                        "type": "http.response.pathsend",
+                        "path": os.path.abspath(asset.filename),
+                    }
+                )
+                return
+            while True:
+                chunk = await self.executor.run(next, chunks, None, wait=True)
+                if chunk is None:
+                    break
+                await send(
+                    {"type": "http.response.body", "body": chunk, "more_body": True}
+                )
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            chunks.close()
+            body.close()
+
+    async def _asgi_lifespan(self, receive, send) -> None:
+        """
+        ASGIサーバの起動・停止の通知を処理する (停止時にワーカースレッドと接続プールを閉じる)
+
+        Args:
+            receive (callable): メッセージを受信するための関数
+            send (callable): メッセージを送信するための関数
+        """
+        import asyncio
+
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self.executor.shutdown
+                )
+                self.pool.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+def create_asgi_app():
+    """
+    ASGIアプリケーションを生成する (uvicorn sdvx_stats_app:create_asgi_app --factory などで起動する)
+
+    Returns:
+        callable: ASGIアプリケーション
+    """
+    sdvx_app = SdvxStatsApp(dbname="data/sdvx_stats.db", csv_file="data/sdvx_stats.csv")
+    return sdvx_app.asgi
 
 
 # リファレンスWEBサーバを起動
@@ -294,12 +1554,94 @@ class SdvxStatsApp:
 # このサンプルの動作が確認できる．
 # コマンドライン引数にポート番号を指定（python3 sql.py ポート番号）した場合は，
 # http://localhost:ポート番号 にアクセスする．
+# --threads・--processesでワーカースレッド・プロセスの数を指定できる．
+
+
+def parse_args(argv=None):
+    """
+    コマンドライン引数を解析
+
+    Args:
+        argv (list, optional): コマンドライン引数 (省略時はsys.argv)
+
+    Returns:
+        argparse.Namespace: 解析結果
+    """
+    # argparseはコマンドラインから起動した場合だけ必要なため、ここで読み込む
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="SDVXの統計データを表示するWebアプリケーション"
+    )
+    parser.add_argument("port", nargs="?", type=int, default=8080, help="ポート番号")
+    parser.add_argument("--host", default="", help="待ち受けるホスト名")
+    parser.add_argument(
+        "--threads", type=int, default=8, help="1プロセスあたりのワーカースレッドの数"
+    )
+    parser.add_argument("--processes", type=int, default=1, help="プロセスの数")
+    parser.add_argument(
+        "--queue-size", type=int, default=64, help="処理待ちの接続の上限"
+    )
+    parser.add_argument("--quiet", action="store_true", help="アクセスログを出力しない")
+    parser.add_argument(
+        "--search-normalize",
+        action="store_true",
+        help="楽曲名・作曲者の検索で全角・半角, カタカナ・ひらがなを区別しない",
+    )
+    parser.add_argument(
+        "--backend",
+        choices=SEARCH_BACKENDS,
+        default="sqlite",
+        help="検索の絞り込みを求めるバックエンド (memory: メモリ上の列指向スナップショット)",
+    )
+    parser.add_argument(
+        "--slow-query-ms",
+        type=float,
+        help="これより時間のかかった問い合わせを実行計画とともに標準エラー出力に記録する (ミリ秒)",
+    )
+    parser.add_argument(
+        "--simple",
+        action="store_true",
+        help="1度に1リクエストずつ処理するwsgiref.simple_serverで起動する",
+    )
+    parser.add_argument(
+        "--startup-report",
+        action="store_true",
+        help="起動処理の段階ごとの所要時間を標準エラー出力に表示する",
+    )
+    return parser.parse_args(argv)
+
 
 if __name__ == "__main__":
-    port = 8080
-    if len(sys.argv) == 2:
-        port = int(sys.argv[1])
+    args = parse_args()
 
-    sdvx_app = SdvxStatsApp(dbname="data/sdvx_stats.db", csv_file="data/sdvx_stats.csv")
-    server = simple_server.make_server("", port, sdvx_app.application)
-    server.serve_forever()
+    sdvx_app = SdvxStatsApp(
+        dbname="data/sdvx_stats.db",
+        csv_file="data/sdvx_stats.csv",
+        search_normalize=args.search_normalize,
+        backend=args.backend,
+        slow_query_ms=args.slow_query_ms,
+        # ワーカースレッドごとに1つ (ストリーミング中も借りたまま) と起動時の準備のスレッドの分の接続を用意する
+        pool_size=args.threads + 1,
+        # 複数プロセスの場合は準備を済ませてからforkする (子プロセスが準備済みの索引・キャッシュを共有する)
+        warm_up="sync" if args.processes > 1 else "background",
+    )
+    if args.startup_report:
+        print(sdvx_app.startup_report(), file=sys.stderr)
+    if args.simple:
+        from wsgiref import simple_server
+
+        server = simple_server.make_server(args.host, args.port, sdvx_app.application)
+        server.serve_forever()
+    else:
+        from modules.server import serve
+
+        serve(
+            sdvx_app.application,
+            host=args.host,
+            port=args.port,
+            threads=args.threads,
+            processes=args.processes,
+            queue_size=args.queue_size,
+            quiet=args.quiet,
+        )
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+"""テストで使う小さなCSVファイル・データベースの作成"""
+
+import contextlib
+import csv
+import os
+
+# テストに使う元データ (リポジトリ同梱のCSV)
+CSV_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(__file__)), "data", "sdvx_stats.csv"
+)
+
+
+def read_csv_rows(csv_file=CSV_FILE, limit=None) -> tuple:
+    """
+    CSVファイルの見出し行と行を読み込む
+
+    Args:
+        csv_file (str, optional): CSVファイル名
+        limit (int, optional): 読み込む行数の上限 (Noneならすべて)
+
+    Returns:
+        tuple (list, list): 見出し行, 行のリスト
+    """
+    with open(csv_file, "r", encoding="utf-8-sig", newline="") as file:
+        reader = csv.reader(file)
+        header = next(reader)
+        rows = []
+        for row in reader:
+            if limit is not None and len(rows) >= limit:
+                break
+            rows.append(row)
+    return header, rows
+
+
+def write_csv(csv_file, header, rows) -> None:
+    """
+    見出し行と行をCSVファイルに書き込む
+
+    Args:
+        csv_file (str): CSVファイル名
+        header (list): 見出し行
+        rows (list): 行のリスト
+    """
+    with open(csv_file, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+def build_test_db(directory, limit=None) -> str:
+    """
+    CSVファイル (limit行まで) からデータベースを構築する (取り込み時のメッセージは出力しない)
+
+    Args:
+        directory (str): データベースを作成するディレクトリ
+        limit (int, optional): 取り込む行数の上限 (Noneならすべて)
+
+    Returns:
+        str: データベースのファイル名
+    """
+    from modules.create_db import build_db
+
+    csv_file = os.path.join(directory, "sdvx_stats.csv")
+    dbname = os.path.join(directory, "sdvx_stats.db")
+    write_csv(csv_file, *read_csv_rows(limit=limit))
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        build_db(dbname, csv_file)
+    return dbname
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+
+"""条件付きGET (304 Not Modified) とgzip圧縮のレスポンスヘッダのテスト"""
+
+import os
+import tempfile
+import unittest
+from wsgiref.util import setup_testing_defaults
+
+from tests.helpers import build_test_db
+
+# テンプレート・静的ファイルはリポジトリのルートからの相対パスで読み込まれる
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class ConditionalGetTest(unittest.TestCase):
+    """gzipを受け付けるクライアントへの304が200と同じETag・Varyを返すことを確認する"""
+
+    @classmethod
+    def setUpClass(cls):
+        from sdvx_stats_app import SdvxStatsApp
+
+        cls._tmpdir = tempfile.TemporaryDirectory()
+        cls._cwd = os.getcwd()
+        os.chdir(ROOT_DIR)
+        dbname = build_test_db(cls._tmpdir.name, limit=200)
+        csv_file = os.path.join(cls._tmpdir.name, "sdvx_stats.csv")
+        cls.app = SdvxStatsApp(dbname=dbname, csv_file=csv_file, sync_interval=None)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.app.pool.close()
+        os.chdir(cls._cwd)
+        cls._tmpdir.cleanup()
+
+    def call(self, path, query="", **extra) -> tuple:
+        """アプリケーションを呼び出し、ステータス・ヘッダの辞書・ボディを返す"""
+        environ = {"PATH_INFO": path, "QUERY_STRING": query}
+        setup_testing_defaults(environ)
+        environ.update(extra)
+        response = {}
+
+        def start_response(status, headers):
+            response["status"] = status
+            response["headers"] = headers
+
+        body = b"".join(self.app.application(environ, start_response))
+        return response["status"], dict(response["headers"]), body
+
+    def assert_not_modified(self, path, query):
+        status, headers, _ = self.call(path, query, HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(status, "200 OK")
+        self.assertEqual(headers["Content-Encoding"], "gzip")
+        self.assertTrue(headers["ETag"].endswith('-gzip"'))
+
+        status, not_modified, body = self.call(
+            path,
+            query,
+            HTTP_ACCEPT_ENCODING="gzip",
+            HTTP_IF_NONE_MATCH=headers["ETag"],
+        )
+        self.assertEqual(status, "304 Not Modified")
+        self.assertEqual(body, b"")
+        self.assertEqual(not_modified["ETag"], headers["ETag"])
+        self.assertEqual(not_modified["Vary"], "Accept-Encoding")
+        self.assertNotIn("Content-Encoding", not_modified)
+
+        # gzipを受け付けないクライアントには圧縮前のETagを返す
+        status, plain, _ = self.call(path, query, HTTP_IF_NONE_MATCH=headers["ETag"])
+        self.assertEqual(status, "304 Not Modified")
+        self.assertEqual(plain["ETag"], headers["ETag"].replace('-gzip"', '"'))
+        self.assertEqual(plain["Vary"], "Accept-Encoding")
+
+    def test_html(self):
+        self.assert_not_modified("/", "submit=&format=1")
+
+    def test_api(self):
+        self.assert_not_modified("/api/search", "output=jsonl")
+
+    def test_gzip_cache_follows_build_version(self):
+        self.call("/", "about=", HTTP_ACCEPT_ENCODING="gzip")
+        # キャッシュの中身を差し替えて、キャッシュが使われたかどうかを判別する
+        self.app.compressed_cache.put(("/", "about="), (b"stale",))
+        _, _, body = self.call("/", "about=", HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(body, b"stale")
+
+        build_version = self.app.build_version
+        try:
+            # テンプレート・静的ファイルの更新 (デプロイ) 後は圧縮済みのキャッシュを使わない
+            self.app.build_version = "changed"
+            _, _, body = self.call("/", "about=", HTTP_ACCEPT_ENCODING="gzip")
+            self.assertNotEqual(body, b"stale")
+        finally:
+            self.app.build_version = build_version
+
+
+if __name__ == "__main__":
+    unittest.main()
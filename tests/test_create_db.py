@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+
+"""スキーマの移行・CSVとの差分同期・CSVの変更判定のテスト"""
+
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+from modules import create_db
+from modules.create_db import (
+    SCHEMA_VERSION,
+    build_db,
+    get_data_version,
+    get_schema_version,
+    is_csv_modified,
+    migrate_db,
+    read_meta,
+    sync_db,
+)
+from tests.helpers import read_csv_rows, write_csv
+
+from data import Column
+
+
+class CreateDbTestCase(unittest.TestCase):
+    """一時ディレクトリに小さなCSVファイルを用意するテストの基底クラス"""
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tempdir.cleanup)
+        self.dbname = os.path.join(self.tempdir.name, "sdvx_stats.db")
+        self.csv_file = os.path.join(self.tempdir.name, "sdvx_stats.csv")
+        self.header, self.rows = read_csv_rows(limit=40)
+        write_csv(self.csv_file, self.header, self.rows)
+        # 取り込み・同期時のメッセージは出力しない
+        patcher = mock.patch("builtins.print")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch_rows(self) -> dict:
+        """データベースの行を (楽曲名, 難易度) -> 行の辞書で取得"""
+        con = sqlite3.connect(self.dbname)
+        try:
+            columns = ", ".join(Column.column_info)
+            rows = con.execute(f"SELECT {columns} FROM sdvx_stats").fetchall()
+        finally:
+            con.close()
+        return {(row[0], row[1]): row for row in rows}
+
+
+class MigrateDbTest(CreateDbTestCase):
+    """旧スキーマ (バージョン0) からの移行"""
+
+    def create_v0_db(self) -> None:
+        """型・インデックスなしの旧スキーマのデータベースを作成 (値はすべて文字列)"""
+        columns = ", ".join(Column.column_info)
+        placeholder = ", ".join("?" for _ in Column.column_info)
+        con = sqlite3.connect(self.dbname)
+        con.execute(f"CREATE TABLE sdvx_stats ({columns})")
+        con.executemany(
+            f"INSERT INTO sdvx_stats ({columns}) VALUES ({placeholder})", self.rows
+        )
+        con.commit()
+        con.close()
+
+    def test_migrate_v0(self):
+        self.create_v0_db()
+        con = sqlite3.connect(self.dbname)
+        try:
+            self.assertEqual(get_schema_version(con), 0)
+            self.assertTrue(migrate_db(con))
+            self.assertEqual(get_schema_version(con), SCHEMA_VERSION)
+            # 2回目は何もしない
+            self.assertFalse(migrate_db(con))
+
+            # 数値の列は整数に変換される
+            level, count = con.execute(
+                "SELECT typeof(level), typeof(count) FROM sdvx_stats LIMIT 1"
+            ).fetchone()
+            self.assertEqual((level, count), ("integer", "integer"))
+            tables = {
+                row[0]
+                for row in con.execute(
+                    "SELECT name FROM sqlite_master WHERE type IN ('table', 'index')"
+                )
+            }
+            for name in ["sdvx_search", "sdvx_summary", "sdvx_meta"] + list(
+                Column.indexes
+            ):
+                self.assertIn(name, tables)
+            # 主キーが張られている
+            with self.assertRaises(sqlite3.IntegrityError):
+                con.execute(
+                    "INSERT INTO sdvx_stats (music_title, difficulty_name) VALUES (?, ?)",
+                    self.rows[0][:2],
+                )
+        finally:
+            con.close()
+
+        rows = self.fetch_rows()
+        self.assertEqual(len(rows), len(self.rows))
+        first = self.rows[0]
+        self.assertEqual(rows[(first[0], first[1])][2], int(first[2]))
+
+    def test_migrate_keeps_old_schema_on_failure(self):
+        self.create_v0_db()
+        con = sqlite3.connect(self.dbname)
+        try:
+            with mock.patch.object(
+                create_db, "finish_schema", side_effect=sqlite3.OperationalError
+            ):
+                with self.assertRaises(sqlite3.OperationalError):
+                    migrate_db(con)
+            self.assertEqual(get_schema_version(con), 0)
+            self.assertEqual(
+                con.execute("SELECT count(*) FROM sdvx_stats").fetchone()[0],
+                len(self.rows),
+            )
+        finally:
+            con.close()
+
+
+class SyncDbTest(CreateDbTestCase):
+    """CSVファイルとの差分同期"""
+
+    def setUp(self):
+        super().setUp()
+        build_db(self.dbname, self.csv_file)
+
+    def test_sync_added_changed_deleted_rows(self):
+        level_index = self.header.index("level")
+        count_index = self.header.index("count")
+        rows = [list(row) for row in self.rows]
+        # 1行目のプレイ人数を変更, 2行目を削除, 新しい譜面を追加
+        rows[0][count_index] = str(int(rows[0][count_index]) + 1)
+        deleted = rows.pop(1)
+        added = list(rows[2])
+        added[0] = "テスト用の楽曲"
+        added[level_index] = "20"
+        rows.append(added)
+        write_csv(self.csv_file, self.header, rows)
+
+        result = sync_db(self.dbname, self.csv_file)
+        self.assertEqual(result, {"upserted": 2, "deleted": 1, "data_version": 2})
+
+        db_rows = self.fetch_rows()
+        self.assertEqual(len(db_rows), len(rows))
+        self.assertNotIn((deleted[0], deleted[1]), db_rows)
+        self.assertEqual(
+            db_rows[(rows[0][0], rows[0][1])][count_index], int(rows[0][count_index])
+        )
+        self.assertEqual(db_rows[(added[0], added[1])][level_index], 20)
+
+        # 集計表・全文検索インデックスも作り直される
+        con = sqlite3.connect(self.dbname)
+        try:
+            hits = con.execute(
+                "SELECT count(*) FROM sdvx_search WHERE music_title LIKE ?",
+                ["%テスト用%"],
+            ).fetchone()[0]
+            self.assertEqual(hits, 1)
+            self.assertFalse(is_csv_modified(con, self.csv_file))
+        finally:
+            con.close()
+
+    def test_sync_without_changes_keeps_version(self):
+        # 内容が同じなら更新時刻が変わってもデータのバージョンは上がらない
+        write_csv(self.csv_file, self.header, self.rows)
+        result = sync_db(self.dbname, self.csv_file)
+        self.assertEqual(result, {"upserted": 0, "deleted": 0, "data_version": 1})
+
+
+class IsCsvModifiedTest(CreateDbTestCase):
+    """更新時刻・サイズ・ハッシュ値によるCSVファイルの変更判定"""
+
+    def setUp(self):
+        super().setUp()
+        build_db(self.dbname, self.csv_file)
+        self.con = sqlite3.connect(self.dbname)
+        self.addCleanup(self.con.close)
+
+    def test_unchanged_file_is_not_hashed(self):
+        with mock.patch.object(create_db.hashlib, "sha256", side_effect=AssertionError):
+            self.assertFalse(is_csv_modified(self.con, self.csv_file))
+
+    def test_touched_file_records_new_mtime(self):
+        stat = os.stat(self.csv_file)
+        os.utime(self.csv_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        # 内容が同じなのでハッシュ値を計算して変更なしと判定し、新しい更新時刻を記録する
+        self.assertFalse(is_csv_modified(self.con, self.csv_file))
+        self.assertEqual(
+            read_meta(self.con)["csv_mtime"], str(stat.st_mtime_ns + 10**9)
+        )
+        # 次回はハッシュ値を計算しない
+        with mock.patch.object(create_db.hashlib, "sha256", side_effect=AssertionError):
+            self.assertFalse(is_csv_modified(self.con, self.csv_file))
+
+    def test_changed_content_is_detected(self):
+        write_csv(self.csv_file, self.header, self.rows[:-1])
+        self.assertTrue(is_csv_modified(self.con, self.csv_file))
+        self.assertEqual(get_data_version(self.con), 1)
+
+    def test_same_size_change_is_detected_by_hash(self):
+        stat = os.stat(self.csv_file)
+        rows = [list(row) for row in self.rows]
+        # 1桁の数字を別の1桁の数字に変えてサイズを変えずに内容を変更する
+        played_index = self.header.index("played")
+        rows[0][played_index] = "1" if rows[0][played_index] != "1" else "2"
+        write_csv(self.csv_file, self.header, rows)
+        self.assertEqual(os.stat(self.csv_file).st_size, stat.st_size)
+        self.assertTrue(is_csv_modified(self.con, self.csv_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+
+"""ページ送りのカーソルとキーセットページングのテスト"""
+
+import base64
+import sqlite3
+import tempfile
+import unittest
+from urllib.parse import urlencode
+
+from modules.create_results import create_page_cursors, split_page
+from modules.form import FormData
+from modules.make_sql import (
+    decode_page_cursor,
+    encode_page_cursor,
+    make_sql_from_form,
+    parse_page_params,
+)
+from tests.helpers import build_test_db
+
+from data import Column
+
+
+def _encode_raw(text) -> str:
+    """任意のJSON文字列をカーソルと同じ形式に変換 (改ざんされたカーソルの作成)"""
+    return base64.urlsafe_b64encode(text.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+class PageCursorTest(unittest.TestCase):
+    """カーソルの変換"""
+
+    def test_round_trip(self):
+        for key_values in [
+            [9876543, "楽曲名", "MAXIMUM"],
+            [None, 'title with "quotes" & spaces', "EXHAUST"],
+            ["文字列の値", "゜*。Chantilly Fille。*°", "ADVANCED"],
+            [12.5, "", "NOVICE"],
+        ]:
+            cursor = encode_page_cursor(key_values)
+            self.assertNotIn("=", cursor)
+            self.assertEqual(decode_page_cursor(cursor), key_values)
+
+    def test_invalid_cursor(self):
+        for cursor in ["", "!!!", "not base64 at all", _encode_raw("{")]:
+            self.assertIsNone(decode_page_cursor(cursor))
+
+    def test_wrong_shape(self):
+        for text in ['{"a": 1}', "[1, 2]", '[1, "a", "b", "c"]', '"abc"', "3"]:
+            self.assertIsNone(decode_page_cursor(_encode_raw(text)))
+
+    def test_incomparable_values(self):
+        # SQLのプレースホルダ・スナップショットの比較に使えない値を含むカーソルは無視する
+        for text in [
+            "[{}, 1, 2]",
+            '[[1], "a", "b"]',
+            '[true, "a", "b"]',
+            '[1, {"x": 1}, "b"]',
+            '[Infinity, "a", "b"]',
+            '[NaN, "a", "b"]',
+        ]:
+            self.assertIsNone(decode_page_cursor(_encode_raw(text)), text)
+
+    def test_tampered_cursor_is_ignored_by_page_params(self):
+        form = FormData.parse(urlencode({"after": _encode_raw("[{}, 1, 2]")}))
+        page = parse_page_params(form, Column.display_info)
+        self.assertIsNone(page["cursor"])
+        self.assertFalse(page["is_backward"])
+
+
+class KeysetPagingTest(unittest.TestCase):
+    """前後のページへのカーソルをたどった結果が全件を並び替えた結果と一致すること"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.TemporaryDirectory()
+        cls.con = sqlite3.connect(build_test_db(cls.tempdir.name))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.tempdir.cleanup()
+
+    def fetch_page(self, params) -> tuple:
+        """
+        1ページ分を取得
+
+        Returns:
+            tuple (list, str, str): 表示する行の (楽曲名, 難易度) のリスト, 前のページ・次のページのカーソル
+        """
+        form = FormData.parse(urlencode(params, doseq=True))
+        page = parse_page_params(form, Column.display_info)
+        query, _, _ = make_sql_from_form(
+            form, Column.filter_info, Column.display_info, page
+        )
+        rows, has_prev, has_next = split_page(
+            self.con.execute(query.sql, query.values).fetchall(), query.page
+        )
+        prev_cursor, next_cursor = create_page_cursors(
+            rows, query.select_keys, has_prev, has_next
+        )
+        return [(row[0], row[1]) for row in rows], prev_cursor, next_cursor
+
+    def expected_order(self, sort, order, level_filter=None) -> list:
+        """並び替えの列・楽曲名・難易度で並び替えた全件の (楽曲名, 難易度) のリスト"""
+        direction = "DESC" if order == "desc" else "ASC"
+        where, values = "", []
+        if level_filter is not None:
+            where, values = "WHERE level = ?", [level_filter]
+        return self.con.execute(
+            f"SELECT music_title, difficulty_name FROM sdvx_stats {where} ORDER BY "
+            + f"{sort} {direction}, music_title {direction}, difficulty_name {direction}",
+            values,
+        ).fetchall()
+
+    def walk(self, params) -> tuple:
+        """
+        最初のページから次のページをたどり、最後のページから前のページをたどる
+
+        Args:
+            params (dict): 検索条件・ページ送りの条件
+
+        Returns:
+            tuple (list, list): 前向きにたどった行, 後ろ向きにたどった行 (元の順に並べたもの)
+        """
+        rows, prev_cursor, next_cursor = self.fetch_page(params)
+        self.assertEqual(prev_cursor, "")
+        forward = list(rows)
+        while next_cursor:
+            rows, prev_cursor, next_cursor = self.fetch_page(
+                dict(params, after=next_cursor)
+            )
+            self.assertNotEqual(prev_cursor, "")
+            forward += rows
+
+        # 最後のページから先頭に向かってたどる
+        backward_pages = [rows]
+        while prev_cursor:
+            rows, prev_cursor, next_cursor = self.fetch_page(
+                dict(params, before=prev_cursor)
+            )
+            self.assertNotEqual(next_cursor, "")
+            backward_pages.append(rows)
+        backward = [row for page in reversed(backward_pages) for row in page]
+        return forward, backward
+
+    def test_walk(self):
+        for sort in ["music_title", "level", "avg_score", "count"]:
+            for order in ["asc", "desc"]:
+                with self.subTest(sort=sort, order=order):
+                    params = {"sort": sort, "order": order, "page_size": 500}
+                    forward, backward = self.walk(params)
+                    expected = self.expected_order(sort, order)
+                    self.assertEqual(len(set(forward)), len(forward))
+                    self.assertEqual(forward, expected)
+                    self.assertEqual(backward, expected)
+
+    def test_walk_with_filter(self):
+        params = {"sort": "avg_score", "order": "desc", "page_size": 50}
+        params["level_filter"] = 18
+        forward, backward = self.walk(params)
+        expected = self.expected_order("avg_score", "desc", level_filter=18)
+        self.assertGreater(len(expected), 50)
+        self.assertEqual(forward, expected)
+        self.assertEqual(backward, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+"""列指向スナップショットの検索結果がSQLiteと一致することのテスト"""
+
+import itertools
+import sqlite3
+import tempfile
+import unittest
+from urllib.parse import urlencode
+
+from modules.create_results import create_page_cursors, split_page
+from modules.form import FormData
+from modules.make_sql import make_sql_from_form, parse_page_params
+from modules.snapshot import ColumnarSnapshot
+from tests.helpers import build_test_db
+
+from data import Column
+
+# 絞り込みの条件の組み合わせ (部分一致検索は3文字未満・3文字以上・ワイルドカード・大文字小文字・全角半角)
+FILTERS = [
+    {},
+    {"level_filter": [18, 19, 20]},
+    {"difficulty": [3, 4]},
+    {"level_filter": [17], "difficulty": [2, 3]},
+    {"music_title_filter": "a"},
+    {"music_title_filter": "LOVE"},
+    {"music_title_filter": "の"},
+    {"music_title_filter": "ｶﾞ"},
+    {"music_title_filter": "%e_"},
+    {"artist_filter": "feat"},
+    {"artist_filter": "xi", "level_filter": [19, 20]},
+    {"music_title_filter": "zzzzzz"},
+]
+# 表示項目 (空の場合はすべての列)
+DISPLAY_KEYS = [[], ["level", "avg_score"], ["artist", "count", "grade_S"]]
+
+
+class SnapshotParityTest(unittest.TestCase):
+    """スナップショットとSQLiteで同じ問い合わせの結果を比較する"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.tempdir = tempfile.TemporaryDirectory()
+        cls.con = sqlite3.connect(build_test_db(cls.tempdir.name))
+        cls.snapshot = ColumnarSnapshot.load(cls.con)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.con.close()
+        cls.tempdir.cleanup()
+
+    def search_both(self, params, normalize) -> tuple:
+        """
+        同じフォームの問い合わせをSQLiteとスナップショットで実行
+
+        Returns:
+            tuple (Query, list, list): 問い合わせ, SQLiteの結果, スナップショットの結果
+        """
+        form = FormData.parse(urlencode(params, doseq=True))
+        page = parse_page_params(form, Column.display_info)
+        query, _, _ = make_sql_from_form(
+            form, Column.filter_info, Column.display_info, page, normalize
+        )
+        expected = self.con.execute(query.sql, query.values).fetchall()
+        actual = self.snapshot.search(
+            query.filters, query.select_keys, query.page, query.normalize
+        )
+        return query, expected, actual
+
+    def form_params(self, filters, display_keys) -> dict:
+        """絞り込みの条件と表示項目からフォームのパラメータを作成"""
+        params = {"submit": "", **filters}
+        for key in display_keys:
+            params[key] = "on"
+        return params
+
+    def test_all_rows(self):
+        # 全件表示はSQLiteでは並び順が決まらないため、行の集合を比較する
+        for filters, display_keys, normalize in itertools.product(
+            FILTERS, DISPLAY_KEYS, [False, True]
+        ):
+            with self.subTest(
+                filters=filters, display=display_keys, normalize=normalize
+            ):
+                params = self.form_params(filters, display_keys)
+                params["page_size"] = 0
+                _, expected, actual = self.search_both(params, normalize)
+                self.assertEqual(sorted(actual, key=repr), sorted(expected, key=repr))
+
+    def test_pages(self):
+        # ページ送りは並び順も含めて一致し、カーソルをたどっても一致する
+        for filters, sort, order, normalize in itertools.product(
+            FILTERS,
+            ["music_title", "level", "avg_score", "sd_score"],
+            ["asc", "desc"],
+            [False, True],
+        ):
+            with self.subTest(
+                filters=filters, sort=sort, order=order, normalize=normalize
+            ):
+                params = self.form_params(filters, ["count", sort])
+                params.update(sort=sort, order=order, page_size=500)
+                for _ in range(20):
+                    query, expected, actual = self.search_both(params, normalize)
+                    self.assertEqual(actual, expected)
+                    rows, has_prev, has_next = split_page(expected, query.page)
+                    _, next_cursor = create_page_cursors(
+                        rows, query.select_keys, has_prev, has_next
+                    )
+                    if not next_cursor:
+                        break
+                    params["after"] = next_cursor
+
+    def test_previous_page(self):
+        params = self.form_params({"level_filter": [18]}, ["avg_score"])
+        params.update(sort="avg_score", order="desc", page_size=50)
+        query, expected, actual = self.search_both(params, False)
+        rows, has_prev, has_next = split_page(expected, query.page)
+        _, next_cursor = create_page_cursors(
+            rows, query.select_keys, has_prev, has_next
+        )
+        query, expected, actual = self.search_both(
+            dict(params, after=next_cursor), False
+        )
+        rows, has_prev, has_next = split_page(expected, query.page)
+        prev_cursor, _ = create_page_cursors(
+            rows, query.select_keys, has_prev, has_next
+        )
+        _, expected, actual = self.search_both(dict(params, before=prev_cursor), False)
+        self.assertEqual(actual, expected)
+
+
+if __name__ == "__main__":
+    unittest.main()
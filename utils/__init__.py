@@ -1 +1,2 @@
+from utils.template import *  # NOQA
 from utils.utils import *  # NOQA
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+"""HTMLテンプレートの読み込みと埋め込み"""
+
+import hashlib
+import os
+import re
+import threading
+
+# テンプレート中の埋め込み箇所 ({% key %}) のパターン
+SLOT_PATTERN = re.compile(r"\{% (\w+) %\}")
+# テンプレート中のサイト内のURL (href="/...", src="/...") のパターン
+LOCAL_URL_PATTERN = re.compile(r'\b(href|src)="(/[^"?#]*)"')
+
+
+class Template:
+    """
+    固定部分の文字列と埋め込み箇所に分割済みのHTMLテンプレート
+
+    描画時は分割済みの部分を1回のjoinで連結するため、埋め込み箇所ごとにページ全体をコピーしない
+    """
+
+    def __init__(self, html):
+        """
+        Args:
+            html (str): テンプレートのHTML
+        """
+        # 偶数番目は固定部分の文字列, 奇数番目は埋め込み箇所のキー
+        self.segments = SLOT_PATTERN.split(html)
+        self.keys = set(self.segments[1::2])
+        # テンプレートの内容のハッシュ (ETagに含め、テンプレートが変わったらキャッシュを無効にする)
+        self.digest = hashlib.sha256(html.encode("utf-8")).hexdigest()[:12]
+
+    def render(self, data=None) -> str:
+        """
+        埋め込み箇所にデータを埋め込んだHTMLを生成
+
+        Args:
+            data (dict, optional): 埋め込み箇所のキーと埋め込む文字列の辞書
+
+        Returns:
+            str: 生成したHTML (dataにないキーの埋め込み箇所はそのまま残す)
+        """
+        if data is None:
+            data = {}
+        segments = self.segments[:]
+        for index in range(1, len(segments), 2):
+            key = segments[index]
+            segments[index] = data[key] if key in data else "{% " + key + " %}"
+        return "".join(segments)
+
+    def render_iter(self, data=None):
+        """
+        埋め込み箇所にデータを埋め込んだHTMLを少しずつ生成するジェネレータ
+
+        埋め込むデータには文字列の他に、文字列を生成するイテラブル (ジェネレータなど) も指定できる
+
+        Args:
+            data (dict, optional): 埋め込み箇所のキーと埋め込む文字列 (またはイテラブル) の辞書
+
+        Yields:
+            str: HTMLの断片
+        """
+        if data is None:
+            data = {}
+        for index, segment in enumerate(self.segments):
+            if index % 2 == 0:
+                if segment:
+                    yield segment
+            elif segment not in data:
+                yield "{% " + segment + " %}"
+            elif isinstance(data[segment], str):
+                yield data[segment]
+            else:
+                yield from data[segment]
+
+
+class TemplateLoader:
+    """
+    テンプレートファイルを1度だけ読み込んで保持する
+
+    auto_reloadがTrueの場合は、ファイルの更新時刻が変わったときに読み込み直す (開発用).
+    url_forを指定した場合は、読み込み時にサイト内のURLをurl_forで変換したURLに書き換える
+    """
+
+    def __init__(self, auto_reload=False, url_for=None):
+        """
+        Args:
+            auto_reload (bool, optional): ファイルの更新を検知して読み込み直すかどうか
+            url_for (callable, optional): サイト内のURLを書き換える関数 (静的ファイルのハッシュ付きのURLなど)
+        """
+        self.auto_reload = auto_reload
+        self.url_for = url_for
+        self._templates = {}  # ファイル名 -> (Template, 更新時刻)
+        self._lock = threading.Lock()
+
+    def _load(self, filename) -> Template:
+        """
+        テンプレートファイルを読み込んでキャッシュする
+
+        Args:
+            filename (str): テンプレートのファイル名
+
+        Returns:
+            Template: 読み込んだテンプレート
+        """
+        mtime = os.stat(filename).st_mtime_ns
+        with open(filename, "r", encoding="utf-8") as file:
+            html = file.read()
+        if self.url_for is not None:
+            html = LOCAL_URL_PATTERN.sub(
+                lambda match: f'{match.group(1)}="{self.url_for(match.group(2))}"',
+                html,
+            )
+        template = Template(html)
+        with self._lock:
+            self._templates[filename] = (template, mtime)
+        return template
+
+    def get(self, filename) -> Template:
+        """
+        テンプレートを取得 (初回のみファイルから読み込む)
+
+        Args:
+            filename (str): テンプレートのファイル名
+
+        Returns:
+            Template: テンプレート
+        """
+        entry = self._templates.get(filename)
+        if entry is None:
+            return self._load(filename)
+        template, mtime = entry
+        if self.auto_reload and os.stat(filename).st_mtime_ns != mtime:
+            return self._load(filename)
+        return template
+
+    def digest(self) -> str:
+        """
+        読み込んだすべてのテンプレートの内容から求めたハッシュ
+
+        Returns:
+            str: ハッシュ (テンプレートのどれかが変わると変わる)
+        """
+        with self._lock:
+            entries = sorted(self._templates.items())
+        parts = [f"{filename}:{template.digest}" for filename, (template, _) in entries]
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()[:12]
+
+    def preload(self, filenames) -> None:
+        """
+        複数のテンプレートをまとめて読み込む (起動時に使用)
+
+        Args:
+            filenames (list): テンプレートのファイル名のリスト
+        """
+        for filename in filenames:
+            self._load(filename)
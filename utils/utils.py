@@ -2,6 +2,24 @@
 
 """ユーティリティ関数"""
 
+import unicodedata
+from bisect import bisect_left
+from itertools import repeat
+from operator import mul, truediv
+
+# カタカナ (ァ～ヶ) をひらがなに変換する表
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(0x30A1, 0x30F7)}
+
+# 達成率の色分けの境界 (0%, 0.10%以下, 1.00%以下, それより上) と対応するクラス
+# bisect_leftで境界の値はそれ以下の側に分類される
+ACHIEVER_RATE_BOUNDS = [0, 0.10, 1.00]
+ACHIEVER_RATE_CLASSES = [
+    "achiever_rate_zero",
+    "achiever_rate_very_rare",
+    "achiever_rate_rare",
+    "achiever_rate_common",
+]
+
 
 def load_html(filename) -> str:
     """
@@ -18,6 +36,35 @@ def load_html(filename) -> str:
     return html
 
 
+def encode_chunks(chunks, min_size=16384):
+    """
+    文字列の断片をUTF-8にエンコードし、ある程度の大きさにまとめて返すジェネレータ
+
+    Args:
+        chunks (Iterable[str]): 文字列の断片
+        min_size (int, optional): まとめて返す最小の文字数
+
+    Yields:
+        bytes: エンコードした断片
+    """
+    buffer = []
+    buffer_size = 0
+    try:
+        for chunk in chunks:
+            buffer.append(chunk)
+            buffer_size += len(chunk)
+            if buffer_size >= min_size:
+                yield "".join(buffer).encode("utf-8")
+                buffer = []
+                buffer_size = 0
+        if buffer:
+            yield "".join(buffer).encode("utf-8")
+    finally:
+        # 送信が途中で中断された場合も元のイテレータを閉じる (借りている接続を返すため)
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
 def create_placeholder(key) -> str:
     """
     SQL文作成のためのプレースホルダを生成
@@ -31,6 +78,23 @@ def create_placeholder(key) -> str:
     return ",".join(["?" for _ in range(len(key))])
 
 
+def normalize_text(text) -> str:
+    """
+    検索用に文字列を正規化する (全角・半角の統一, カタカナをひらがなに変換, 小文字に変換)
+
+    Args:
+        text (str): 正規化する文字列
+
+    Returns:
+        str: 正規化した文字列 (Noneの場合は空文字列)
+    """
+    if text is None:
+        return ""
+    # NFKCで全角英数字は半角に、半角カナは全角カナになる
+    text = unicodedata.normalize("NFKC", text)
+    return text.translate(_KATAKANA_TO_HIRAGANA).lower()
+
+
 def calculate_deviation(score, avg_score, sd_score) -> float:
     """
     偏差値を計算する
@@ -49,7 +113,7 @@ def calculate_deviation(score, avg_score, sd_score) -> float:
     return deviation_value
 
 
-def _validate_ss_score(ss_score) -> tuple:
+def validate_ss_score(ss_score) -> tuple:
     """
     偏差値計算に用いるスコアのバリデーションを行う
 
@@ -101,7 +165,7 @@ def validate_score(ss_score, sd_score):
         tuple: バリデーションの結果とエラーメッセージ
     """
     # スコアが正しいかどうかを確認
-    is_valid, error_message = _validate_ss_score(ss_score)
+    is_valid, error_message = validate_ss_score(ss_score)
     if not is_valid:
         return False, error_message
     # 標準偏差が正しいかどうかを確認
@@ -128,24 +192,45 @@ def calculate_achiever_rate(achiever_count, total_count) -> tuple:
     else:
         achiever_rate = round(achiever_count / total_count * 100, 3)
     # 達成者率ごとに色分け用のクラスを返す
-    if achiever_rate == 0:
-        achiever_class = "achiever_rate_zero"
-    elif achiever_rate <= 0.10:
-        achiever_class = "achiever_rate_very_rare"
-    elif achiever_rate <= 1.00:
-        achiever_class = "achiever_rate_rare"
-    else:
-        achiever_class = "achiever_rate_common"
+    achiever_class = ACHIEVER_RATE_CLASSES[
+        bisect_left(ACHIEVER_RATE_BOUNDS, achiever_rate)
+    ]
     return achiever_rate, achiever_class
 
 
-def print_sql(sql, values) -> None:
+def calculate_achiever_rates(achiever_counts, total_counts) -> tuple:
     """
-    実行したSQL文とプレースホルダに対応する値を表示
+    複数の行の達成率と色分け用のクラスをまとめて計算する (calculate_achiever_rateと同じ結果)
+
+    行ごとに関数を呼び出さず、組み込み関数のmapで列全体を一度に計算する
 
     Args:
-        sql (str): 実行したSQL文
-        values (list): プレースホルダに対応する値
-    """
-    print(f"\n実行したSQL文\n {sql}\n")
-    print("プレースホルダ\n" + str(values) + "\n")
+        achiever_counts (Iterable[int]): 各行の達成者数
+        total_counts (Iterable[int]): 各行の総数
+
+    Returns:
+        tuple (list, list): 達成率のリストと色分け用のクラスのリスト
+    """
+    achiever_counts = list(map(int, achiever_counts))
+    total_counts = list(map(int, total_counts))
+    if 0 in total_counts:
+        # 総数が0の行は達成率を0とする
+        achiever_rates = [
+            round(achiever / total * 100, 3) if total else 0.0
+            for achiever, total in zip(achiever_counts, total_counts)
+        ]
+    else:
+        achiever_rates = list(
+            map(
+                round,
+                map(mul, map(truediv, achiever_counts, total_counts), repeat(100)),
+                repeat(3),
+            )
+        )
+    achiever_classes = list(
+        map(
+            ACHIEVER_RATE_CLASSES.__getitem__,
+            map(bisect_left, repeat(ACHIEVER_RATE_BOUNDS), achiever_rates),
+        )
+    )
+    return achiever_rates, achiever_classes